@@ -1,25 +1,57 @@
 from flask_swagger_ui import get_swaggerui_blueprint
-from flask import Flask, render_template, request, redirect, jsonify, send_from_directory, url_for, session, flash
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required
+from flask import Flask, render_template, request, redirect, jsonify, send_from_directory, url_for, session, flash, abort
+from flask import Response, Request, stream_with_context
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, verify_jwt_in_request, get_jwt_identity
+from flask import g
 from werkzeug.utils import secure_filename
-import os, json, bcrypt, pandas as pd
+import os, io, re, gc, time, base64, fcntl, tempfile, cProfile, pstats, bcrypt, pandas as pd
 from pathlib import Path
 
 from data_handler import (
-    save_uploaded_file, get_last_dataframe,
-    save_yelp_business_json, save_yelp_review_json,
-    get_business_from_db, get_review_from_db   # 👈 añadido
+    save_uploaded_file, get_last_dataframe, preload_snapshots, migrate,
+    stream_yelp_business_json, stream_yelp_review_json,
+    get_business_categories, get_review_from_db, dataset_version,
+    update_review_sentiment,
+    update_review_topics, get_topic_counts, iter_review_text, get_markers,
+    get_category_aggregates, page_category_aggregates, iter_category_aggregates,
+    page_frame_aggregates, iter_frame_aggregates,
+    get_monthly_trends, get_review_totals, get_sample, get_review_summary,
+    search_reviews, upload_is_current, save_named_dataset, named_dataset_is_current,
+    list_named_datasets, named_dataset_version, get_named_dataframe, DATASET_NAME_RE
 )
-from models import analyze_opportunities
-from demand_analysis import analyze_reviews_from_df
+from models import (
+    analyze_opportunities, opportunity_report, with_opportunity, gap_analysis, gap_from_aggregates,
+    gap_report, sample_opportunities, category_pairs, aggregate_categories, business_reviews,
+    OPPORTUNITY_COLUMNS
+)
+from demand_analysis import (
+    polarity_scores, update_topic_model, stored_topics,
+    term_frequencies, render_wordcloud_png, sample_demand
+)
+from sampling import CONFIDENCE
+import result_cache
+import jobs
+import history_store
+import upload_store
+import metrics
+from db_handler import is_busy
+from sqlalchemy.exc import OperationalError
 
 BASE_DIR = os.path.dirname(__file__)
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 STORAGE = Path(__file__).parent / 'storage'
 STORAGE.mkdir(exist_ok=True)
+WORDCLOUD_DIR = STORAGE / 'wordcloud'
+
+class UploadRequest(Request):
+    # cada archivo de un multipart se escribe directo en uploads/ calculando su SHA-256
+    # (ver upload_store), en lugar de un temporal que después se copia
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_store.HashingFile()
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['JWT_SECRET_KEY'] = 'cambiame_por_una_clave_segura'
 app.secret_key = 'cambiame_por_otra_clave_segura'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -68,7 +100,63 @@ def logout():
     flash('Sesión cerrada', 'info')
     return redirect(url_for('index'))
 
-# 🚀 Subida de múltiples archivos
+def ingest_file(file_path, filename, mode, content_hash=None, dataset=None):
+    """Devuelve la función que procesa el archivo en segundo plano según su tipo (o que lo
+    guarda en el dataset con nombre dataset). Si el mismo contenido ya es lo último cargado (y
+    cargarlo de nuevo no cambia nada) se omite."""
+    lower = filename.lower()
+
+    def run(progress):
+        if dataset:
+            if content_hash and named_dataset_is_current(dataset, filename, content_hash, mode):
+                return {'rows': 0, 'message': f"Archivo {filename} sin cambios en el dataset {dataset}."}
+            df = save_named_dataset(dataset, file_path, mode=mode, content_hash=content_hash)
+            return {'rows': len(df), 'message': f"Archivo {filename} guardado en el dataset {dataset}."}
+        if content_hash and upload_is_current(filename, content_hash, mode):
+            return {'rows': 0, 'message': f"Archivo {filename} sin cambios: el mismo contenido ya estaba cargado."}
+        if lower.endswith('.json') and 'business' in lower:
+            stats = stream_yelp_business_json(file_path, mode=mode, progress=progress, content_hash=content_hash)
+            return {'rows': stats['rows'], 'message': f"Archivo {filename} (business) procesado correctamente."}
+        if lower.endswith('.json') and 'review' in lower:
+            stats = stream_yelp_review_json(file_path, mode=mode, progress=progress, content_hash=content_hash)
+            # el sentimiento y el tópico de las reseñas nuevas se calculan aquí (en segundo plano);
+            # las vistas de demanda solo leen lo guardado
+            update_review_sentiment(polarity_scores)
+            update_review_topics(update_topic_model)
+            # lo que se haya calculado mientras se puntuaba tiene sentimiento y tópicos incompletos
+            result_cache.invalidate()
+            # la nube de palabras de la nueva versión queda lista antes de que alguien la pida; si
+            # falla, los datos ya están cargados y la vista la vuelve a intentar
+            try:
+                wordcloud_file()
+            except Exception:
+                app.logger.exception('wordcloud rendering failed')
+            return {'rows': stats['rows'], 'message': f"Archivo {filename} (review) procesado correctamente."}
+        df = save_uploaded_file(file_path, mode=mode, content_hash=content_hash)
+        return {'rows': len(df), 'message': f"Archivo {filename} procesado correctamente."}
+
+    return run
+
+def enqueue_uploads(files, mode, dataset=None):
+    """Guarda los archivos por contenido y encola su procesamiento (en el dataset con nombre
+    dataset, si se indica); devuelve los ids de trabajo y el SHA-256 de cada archivo."""
+    job_ids, hashes = [], []
+    for f in files:
+        hashed = isinstance(getattr(f, 'stream', None), upload_store.HashingFile)
+        if not f or f.filename == "":
+            if hashed:
+                upload_store.discard(f.stream)
+            continue
+        filename = secure_filename(f.filename)
+        if hashed:
+            file_path, digest = upload_store.commit(f.stream, filename)
+        else:
+            file_path, digest = upload_store.save_stream(f.stream, filename)
+        job_ids.append(jobs.submit(filename, ingest_file(str(file_path), filename, mode, digest, dataset)))
+        hashes.append(digest)
+    return job_ids, hashes
+
+# 🚀 Subida de múltiples archivos (se procesan en segundo plano)
 @app.route('/upload', methods=['GET','POST'])
 def upload_page():
     if 'user' not in session:
@@ -80,31 +168,99 @@ def upload_page():
             flash("⚠️ No se seleccionó ningún archivo", "danger")
             return redirect(url_for('upload_page'))
 
-        for f in files:
-            if not f or f.filename == "":
-                continue
+        # Por defecto los datos nuevos se agregan/actualizan (upsert) sobre los existentes
+        mode = 'replace' if request.form.get('replace') else 'upsert'
+        dataset = request.form.get('dataset', '').strip() or None
+        if dataset and not DATASET_NAME_RE.match(dataset):
+            flash("⚠️ Nombre de dataset inválido: usa letras, números, '-' o '_' (máximo 64)", "danger")
+            return redirect(url_for('upload_page'))
+        job_ids, _ = enqueue_uploads(files, mode, dataset)
+        if job_ids:
+            flash(f"⏳ {len(job_ids)} archivo(s) en cola de procesamiento.", "info")
+        return redirect(url_for('upload_page', jobs=','.join(job_ids)))
 
-            filename = secure_filename(f.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            f.save(file_path)
+    job_ids = [j for j in request.args.get('jobs', '').split(',') if j]
+    return render_template('upload.html', job_ids=job_ids)
 
-            try:
-                lower = filename.lower()
-                if lower.endswith('.json') and 'business' in lower:
-                    save_yelp_business_json(file_path)
-                    flash(f"✅ Archivo {filename} (business) procesado correctamente.", "success")
-                elif lower.endswith('.json') and 'review' in lower:
-                    save_yelp_review_json(file_path)
-                    flash(f"✅ Archivo {filename} (review) procesado correctamente.", "success")
-                else:
-                    save_uploaded_file(file_path)
-                    flash(f"✅ Archivo {filename} procesado correctamente.", "success")
-            except Exception as e:
-                flash(f"❌ Error al procesar {filename}: {str(e)}", "danger")
-
-        return redirect(url_for('upload_page'))
-
-    return render_template('upload.html')
+@app.route('/api/upload', methods=['POST'])
+@jwt_required()
+def api_upload():
+    files = request.files.getlist('file')
+    mode = 'replace' if request.form.get('replace') else 'upsert'
+    dataset = request.form.get('dataset') or None
+    if dataset and not DATASET_NAME_RE.match(dataset):
+        return jsonify({'msg':'dataset name must be 1-64 letters, digits, "-" or "_"'}), 400
+    job_ids, hashes = enqueue_uploads(files, mode, dataset)
+    if not job_ids:
+        return jsonify({'msg':'no file uploaded'}), 400
+    return jsonify({'jobs': [url_for('api_job', job_id=j) for j in job_ids], 'job_ids': job_ids, 'sha256': hashes}), 202
+
+# Carga por partes y reanudable (archivos Yelp de varios GB): POST crea la carga, cada PATCH
+# envía los bytes siguientes (cuerpo sin multipart, cabecera Upload-Offset) y POST .../complete
+# la guarda por contenido y la encola. GET devuelve el offset desde el cual reanudar.
+@app.route('/api/uploads', methods=['POST'])
+@jwt_required()
+def api_upload_start():
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    if not filename:
+        return jsonify({'msg':'filename is required'}), 400
+    size = data.get('size')
+    if size is not None and (not isinstance(size, int) or size < 0):
+        return jsonify({'msg':'size must be a non-negative integer'}), 400
+    upload_id = upload_store.start(filename, size)
+    return jsonify(dict(upload_store.status(upload_id), url=url_for('api_upload_part', upload_id=upload_id))), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@jwt_required()
+def api_upload_status(upload_id):
+    info = upload_store.status(upload_id)
+    if info is None:
+        return jsonify({'msg':'upload not found'}), 404
+    return jsonify(info)
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+@jwt_required()
+def api_upload_part(upload_id):
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'msg':'Upload-Offset header is required'}), 400
+    try:
+        written = upload_store.append(upload_id, offset, request.stream)
+    except KeyError:
+        return jsonify({'msg':'upload not found'}), 404
+    except ValueError as e:
+        info = upload_store.status(upload_id)
+        return jsonify({'msg': str(e), 'offset': info['offset'] if info else None}), 409
+    return jsonify({'upload_id': upload_id, 'offset': written})
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@jwt_required()
+def api_upload_complete(upload_id):
+    data = request.get_json(silent=True) or request.form
+    mode = 'replace' if data.get('replace') else 'upsert'
+    dataset = data.get('dataset') or None
+    if dataset and not DATASET_NAME_RE.match(str(dataset)):
+        return jsonify({'msg':'dataset name must be 1-64 letters, digits, "-" or "_"'}), 400
+    try:
+        file_path, digest, filename = upload_store.finish(upload_id)
+    except KeyError:
+        return jsonify({'msg':'upload not found'}), 404
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 409
+    job_id = jobs.submit(filename, ingest_file(str(file_path), filename, mode, digest, dataset))
+    return jsonify({'jobs': [url_for('api_job', job_id=job_id)], 'job_ids': [job_id], 'sha256': [digest]}), 202
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    # la página de carga consulta con la sesión; los clientes de la API con JWT
+    if not require_login_browser():
+        verify_jwt_in_request()
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({'msg':'job not found'}), 404
+    return jsonify(job)
 
 @app.route('/api/login', methods=['POST'])
 def api_login():
@@ -119,24 +275,347 @@ def api_login():
 def require_login_browser():
     return 'user' in session
 
+# Una carga en curso tiene el lock de escritura de SQLite hasta que termina: las peticiones que
+# necesitan escribir (p. ej. crear una tabla que falta) responden "ocupado" en vez de "sin datos"
+@app.errorhandler(OperationalError)
+def database_busy(e):
+    if not is_busy(e):
+        raise e
+    if request.path.startswith('/api/'):
+        return jsonify({'msg':'database busy: a data load is in progress, try again later'}), 503, {'Retry-After': '5'}
+    return "Hay una carga de datos en curso; intenta de nuevo en unos segundos.", 503, {'Retry-After': '5'}
+
+def is_admin():
+    if session.get('role') == 'admin':
+        return True
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        return False
+    return isinstance(identity, dict) and identity.get('role') == 'admin'
+
+# Latencia por ruta y perfil opcional por petición (?profile=1, solo administradores):
+# la respuesta se reemplaza por el desglose de etapas y las funciones más costosas (cProfile)
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.profiler = None
+    if request.args.get('profile') == '1' and is_admin():
+        metrics.start_trace()
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe(
+        'dss_request_seconds', elapsed, metrics.REQUEST_BUCKETS,
+        route=route, method=request.method, status=response.status_code
+    )
+    profiler = g.get('profiler')
+    if profiler is None:
+        return response
+    profiler.disable()
+    g.profiler = None
+    out = io.StringIO()
+    out.write(f"{request.method} {request.full_path} -> {response.status_code} en {elapsed:.3f} s\n\n")
+    out.write("Etapas:\n")
+    for st in metrics.stop_trace():
+        out.write(f"  {st['stage']:<28} {st['seconds']:>9.3f} s  filas={st['rows'] or '-'}  rss={st['rss_mb']} MB (+{st['rss_growth_mb']} MB)\n")
+    out.write("\n")
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+    return Response(out.getvalue(), mimetype='text/plain')
+
+# Métricas en formato Prometheus; con DSS_METRICS_TOKEN definido se exige "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get('DSS_METRICS_TOKEN')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Resultados de análisis (en caché por versión del dataset; None si no hay datos)
+def opportunities_result(include_markers=False, source='last'):
+    if source == 'db':
+        # índice de oportunidad sobre toda la tabla business, agregado en SQLite
+        agg = get_category_aggregates()
+        if agg is None or agg.empty:
+            return None
+        table_html, summary = opportunity_report(agg.drop(columns=['reviews']))
+        return table_html, summary, []
+    df = get_last_dataframe(columns=OPPORTUNITY_COLUMNS)
+    if df is None:
+        return None
+    return analyze_opportunities(df, include_markers=include_markers)
+
+def named_opportunities_result(name):
+    df = get_named_dataframe(name, 'business', columns=OPPORTUNITY_COLUMNS)
+    if df is None:
+        return None
+    table_html, summary, _ = analyze_opportunities(df)
+    return table_html, summary
+
+def named_analysis_response(name):
+    try:
+        version = named_dataset_version(name)
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+    result = version and result_cache.cached('named_analysis', version, lambda: named_opportunities_result(name), params={'dataset': name})
+    if not result:
+        return jsonify({'msg':'dataset not found or without businesses'}), 404
+    table_html, summary = result
+    return jsonify({'dataset': name, 'summary': summary, 'table_html': table_html})
+
+def demand_result():
+    try:
+        # polaridad y tópicos ya calculados en la ingesta (ver ingest_file)
+        # serie mensual y sentimiento promedio desde los agregados (sin recorrer review)
+        totals = get_review_totals()
+        trends = get_monthly_trends()
+    except Exception as e:
+        if is_busy(e):
+            raise
+        return None
+    if totals['reviews'] == 0:
+        return None
+    return {
+        'avg_sentiment': float(totals['avg_sentiment'] or 0.0),
+        'time_series': dict(zip(trends['month'], trends['reviews'].astype(int).tolist())),
+        'topics': stored_topics()
+    }
+
+# Modo aproximado (?sample=1): resultados sobre la muestra aleatoria guardada en la ingesta
+def sample_requested():
+    return request.args.get('sample') == '1'
+
+def opportunities_sample_result():
+    sample, population = get_sample('business', ['business_id', 'categories', 'review_count'])
+    if sample.empty:
+        return None
+    est = sample_opportunities(sample, population)
+    return {
+        'categories': est.astype(object).where(est.notna(), None).to_dict(orient='records'),
+        'sample': {'rows': len(sample), 'population': int(population.sum()), 'confidence': CONFIDENCE}
+    }
+
+def demand_sample_result():
+    sample, population = get_sample('review', ['text', 'date'], derived={'review_sentiment': ['polarity']})
+    if sample.empty:
+        return None
+    return dict(sample_demand(sample, population), topics=stored_topics())
+
+def wordcloud_file():
+    """PNG de la nube de palabras de la versión actual del dataset (se genera una sola vez: la
+    carga de reseñas la deja lista; si falta, el primer worker que la pide la genera y el resto
+    espera el lock)."""
+    fp = WORDCLOUD_DIR / f'{dataset_version()}.png'
+    if fp.exists():
+        return fp
+    WORDCLOUD_DIR.mkdir(exist_ok=True)
+    with open(WORDCLOUD_DIR / '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if fp.exists():
+                return fp
+            png = render_wordcloud_png(term_frequencies(iter_review_text()))
+            with tempfile.NamedTemporaryFile(dir=WORDCLOUD_DIR, suffix='.tmp', delete=False) as tmp:
+                tmp.write(png)
+            os.replace(tmp.name, fp)
+            for old in [*WORDCLOUD_DIR.glob('*.png'), *WORDCLOUD_DIR.glob('*.tmp')]:
+                if old != fp:
+                    old.unlink(missing_ok=True)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return fp
+
+# Dónde se agregan oferta/demanda: 'sql' (GROUP BY en SQLite) o 'pandas'
+AGGREGATION_MODE = os.environ.get('DSS_AGGREGATION', 'sql')
+
+def gap_result():
+    if AGGREGATION_MODE == 'sql':
+        try:
+            agg = get_category_aggregates()
+        except Exception as e:
+            if is_busy(e):
+                raise
+            return None
+        if agg is None or agg.empty:
+            return None
+        return gap_from_aggregates(agg['category'], agg['businesses_count'], agg['reviews'])
+    try:
+        pairs, names = get_business_categories()
+        rdf = get_review_from_db(columns=['business_id'])
+    except Exception as e:
+        if is_busy(e):
+            raise
+        return None
+    if pairs.empty or rdf is None or rdf.empty:
+        return None
+    return gap_analysis(pairs, names, rdf)
+
+# Paginación, filtros y streaming NDJSON de las APIs por categoría.
+# /api/gap se resuelve en SQLite sobre toda la base; /api/analysis usa la misma fuente que sin
+# paginar (source=last: el último archivo subido, agregado en pandas; source=db: SQLite).
+CATEGORY_QUERY_ARGS = ('limit', 'cursor', 'city', 'category', 'min_reviews', 'format')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+def category_query():
+    """Parámetros de consulta por categoría, o None si no se pidió ninguno.
+    Lanza ValueError si alguno no es válido."""
+    if not any(a in request.args for a in CATEGORY_QUERY_ARGS):
+        return None
+    fmt = request.args.get('format', 'json')
+    if fmt not in ('json', 'ndjson'):
+        raise ValueError('format must be json or ndjson')
+    limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    min_reviews = request.args.get('min_reviews')
+    return {
+        'format': fmt,
+        'limit': limit,
+        'cursor': request.args.get('cursor'),
+        'filters': {
+            'city': request.args.get('city'),
+            'category': request.args.get('category'),
+            'min_reviews': int(min_reviews) if min_reviews is not None else None
+        }
+    }
+
+def last_category_aggregates(city=None, category=None, min_reviews=None):
+    """Categorías agregadas del último archivo subido (category, businesses_count, avg_reviews,
+    total_reviews) con los filtros de la consulta paginada; None si no hay archivo."""
+    df = get_last_dataframe(columns=OPPORTUNITY_COLUMNS)
+    if df is None or 'categories' not in df.columns:
+        return None
+    reviews = business_reviews(df)
+    keep = pd.Series(True, index=df.index)
+    if city:
+        cities = df['city'].astype(str) if 'city' in df.columns else pd.Series('', index=df.index)
+        keep &= cities.str.casefold() == city.casefold()
+    if min_reviews is not None:
+        keep &= reviews >= min_reviews
+    grouped = aggregate_categories(*category_pairs(df[keep], reviews[keep]))
+    if category:
+        grouped = grouped[grouped['category'].str.casefold() == category.casefold()]
+    return grouped.reset_index(drop=True)
+
+def category_response(query, order, to_rows, key):
+    """Página JSON ({key: [...], next_cursor}) o stream NDJSON de las categorías agregadas.
+    to_rows transforma cada lote de agregados en las columnas de la respuesta."""
+    if query['format'] == 'ndjson':
+        def generate():
+            for chunk in iter_category_aggregates(order=order, **query['filters']):
+                yield to_rows(chunk).to_json(orient='records', lines=True)
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    try:
+        page, next_cursor = page_category_aggregates(
+            order=order, cursor=query['cursor'], limit=query['limit'], **query['filters']
+        )
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+    if page is None:
+        return jsonify({'msg':'missing data in database'}), 400
+    return jsonify({key: to_rows(page).to_dict(orient='records'), 'next_cursor': next_cursor})
+
+def frame_category_response(query, order, to_rows, key, grouped):
+    """Como category_response, sobre categorías ya agregadas y filtradas en un DataFrame."""
+    if grouped is None:
+        return jsonify({'msg':'no data uploaded'}), 400
+    if query['format'] == 'ndjson':
+        def generate():
+            for chunk in iter_frame_aggregates(grouped, order=order):
+                yield to_rows(chunk).to_json(orient='records', lines=True)
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    try:
+        page, next_cursor = page_frame_aggregates(grouped, order=order, cursor=query['cursor'], limit=query['limit'])
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+    return jsonify({key: to_rows(page).to_dict(orient='records'), 'next_cursor': next_cursor})
+
+def gap_rows(agg):
+    return gap_from_aggregates(agg['category'], agg['businesses_count'], agg['reviews'], sort=False)
+
+def opportunity_rows(agg):
+    return with_opportunity(agg.drop(columns=['reviews'], errors='ignore'))
+
 @app.route('/analysis')
 def analysis_page():
     if not require_login_browser():
         return redirect(url_for('login_page'))
-    df = get_last_dataframe()
-    if df is None:
+    result = result_cache.cached('analysis', dataset_version(), opportunities_result)
+    if result is None:
         return render_template('analysis.html', error='No hay datos cargados todavía.')
-    table_html, summary, markers = analyze_opportunities(df, include_markers=True)
-    return render_template('analysis.html', table_html=table_html, summary=summary, markers=json.dumps(markers))
+    table_html, summary, _ = result
+    return render_template('analysis.html', table_html=table_html, summary=summary)
+
+@app.route('/api/datasets')
+@jwt_required()
+def api_datasets():
+    # datasets con nombre (ver batch_reports.py) con su versión de contenido
+    return jsonify({
+        name: {'version': named_dataset_version(name), 'files': manifest}
+        for name, manifest in list_named_datasets().items()
+    })
 
 @app.route('/api/analysis')
 @jwt_required()
 def api_analysis():
-    df = get_last_dataframe()
-    if df is None:
+    # ?dataset=<nombre> analiza un dataset con nombre en vez del último archivo subido
+    if request.args.get('dataset'):
+        return named_analysis_response(request.args['dataset'])
+    if sample_requested():
+        result = result_cache.cached('analysis', dataset_version(), opportunities_sample_result, params={'sample': True})
+        if result is None:
+            return jsonify({'msg':'no data in database'}), 400
+        return jsonify(result)
+    try:
+        query = category_query()
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+    # source=db calcula sobre toda la base (SQL) en vez del último archivo subido
+    source = request.args.get('source', 'last')
+    if query is not None:
+        if source == 'db':
+            return category_response(query, 'opportunity', opportunity_rows, 'categories')
+        # agregados del último archivo en caché por versión y filtros; las páginas solo los recorren
+        grouped = result_cache.cached(
+            'analysis', dataset_version(), lambda: last_category_aggregates(**query['filters']),
+            params={'aggregates': query['filters']}
+        )
+        return frame_category_response(query, 'opportunity', opportunity_rows, 'categories', grouped)
+    # la lista completa de marcadores solo se incluye con ?markers=1; el mapa usa /api/markers
+    include_markers = request.args.get('markers') == '1'
+    result = result_cache.cached(
+        'analysis', dataset_version(), lambda: opportunities_result(include_markers, source),
+        params={'markers': include_markers, 'source': source}
+    )
+    if result is None:
         return jsonify({'msg':'no data uploaded'}), 400
-    table_html, summary, markers = analyze_opportunities(df, include_markers=True)
-    return jsonify({'summary': summary, 'table_html': table_html, 'markers': markers})
+    table_html, summary, markers = result
+    return jsonify({
+        'summary': summary, 'table_html': table_html, 'markers': markers,
+        'markers_url': url_for('api_markers')
+    })
+
+@app.route('/api/markers')
+def api_markers():
+    # la página de análisis consulta con la sesión; los clientes de la API con JWT
+    if not require_login_browser():
+        verify_jwt_in_request()
+    try:
+        zoom = int(request.args.get('zoom', 0))
+        bbox = request.args.get('bbox')
+        bbox = [float(v) for v in bbox.split(',')] if bbox else None
+        if bbox is not None and len(bbox) != 4:
+            raise ValueError
+    except ValueError:
+        return jsonify({'msg':'bbox must be west,south,east,north and zoom an integer'}), 400
+    return jsonify(get_markers(bbox=bbox, zoom=zoom))
 
 # Demand analysis UI
 @app.route('/demand')
@@ -144,83 +623,42 @@ def demand_page():
     if not require_login_browser():
         return redirect(url_for('login_page'))
 
-    try:
-        df = get_review_from_db()
-    except Exception:
-        return render_template('demand.html', error='No se encontraron reseñas en la base de datos (sube review.json).')
-
-    if df is None or df.empty:
+    results = result_cache.cached('demand', dataset_version(), demand_result)
+    if results is None:
         return render_template('demand.html', error='No se encontraron reseñas en la base de datos (sube review.json).')
 
-    results = analyze_reviews_from_df(df)
     return render_template(
         'demand.html',
-        wordcloud=results['wordcloud_b64'],
+        wordcloud_url=url_for('wordcloud_png', v=dataset_version()),
         avg_sentiment=results['avg_sentiment'],
         time_series=results['time_series'],
         topics=results['topics']
     )
 
+# Nube de palabras como recurso estático en caché (la URL cambia con la versión del dataset)
+@app.route('/demand/wordcloud.png')
+def wordcloud_png():
+    if not require_login_browser():
+        return redirect(url_for('login_page'))
+    try:
+        fp = wordcloud_file()
+    except Exception as e:
+        if is_busy(e):
+            raise
+        abort(404)
+    return send_from_directory(str(fp.parent), fp.name, mimetype='image/png', max_age=31536000)
+
 # Gap analysis UI
 @app.route('/gap')
 def gap_page():
     if not require_login_browser():
         return redirect(url_for('login_page'))
 
-    try:
-        bdf = get_business_from_db()
-        rdf = get_review_from_db()
-    except Exception:
-        return render_template('gap.html', error='No hay datos en la base de datos (sube business.json y review.json).')
-
-    if bdf is None or rdf is None or bdf.empty or rdf.empty:
+    gap = result_cache.cached('gap', dataset_version(), gap_result)
+    if gap is None:
         return render_template('gap.html', error='No hay datos en la base de datos (sube business.json y review.json).')
 
-    # 🔹 Explota categorías
-    s = bdf['categories'].fillna('').str.split(',').apply(lambda xs: [x.strip() for x in xs if x.strip()])
-    exploded = bdf.assign(category_list=s).explode('category_list')
-
-    # 🔹 Oferta
-    cat_supply = exploded.groupby('category_list').agg(supply=('business_id','count')).reset_index()
-
-    # 🔹 Demanda
-    reviews_per_business = rdf.groupby('business_id').size().reset_index(name='reviews')
-    merged = exploded.merge(reviews_per_business, on='business_id', how='left').fillna({'reviews':0})
-    cat_demand = merged.groupby('category_list').agg(demand=('reviews','sum')).reset_index()
-
-    # 🔹 Brecha
-    gap = cat_supply.merge(cat_demand, on='category_list', how='outer').fillna(0)
-    gap['gap'] = gap['demand'] - gap['supply']
-
-    gap = gap.rename(columns={
-        'category_list': 'Categoría',
-        'supply': 'Cantidad de negocios (Oferta)',
-        'demand': 'Cantidad de reseñas (Demanda)',
-        'gap': 'Brecha (Demanda - Oferta)'
-    })
-
-    gap_sorted = gap.sort_values('Brecha (Demanda - Oferta)', ascending=False).head(10)
-
-    best_row = gap_sorted.iloc[0] if not gap_sorted.empty else None
-    recomendacion = "No hay datos suficientes para generar una recomendación."
-    if best_row is not None:
-        categoria = best_row["Categoría"]
-        oferta = int(best_row["Cantidad de negocios (Oferta)"])
-        demanda = int(best_row["Cantidad de reseñas (Demanda)"])
-        brecha = int(best_row["Brecha (Demanda - Oferta)"])
-        recomendacion = (
-            f"La categoría con mayor oportunidad es **{categoria}**. "
-            f"Actualmente existen {oferta} negocios frente a una demanda de {demanda} reseñas. "
-            f"Esto genera una brecha de {brecha}, lo que indica una oportunidad clara."
-        )
-
-    table_html = gap_sorted.to_html(
-        index=False,
-        classes="table table-striped table-hover table-bordered text-center"
-    )
-
-    chart_labels = gap_sorted["Categoría"].tolist()
-    chart_data = gap_sorted["Brecha (Demanda - Oferta)"].tolist()
+    table_html, recomendacion, chart_labels, chart_data = gap_report(gap)
 
     return render_template(
         'gap.html',
@@ -234,52 +672,161 @@ def gap_page():
 @app.route('/api/demand')
 @jwt_required()
 def api_demand():
+    if sample_requested():
+        results = result_cache.cached('demand', dataset_version(), demand_sample_result, params={'sample': True})
+        if results is None:
+            return jsonify({'msg':'no reviews in database'}), 400
+        return jsonify(results)
+    results = result_cache.cached('demand', dataset_version(), demand_result)
+    if results is None:
+        return jsonify({'msg':'no reviews in database'}), 400
     try:
-        df = get_review_from_db()
-    except Exception:
+        wordcloud_b64 = base64.b64encode(wordcloud_file().read_bytes()).decode('utf-8')
+    except Exception as e:
+        if is_busy(e):
+            raise
+        # el resto del análisis sigue siendo válido sin la imagen
+        app.logger.exception('wordcloud rendering failed')
+        wordcloud_b64 = None
+    return jsonify(dict(results, wordcloud_b64=wordcloud_b64))
+
+# API tópicos por negocio o categoría
+@app.route('/api/demand/topics')
+@jwt_required()
+def api_demand_topics():
+    business_id = request.args.get('business_id')
+    category = request.args.get('category')
+    try:
+        counts = get_topic_counts(business_id=business_id, category=category)
+    except Exception as e:
+        if is_busy(e):
+            raise
         return jsonify({'msg':'no reviews in database'}), 400
+    per_topic = dict(zip(counts['topic'], counts['reviews']))
+    topics = [dict(t, reviews=int(per_topic.get(t['topic'], 0))) for t in stored_topics()]
+    return jsonify({'business_id': business_id, 'category': category, 'topics': topics})
+
+# API tendencias mensuales (agregados por categoría y ciudad)
+MONTH_RE = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
 
-    if df is None or df.empty:
+@app.route('/api/demand/trends')
+def api_demand_trends():
+    # los gráficos de la UI consultan con la sesión; los clientes de la API con JWT
+    if not require_login_browser():
+        verify_jwt_in_request()
+    start, end = request.args.get('start'), request.args.get('end')
+    for value in (start, end):
+        if value and not MONTH_RE.match(value):
+            return jsonify({'msg':'start and end must be YYYY-MM'}), 400
+    category, city = request.args.get('category'), request.args.get('city')
+    trends = get_monthly_trends(start=start, end=end, category=category, city=city)
+    series = trends.astype(object).where(trends.notna(), None).to_dict(orient='records')
+    return jsonify({'start': start, 'end': end, 'category': category, 'city': city, 'series': series})
+
+# API resumen de reseñas (sketches combinables guardados en cada carga)
+MAX_SUMMARY_TOP = 100
+
+@app.route('/api/demand/summary')
+def api_demand_summary():
+    if not require_login_browser():
+        verify_jwt_in_request()
+    try:
+        top = int(request.args.get('top', 10))
+    except ValueError:
+        top = 0
+    if not 1 <= top <= MAX_SUMMARY_TOP:
+        return jsonify({'msg': f'top must be between 1 and {MAX_SUMMARY_TOP}'}), 400
+    category, city = request.args.get('category'), request.args.get('city')
+    summary = result_cache.cached(
+        'review_summary', dataset_version(), lambda: get_review_summary(top=top, category=category, city=city),
+        params={'top': top, 'category': category, 'city': city}
+    )
+    if summary is None:
         return jsonify({'msg':'no reviews in database'}), 400
+    return jsonify(summary)
+
+# API búsqueda de términos en las reseñas (índice de texto completo)
+MAX_SEARCH_TOP = 100
+MAX_SEARCH_SNIPPETS = 50
 
-    results = analyze_reviews_from_df(df)
-    return jsonify(results)
+@app.route('/api/demand/search')
+def api_demand_search():
+    if not require_login_browser():
+        verify_jwt_in_request()
+    q = request.args.get('q', '').strip()
+    try:
+        top = int(request.args.get('top', 20))
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'msg':'top and limit must be integers'}), 400
+    if not 1 <= top <= MAX_SEARCH_TOP:
+        return jsonify({'msg': f'top must be between 1 and {MAX_SEARCH_TOP}'}), 400
+    if not 0 <= limit <= MAX_SEARCH_SNIPPETS:
+        return jsonify({'msg': f'limit must be between 0 and {MAX_SEARCH_SNIPPETS}'}), 400
+    try:
+        result = result_cache.cached(
+            'review_search', dataset_version(), lambda: search_reviews(q, top=top, limit=limit),
+            params={'q': q, 'top': top, 'limit': limit}
+        )
+    except ValueError:
+        return jsonify({'msg':'q must contain at least one search term'}), 400
+    if result is None:
+        return jsonify({'msg':'search index not built yet: run python migrate.py or load reviews'}), 503
+    out = {'q': q, 'reviews': result['reviews']}
+    for name in ('categories', 'cities', 'months', 'snippets'):
+        df = result[name]
+        out[name] = df.astype(object).where(df.notna(), None).to_dict(orient='records')
+    return jsonify(out)
 
 # API gap
 @app.route('/api/gap')
 @jwt_required()
 def api_gap():
     try:
-        bdf = get_business_from_db()
-        rdf = get_review_from_db()
-    except Exception:
-        return jsonify({'msg':'missing data in database'}), 400
-
-    if bdf is None or rdf is None or bdf.empty or rdf.empty:
+        query = category_query()
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+    if query is not None:
+        return category_response(query, 'gap', gap_rows, 'gap')
+    gap = result_cache.cached('gap', dataset_version(), gap_result)
+    if gap is None:
         return jsonify({'msg':'missing data in database'}), 400
 
-    s = bdf['categories'].fillna('').str.split(',').apply(lambda xs: [x.strip() for x in xs if x.strip()])
-    exploded = bdf.assign(category_list=s).explode('category_list')
-
-    cat_supply = exploded.groupby('category_list').agg(supply=('business_id','count')).reset_index()
-
-    reviews_per_business = rdf.groupby('business_id').size().reset_index(name='reviews')
-    merged = exploded.merge(reviews_per_business, on='business_id', how='left').fillna({'reviews':0})
-    cat_demand = merged.groupby('category_list').agg(demand=('reviews','sum')).reset_index()
-
-    gap = cat_supply.merge(cat_demand, on='category_list', how='outer').fillna(0)
-    gap['gap'] = gap['demand'] - gap['supply']
-
-    out = gap.sort_values('gap', ascending=False).to_dict(orient='records')
+    out = gap.to_dict(orient='records')
     return jsonify({'gap': out})
 
-# Descarga del histórico
+# Descarga del histórico: format=xlsx (por defecto, generado solo si cambió), csv o parquet (ZIP) en streaming
 @app.route('/download/history')
 def download_history():
-    fp = STORAGE / 'all_data.xlsx'
-    if fp.exists():
-        return send_from_directory(str(fp.parent), fp.name, as_attachment=True)
-    return redirect(url_for('index'))
+    if not history_store.entries():
+        return redirect(url_for('index'))
+    fmt = request.args.get('format', 'xlsx')
+    if fmt == 'csv':
+        return Response(
+            stream_with_context(history_store.iter_csv()), mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=history.csv'}
+        )
+    if fmt == 'parquet':
+        return Response(
+            stream_with_context(history_store.iter_parquet_zip()), mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=history_parquet.zip'}
+        )
+    if fmt == 'xlsx':
+        fp = history_store.export_xlsx()
+        return send_from_directory(str(fp.parent), fp.name, as_attachment=True, download_name='all_data.xlsx')
+    abort(400)
+
+# Tablas y derivados que falten en una base anterior (ver migrate.py, que en producción corre
+# antes como paso release): se construyen al iniciar, no en la primera consulta. Con --preload
+# corre una sola vez en el proceso maestro, antes de crear los workers.
+migrate()
+
+# Modo preload (DSS_PRELOAD=1 con gunicorn --preload): los snapshots se leen una vez en el
+# proceso maestro y los workers los heredan copy-on-write. gc.freeze() evita que el recolector
+# de basura de cada worker toque esos objetos y fuerce la copia de sus páginas.
+if os.environ.get('DSS_PRELOAD') == '1':
+    preload_snapshots()
+    gc.freeze()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,165 @@
+# batch_reports.py
+# Reportes por lote de los datasets con nombre (ver data_handler, "Datasets con nombre"):
+# oportunidades, brecha y análisis de demanda de cada dataset, en paralelo con un pool de
+# procesos (un dataset por worker). Cada reporte queda en <out>/<dataset>/ (report.json,
+# opportunities.html, gap.html y wordcloud.png si hay reseñas con texto) y el resumen de la
+# corrida en <out>/index.json e index.html. Un dataset que falla no detiene a los demás.
+#
+# Uso:
+#   python batch_reports.py --add chile=uploads/ejemplo_negocios_chile.json \
+#                           --add colombia=uploads/ejemplo_negocios_colombia.json
+#   python batch_reports.py chile colombia --out storage/reports/hoy --workers 4
+import argparse, base64, html, json, os, sys, time, traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import pandas as pd
+
+import data_handler
+import demand_analysis
+import upload_store
+from models import (
+    analyze_opportunities, category_pairs, aggregate_categories, gap_analysis, gap_from_aggregates,
+    gap_report, OPPORTUNITY_COLUMNS
+)
+
+reports_dir = data_handler.storage / 'reports'
+
+# Workers por defecto (DSS_REPORT_WORKERS); cada uno procesa un dataset completo
+REPORT_WORKERS = int(os.environ.get('DSS_REPORT_WORKERS', os.cpu_count() or 1))
+
+def _init_worker():
+    # el paralelismo es entre datasets: dentro de cada worker la polaridad usa un solo proceso
+    demand_analysis.SENTIMENT_JOBS = 1
+
+def _write(path, text):
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    tmp.write_text(text, encoding='utf-8')
+    os.replace(tmp, path)
+
+def report_dataset(name, out_dir):
+    """Calcula y escribe los reportes de un dataset; devuelve su resumen (lo que va al índice)."""
+    started = time.perf_counter()
+    version = data_handler.named_dataset_version(name)
+    if version is None:
+        raise ValueError(f'el dataset {name} no existe')
+    target = Path(out_dir) / name
+    target.mkdir(parents=True, exist_ok=True)
+    business = data_handler.get_named_dataframe(name, 'business', columns=OPPORTUNITY_COLUMNS)
+    reviews = data_handler.get_named_dataframe(name, 'review')
+    report = {'dataset': name, 'version': version, 'artifacts': []}
+
+    if business is not None:
+        table_html, summary, _ = analyze_opportunities(business)
+        report['opportunities'] = summary
+        _write(target / 'opportunities.html', table_html)
+        report['artifacts'].append('opportunities.html')
+
+        if 'categories' in business.columns and 'business_id' in business.columns:
+            # demanda: reseñas del dataset si las tiene, si no el review_count de cada negocio
+            counts = business['review_count'] if 'review_count' in business.columns else business.get('reviews')
+            if counts is None:
+                counts = pd.Series(0, index=business.index)
+            pairs, names = category_pairs(business, counts.fillna(0))
+            if reviews is not None and 'business_id' in reviews.columns:
+                gap = gap_analysis(pairs, names, reviews[['business_id']])
+            else:
+                grouped = aggregate_categories(pairs, names)
+                gap = gap_from_aggregates(grouped['category'], grouped['businesses_count'], grouped['total_reviews'])
+            table_html, recomendacion, labels, values = gap_report(gap)
+            report['gap'] = {'recommendation': recomendacion, 'top': dict(zip(labels, map(float, values)))}
+            _write(target / 'gap.html', table_html)
+            report['artifacts'].append('gap.html')
+
+    if reviews is not None and 'text' in reviews.columns and not reviews.empty:
+        demand = demand_analysis.analyze_reviews_from_df(reviews.assign(text=reviews['text'].fillna('').astype(str)))
+        png = base64.b64decode(demand.pop('wordcloud_b64'))
+        (target / 'wordcloud.png').write_bytes(png)
+        report['artifacts'].append('wordcloud.png')
+        # meses como 'YYYY-MM', igual que /api/demand
+        demand['time_series'] = {str(k): int(v) for k, v in demand['time_series'].items()}
+        report['demand'] = demand
+
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    _write(target / 'report.json', json.dumps(report, ensure_ascii=False, indent=2, default=str))
+    report['artifacts'].insert(0, 'report.json')
+    return {k: report[k] for k in ('dataset', 'version', 'artifacts', 'seconds')}
+
+def _index_html(results):
+    rows = []
+    for r in results:
+        if 'error' in r:
+            detail = f"<span class=\"text-danger\">{html.escape(r['error'])}</span>"
+        else:
+            detail = ' · '.join(f"<a href=\"{html.escape(r['dataset'])}/{a}\">{a}</a>" for a in r['artifacts'])
+        rows.append(f"<tr><td>{html.escape(r['dataset'])}</td><td>{r.get('seconds', '')}</td><td>{detail}</td></tr>")
+    return (
+        "<!doctype html><meta charset=\"utf-8\"><title>Reportes DSS</title>"
+        "<table class=\"table table-striped\"><thead><tr><th>Dataset</th><th>Segundos</th><th>Reportes</th></tr></thead>"
+        f"<tbody>{''.join(rows)}</tbody></table>"
+    )
+
+def run(names, out_dir, workers=None):
+    """Genera los reportes de los datasets names en paralelo; devuelve el resumen de cada uno
+    (con 'error' en los que fallaron)."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    workers = max(1, min(workers or REPORT_WORKERS, len(names) or 1))
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(report_dataset, name, str(out_dir)): name for name in names}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = {'dataset': name, 'error': f"{type(e).__name__}: {e}", 'trace': traceback.format_exc()}
+                print(f"  {name:<24} error: {results[name]['error']}")
+            else:
+                print(f"  {name:<24} {results[name]['seconds']:>8.2f} s  {', '.join(results[name]['artifacts'])}")
+    ordered = [results[name] for name in names]
+    _write(out_dir / 'index.json', json.dumps(
+        {'generated': time.strftime('%Y-%m-%dT%H:%M:%S'), 'reports': ordered}, ensure_ascii=False, indent=2
+    ))
+    _write(out_dir / 'index.html', _index_html(ordered))
+    return ordered
+
+def add_dataset(spec, mode='replace'):
+    """Registra NOMBRE=RUTA en el dataset con nombre (se omite si el contenido no cambió)."""
+    name, sep, path = spec.partition('=')
+    if not sep or not path:
+        raise ValueError(f'--add espera NOMBRE=RUTA: {spec}')
+    if not data_handler.DATASET_NAME_RE.match(name):
+        raise ValueError(f"nombre de dataset inválido: {name} (letras, números, '-' o '_')")
+    digest = upload_store.file_sha256(path)
+    if data_handler.named_dataset_is_current(name, path, digest, mode):
+        return name, False
+    data_handler.save_named_dataset(name, path, mode=mode, content_hash=digest)
+    return name, True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reportes por lote de los datasets con nombre.')
+    parser.add_argument('datasets', nargs='*', help='datasets a procesar (por defecto todos)')
+    parser.add_argument('--add', action='append', default=[], metavar='NOMBRE=RUTA',
+                        help='guarda el archivo en el dataset antes de procesar (se puede repetir)')
+    parser.add_argument('--upsert', action='store_true', help='con --add, agrega/actualiza en vez de reemplazar')
+    parser.add_argument('--out', default=None, help='carpeta de salida (por defecto storage/reports/<fecha>)')
+    parser.add_argument('--workers', type=int, default=None, help='procesos en paralelo (DSS_REPORT_WORKERS)')
+    args = parser.parse_args()
+
+    added = []
+    for spec in args.add:
+        try:
+            name, changed = add_dataset(spec, mode='upsert' if args.upsert else 'replace')
+        except (ValueError, OSError) as e:
+            parser.error(str(e))
+        print(f"Dataset {name}: {'guardado' if changed else 'sin cambios'}")
+        added.append(name)
+
+    names = list(dict.fromkeys(args.datasets + added)) or list(data_handler.list_named_datasets())
+    if not names:
+        parser.error('no hay datasets con nombre (usa --add NOMBRE=RUTA)')
+    out_dir = Path(args.out) if args.out else reports_dir / time.strftime('%Y-%m-%d')
+    print(f'Reportes de {len(names)} dataset(s) en {out_dir}:')
+    results = run(names, out_dir, workers=args.workers)
+    if any('error' in r for r in results):
+        sys.exit(1)
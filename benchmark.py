@@ -0,0 +1,199 @@
+# benchmark.py
+# Mide tiempo y memoria de cada etapa del pipeline (extracción, SQLite, oportunidades,
+# brecha, análisis de demanda y búsqueda en reseñas) sobre datos sintéticos o archivos Yelp
+# existentes.
+# Cada ejecución agrega una línea JSON a benchmarks/results.jsonl y se compara con la
+# ejecución anterior de la misma escala para que las regresiones queden a la vista.
+#
+# Uso:
+#   python benchmark.py --reviews 100000
+#   python benchmark.py --business business.json --review review.json --nrows 50000
+import argparse, json, os, platform, subprocess, sys, tempfile, time, tracemalloc, uuid
+from pathlib import Path
+
+import data_handler
+import demand_analysis
+import synthetic_yelp
+from yelp_utils import extract_business_table, extract_reviews_table, BATCH_SIZE
+from models import analyze_opportunities, category_pairs, gap_analysis, gap_from_aggregates
+from demand_analysis import (
+    term_frequencies, render_wordcloud_png, polarity_scores, aggregate_time_series, update_topic_model
+)
+
+results_path = Path(__file__).parent / 'benchmarks' / 'results.jsonl'
+
+# Una etapa es regresión si tarda (o usa memoria) más de este factor respecto a la corrida anterior
+REGRESSION_FACTOR = 1.2
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def _measure(fn, memory=True):
+    """Ejecuta fn midiendo el tiempo; con memory=True la repite bajo tracemalloc para el pico
+    (tracemalloc agrega overhead, por eso el tiempo se toma en la corrida sin él)."""
+    started = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - started
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak_mb
+
+def _chunks(series, size=demand_analysis.WORDCLOUD_CHUNK):
+    for start in range(0, len(series), size):
+        yield series.iloc[start:start + size]
+
+def run(business_path, review_path, nrows=None, memory=True, workdir=None, parse_workers=None):
+    """Ejecuta todas las etapas y devuelve la lista de mediciones.
+    La base SQLite y el modelo de tópicos se escriben en workdir, no en los del proyecto."""
+    workdir = Path(workdir or tempfile.mkdtemp(prefix='dss_bench_'))
+    data_handler.use_database(workdir / 'bench.db')
+    demand_analysis.topic_model_path = workdir / 'topic_model.joblib'
+
+    stages = []
+    state = {}
+
+    def stage(name, fn, rows=None):
+        result, seconds, peak_mb = _measure(fn, memory)
+        n = rows(result) if callable(rows) else rows
+        stages.append({
+            'stage': name,
+            'seconds': round(seconds, 4),
+            'rows': n,
+            'rows_per_sec': round(n / seconds, 1) if n and seconds > 0 else None,
+            'peak_mb': round(peak_mb, 2) if peak_mb is not None else None
+        })
+        print(f"  {name:<28} {seconds:>9.3f} s  {stages[-1]['peak_mb'] or '-':>9} MB  {n or ''}")
+        return result
+
+    business = stage('extract_business_table', lambda: extract_business_table(business_path, nrows=nrows, workers=parse_workers), len)
+    reviews = stage('extract_reviews_table', lambda: extract_reviews_table(review_path, nrows=nrows, workers=parse_workers), len)
+    stage('save_to_sqlite[business]', lambda: data_handler.save_to_sqlite(business, 'business', mode='replace'), len(business))
+    stage('save_to_sqlite[review]', lambda: data_handler.save_to_sqlite(reviews, 'review', mode='replace'), len(reviews))
+    stage('analyze_opportunities', lambda: analyze_opportunities(business), len(business))
+
+    def gap_pandas():
+        pairs, names = category_pairs(business, business['review_count'])
+        return gap_analysis(pairs, names, reviews[['business_id']])
+    stage('gap[pandas]', gap_pandas, len)
+
+    def gap_sql():
+        agg = data_handler.get_category_aggregates()
+        return gap_from_aggregates(agg['category'], agg['businesses_count'], agg['reviews'])
+    stage('gap[sql]', gap_sql, len)
+
+    texts = reviews['text']
+    freqs = stage('term_frequencies', lambda: term_frequencies(_chunks(texts)), len(texts))
+    stage('render_wordcloud_png', lambda: render_wordcloud_png(freqs))
+    state['polarity'] = stage('polarity_scores', lambda: polarity_scores(texts), len(texts))
+    stage('aggregate_time_series', lambda: aggregate_time_series(reviews[['date']]), len(reviews))
+    stage('get_monthly_trends', lambda: data_handler.get_monthly_trends(), len)
+    stage('search_reviews', lambda: data_handler.search_reviews('food'), lambda res: res['reviews'])
+
+    def topics():
+        # mismo recorrido que update_review_topics: el primer lote reinicia el modelo
+        out = []
+        for i, start in enumerate(range(0, len(texts), BATCH_SIZE)):
+            out.append(update_topic_model(texts.iloc[start:start + BATCH_SIZE], reset=(i == 0)))
+        return out
+    stage('update_topic_model', topics, len(texts))
+    return stages
+
+def _previous(records, scale, parse_workers=None):
+    for rec in reversed(records):
+        if rec.get('scale') == scale and rec.get('parse_workers') == parse_workers:
+            return rec
+    return None
+
+def compare(current, previous):
+    """Etapas que empeoraron más de REGRESSION_FACTOR respecto a la corrida anterior."""
+    before = {s['stage']: s for s in previous['stages']}
+    regressions = []
+    for s in current['stages']:
+        old = before.get(s['stage'])
+        if not old:
+            continue
+        for metric in ('seconds', 'peak_mb'):
+            if s.get(metric) and old.get(metric) and s[metric] > old[metric] * REGRESSION_FACTOR:
+                regressions.append({
+                    'stage': s['stage'], 'metric': metric,
+                    'before': old[metric], 'after': s[metric], 'ratio': round(s[metric] / old[metric], 2)
+                })
+    return regressions
+
+def _load_results(path):
+    if not path.exists():
+        return []
+    with path.open('r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark de las etapas del pipeline DSS.')
+    parser.add_argument('--reviews', type=int, default=10000, help='reseñas sintéticas a generar')
+    parser.add_argument('--businesses', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--business', help='business.json existente (en lugar de datos sintéticos)')
+    parser.add_argument('--review', help='review.json existente (en lugar de datos sintéticos)')
+    parser.add_argument('--nrows', type=int, default=None, help='filas a leer de cada archivo')
+    parser.add_argument('--parse-workers', type=int, default=None, help='procesos para leer los NDJSON (DSS_PARSE_WORKERS)')
+    parser.add_argument('--no-memory', action='store_true', help='no medir el pico de memoria (más rápido)')
+    parser.add_argument('--results', default=str(results_path))
+    parser.add_argument('--fail-on-regression', action='store_true', help='código de salida 1 si hay regresiones')
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='dss_bench_'))
+    if args.business and args.review:
+        business_path, review_path = args.business, args.review
+        scale = {'business': Path(args.business).name, 'review': Path(args.review).name, 'nrows': args.nrows}
+    else:
+        print('Generando datos sintéticos...')
+        info = synthetic_yelp.generate(workdir / 'data', n_reviews=args.reviews, n_businesses=args.businesses, seed=args.seed)
+        business_path, review_path = info['business_path'], info['review_path']
+        scale = {'businesses': info['businesses'], 'reviews': info['reviews'], 'seed': args.seed}
+
+    print(f'Etapas ({workdir}):')
+    stages = run(
+        business_path, review_path, nrows=args.nrows, memory=not args.no_memory, workdir=workdir,
+        parse_workers=args.parse_workers
+    )
+
+    record = {
+        'run_id': uuid.uuid4().hex[:12],
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'memory_measured': not args.no_memory,
+        'scale': scale,
+        'parse_workers': args.parse_workers,
+        'stages': stages
+    }
+    path = Path(args.results)
+    previous = _previous(_load_results(path), scale, args.parse_workers)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f'Resultados en {path} (run {record["run_id"]})')
+
+    if previous:
+        regressions = compare(record, previous)
+        if regressions:
+            print(f'⚠️  Regresiones respecto a la corrida {previous["run_id"]} ({previous.get("git_commit")}):')
+            for r in regressions:
+                print(f"   {r['stage']:<28} {r['metric']:<8} {r['before']} → {r['after']} (x{r['ratio']})")
+            if args.fail_on_regression:
+                sys.exit(1)
+        else:
+            print(f'Sin regresiones respecto a la corrida {previous["run_id"]}.')
@@ -1,30 +1,524 @@
-import pandas as pd, os
+import pandas as pd, numpy as np, os, re, time, uuid, json, base64, hashlib, fcntl, tempfile
+import pyarrow as pa
+from pyarrow import feather
 from pathlib import Path
-from yelp_utils import extract_business_table, extract_reviews_table
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from yelp_utils import (
+    extract_business_table, extract_reviews_table,
+    iter_business_batches, iter_reviews_batches, explode_categories, BATCH_SIZE,
+    BUSINESS_DTYPES, REVIEW_DTYPES, LAZY_COLUMNS, STRING, compact_frame
+)
+import db_handler
+import result_cache
+import history_store
+import spatial_index
+import rollups
+import sampling
+import sketches
+import text_index
+import metrics
 
 # --- Configuración de storage y SQLite ---
 storage = Path(__file__).parent / 'storage'
 storage.mkdir(exist_ok=True)
 
-last_data_csv = storage / 'last_data.csv'
-all_data_xlsx = storage / 'all_data.xlsx'
-sqlite_db = Path(__file__).parent / "dss.db"  # archivo SQLite local
+last_data_csv = storage / 'last_data.csv'  # formato anterior, solo lectura
+last_data_arrow = storage / 'last_data.feather'
+sqlite_db = db_handler.sqlite_db  # archivo SQLite local
+dataset_version_file = storage / 'dataset_version'
 
-# Conexión a SQLite con SQLAlchemy
-engine = create_engine(f"sqlite:///{sqlite_db}")
+# Conexiones a SQLite (ver db_handler): engine para escribir, read_engine para las consultas
+engine, read_engine = db_handler.engine, db_handler.read_engine
+
+def use_database(path):
+    """Apunta la capa de datos a otro archivo SQLite (p. ej. la base temporal del benchmark)."""
+    global engine, read_engine
+    engine, read_engine = db_handler.create_engines(path)
+
+# Esquema de las tablas Yelp: clave primaria para el upsert e índices secundarios
+TABLE_SCHEMAS = {
+    'business': {
+        'key': 'business_id',
+        'columns': {
+            'business_id': 'TEXT PRIMARY KEY',
+            'name': 'TEXT',
+            'categories': 'TEXT',
+            'review_count': 'INTEGER',
+            'city': 'TEXT',
+            'latitude': 'REAL',
+            'longitude': 'REAL'
+        },
+        'indexes': {
+            'idx_business_city': 'city'
+        },
+        'derived': {}
+    },
+    'review': {
+        'key': 'review_id',
+        'columns': {
+            'review_id': 'TEXT PRIMARY KEY',
+            'business_id': 'TEXT',
+            'user_id': 'TEXT',
+            'stars': 'REAL',
+            'date': 'TEXT',
+            'text': 'TEXT'
+        },
+        'indexes': {
+            'idx_review_business_id': 'business_id',
+            'idx_review_date': 'date'
+        },
+        # resultados calculados por reseña; se descartan cuando la reseña cambia
+        'derived': {
+            'review_sentiment': 'review_id TEXT PRIMARY KEY, polarity REAL',
+            'review_topic': 'review_id TEXT PRIMARY KEY, topic INTEGER'
+        }
+    }
+}
+
+# Tipos Arrow equivalentes a los tipos SQLite del esquema
+ARROW_TYPES = {'TEXT': pa.string(), 'INTEGER': pa.int64(), 'REAL': pa.float64()}
+
+# Tipos compactos con los que se entregan los DataFrames de cada tabla (ver yelp_utils)
+COMPACT_DTYPES = {'business': BUSINESS_DTYPES, 'review': REVIEW_DTYPES}
+
+# Snapshots columnares (Arrow IPC / Feather sin compresión, se leen con memory-map)
+def snapshot_path(table_name):
+    return storage / f'{table_name}.feather'
+
+def text_snapshot_path(table_name):
+    # columnas pesadas (LAZY_COLUMNS) en un archivo aparte, con las filas en el mismo orden
+    return storage / f'{table_name}_text.feather'
 
 # --- Funciones auxiliares ---
-def save_to_sqlite(df, table_name):
-    """Guarda un DataFrame en la base SQLite"""
-    df.to_sql(table_name, engine, if_exists="replace", index=False)
+@contextmanager
+def _reading():
+    """Transacción de solo lectura del pool: vista consistente de la base que no espera a las
+    cargas en curso. Nunca escribe: las tablas que falten las crea migrate()."""
+    with read_engine.begin() as conn:
+        yield conn
+
+@metrics.timed('migrate')
+def migrate():
+    """Crea las tablas que falten y construye una sola vez, con los datos ya cargados, lo que
+    mantiene la ingesta (agregados mensuales, muestras, sketches, índice de texto e índice del
+    mapa). En una base anterior puede tardar (recorre review); corre al iniciar la aplicación o
+    con python migrate.py, nunca desde una consulta. Devuelve True si tuvo que construir algo."""
+    with read_engine.connect() as conn:
+        tables = {r[0] for r in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type='table'")}
+    map_missing = 'map_point' not in tables and (last_data_arrow.exists() or last_data_csv.exists())
+    if tables.issuperset(_read_tables()) and not map_missing:
+        return False
+    with engine.begin() as conn:
+        _ensure_rollups(conn)
+        _ensure_samples(conn)
+        _ensure_sketches(conn)
+        _ensure_text_index(conn)
+        _ensure_dataset_state(conn)
+        if map_missing:
+            # datos cargados antes de existir el índice del mapa
+            df = get_last_dataframe()
+            spatial_index.index_points(conn, df if df is not None else pd.DataFrame(), replace=True)
+            spatial_index.rebuild_clusters(conn)
+    return True
+
+def _read_tables():
+    names = {'category', 'business_category', rollups.CITY_TABLE, rollups.CATEGORY_TABLE}
+    names.update(sampling.sample_table(t) for t in sampling.SAMPLES)
+    names.add(sketches.SKETCH_TABLE)
+    names.add(text_index.FTS_TABLE)
+    names.add(DATASET_TABLE)
+    for table_name, schema in TABLE_SCHEMAS.items():
+        names.add(table_name)
+        names.update(schema['derived'])
+    return names
+
+@contextmanager
+def _writing(conn=None):
+    # usa la transacción del llamador (carga por lotes) o abre una nueva
+    if conn is not None:
+        yield conn
+    else:
+        with engine.begin() as conn:
+            yield conn
+
+def _ensure_schema(conn, table_name):
+    """Crea la tabla con clave primaria e índices si no existen.
+    Si la tabla es de una versión anterior (sin clave primaria) se migra una sola vez."""
+    schema = TABLE_SCHEMAS[table_name]
+    row = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table_name,)
+    ).fetchone()
+    legacy = row is not None and 'PRIMARY KEY' not in row[0].upper()
+    if legacy:
+        conn.exec_driver_sql(f"ALTER TABLE {table_name} RENAME TO _legacy_{table_name}")
+
+    cols_sql = ", ".join(f"{c} {t}" for c, t in schema['columns'].items())
+    conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {table_name} ({cols_sql})")
+    for idx_name, col in schema['indexes'].items():
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {idx_name} ON {table_name}({col})")
+    for derived, cols_sql in schema['derived'].items():
+        conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {derived} ({cols_sql})")
+
+    if legacy:
+        legacy_cols = [r[1] for r in conn.exec_driver_sql(f"PRAGMA table_info(_legacy_{table_name})")]
+        cols = ", ".join(c for c in schema['columns'] if c in legacy_cols)
+        conn.exec_driver_sql(
+            f"INSERT OR REPLACE INTO {table_name} ({cols}) SELECT {cols} FROM _legacy_{table_name} "
+            f"WHERE {schema['key']} IS NOT NULL"
+        )
+        conn.exec_driver_sql(f"DROP TABLE _legacy_{table_name}")
+
+def _upsert(conn, df, table_name):
+    """Inserta o actualiza las filas de df según la clave primaria de la tabla."""
+    schema = TABLE_SCHEMAS[table_name]
+    key = schema['key']
+    cols = [c for c in schema['columns'] if c in df.columns]
+    if key not in cols:
+        raise Exception(f"La tabla {table_name} requiere la columna {key}")
+    staging = f"_staging_{table_name}"
+    out = df[cols].dropna(subset=[key])
+    # las fechas se guardan como texto ISO sin fracción de segundo (formato original de Yelp)
+    dates = {c: out[c].dt.strftime('%Y-%m-%d %H:%M:%S') for c in cols if pd.api.types.is_datetime64_any_dtype(out[c])}
+    out.assign(**dates).to_sql(staging, conn, if_exists="replace", index=False)
+    col_list = ", ".join(cols)
+    updates = ", ".join(f"{c}=excluded.{c}" for c in cols if c != key)
+    conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    conn.exec_driver_sql(
+        f"INSERT INTO {table_name} ({col_list}) SELECT {col_list} FROM {staging} WHERE true "
+        f"ON CONFLICT({key}) {conflict}"
+    )
+    for derived in schema['derived']:
+        conn.exec_driver_sql(f"DELETE FROM {derived} WHERE {key} IN (SELECT {key} FROM {staging})")
+    conn.exec_driver_sql(f"DROP TABLE {staging}")
+
+def _ensure_category_index(conn):
+    """Crea el índice normalizado de categorías (category + business_category).
+    Si no existía y ya hay negocios cargados, se construye una sola vez a partir de business."""
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='business_category'"
+    ).fetchone()
+    if exists:
+        return
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS category (category_id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)"
+    )
+    conn.exec_driver_sql(
+        "CREATE TABLE business_category (business_id TEXT NOT NULL, category_id INTEGER NOT NULL, "
+        "PRIMARY KEY (business_id, category_id))"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS idx_business_category_category_id ON business_category(category_id)"
+    )
+    has_business = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='business'"
+    ).fetchone()
+    if has_business:
+        for chunk in pd.read_sql("SELECT business_id, categories FROM business", conn, chunksize=BATCH_SIZE):
+            _index_categories(conn, chunk)
+
+def _index_categories(conn, df):
+    """Actualiza business_category para los negocios de df (ids de categoría por diccionario)."""
+    if 'categories' not in df.columns:
+        return
+    df = df[['business_id', 'categories']].dropna(subset=['business_id']).reset_index(drop=True)
+    cats = explode_categories(df)
+    # los negocios sin categorías también se incluyen (category NULL) para limpiar sus filas previas
+    without = df.index.difference(cats.index)
+    pairs = pd.DataFrame({
+        'business_id': np.concatenate([
+            df['business_id'].to_numpy()[cats.index.to_numpy()], df['business_id'].to_numpy()[without]
+        ]),
+        'category': np.concatenate([cats.to_numpy(), np.full(len(without), None, dtype=object)])
+    })
+    pairs.to_sql("_staging_business_category", conn, if_exists="replace", index=False)
+    conn.exec_driver_sql(
+        "DELETE FROM business_category WHERE business_id IN (SELECT business_id FROM _staging_business_category)"
+    )
+    conn.exec_driver_sql(
+        "INSERT OR IGNORE INTO category (name) SELECT DISTINCT category FROM _staging_business_category "
+        "WHERE category IS NOT NULL"
+    )
+    conn.exec_driver_sql(
+        "INSERT OR IGNORE INTO business_category (business_id, category_id) "
+        "SELECT s.business_id, c.category_id FROM _staging_business_category s "
+        "JOIN category c ON c.name = s.category"
+    )
+    conn.exec_driver_sql("DROP TABLE _staging_business_category")
+
+def save_to_sqlite(df, table_name, mode="replace", conn=None):
+    """Guarda un DataFrame en la base SQLite en una sola transacción (o en la de conn).
+    mode='replace' reescribe la tabla; mode='upsert' inserta/actualiza solo las filas del lote."""
+    with metrics.stage('save_to_sqlite') as st, _writing(conn) as conn:
+        st.rows = len(df)
+        _save_to_sqlite(conn, df, table_name, mode)
+
+def _save_to_sqlite(conn, df, table_name, mode):
+    if table_name not in TABLE_SCHEMAS:
+        df.to_sql(table_name, conn, if_exists="replace" if mode == "replace" else "append", index=False)
+        return
+    key = TABLE_SCHEMAS[table_name]['key']
+    if mode == "replace":
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table_name}")
+        for derived in TABLE_SCHEMAS[table_name]['derived']:
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {derived}")
+    _ensure_schema(conn, table_name)
+    if table_name == 'business':
+        _ensure_category_index(conn)
+        if mode == "replace":
+            conn.exec_driver_sql("DELETE FROM business_category")
+    _ensure_rollups(conn)
+    _ensure_samples(conn)
+    if mode == "replace":
+        sampling.clear(conn, table_name)
+    if table_name == 'review':
+        # índice de texto: se quita el texto actual del lote y se indexa el nuevo
+        _ensure_text_index(conn)
+        if mode == "replace":
+            text_index.clear(conn)
+        text_index.begin_batch(conn, df[key] if key in df.columns else [])
+    # agregados mensuales: se resta el aporte actual del lote y se suma el nuevo
+    full_rebuild = table_name == 'business' and mode == "replace"
+    if table_name == 'review' and mode == "replace":
+        rollups.clear(conn)
+    if not full_rebuild:
+        rollups.begin_batch(conn, df[key] if key in df.columns else [], table_name)
+    _upsert(conn, df, table_name)
+    if table_name == 'review':
+        text_index.end_batch(conn)
+    sampling.add_batch(conn, df, table_name)
+    if table_name == 'business':
+        _index_categories(conn, df)
+    if full_rebuild:
+        rollups.rebuild(conn)
+    else:
+        rollups.end_batch(conn, table_name)
+
+def _ensure_rollups(conn):
+    """Crea las tablas de agregados mensuales (y las que usan); se construyen una sola vez."""
+    for table_name in TABLE_SCHEMAS:
+        _ensure_schema(conn, table_name)
+    _ensure_category_index(conn)
+    if rollups.ensure_tables(conn):
+        rollups.rebuild(conn)
+
+def _ensure_samples(conn):
+    """Crea las tablas de muestra; si no existían se muestrean una vez los datos ya cargados."""
+    for table_name in sampling.ensure_tables(conn):
+        _ensure_schema(conn, table_name)
+        sampling.rebuild(conn, table_name)
+
+def _ensure_sketches(conn, rebuild=False):
+    """Crea la tabla de sketches; si no existía (o con rebuild) y ya hay reseñas, se resumen
+    todas de nuevo en un solo sketch."""
+    if not sketches.ensure_table(conn) and not rebuild:
+        return
+    _ensure_schema(conn, 'review')
+    if conn.exec_driver_sql("SELECT 1 FROM review LIMIT 1").fetchone() is None:
+        return
+    sketch = sketches.ReviewSketch(sketches.business_lookup(conn))
+    for chunk in pd.read_sql("SELECT business_id, user_id, stars FROM review", conn, chunksize=BATCH_SIZE):
+        sketch.update(chunk)
+    sketches.save(conn, sketch, source='review', replace=True)
+
+def _reattribute_sketches():
+    """Después de cargar negocios: los sketches atribuyen ciudad y categorías al ingerir cada
+    reseña, así que se rehacen con los negocios actuales (una lectura de review)."""
+    with engine.begin() as conn:
+        _ensure_sketches(conn, rebuild=True)
+
+def _ensure_text_index(conn):
+    """Crea el índice de texto de las reseñas; si no existía se indexan una sola vez las ya cargadas."""
+    _ensure_schema(conn, 'review')
+    if text_index.ensure_table(conn):
+        text_index.rebuild(conn)
+
+def _unseen(conn, df, table_name):
+    """Filas de df cuya clave todavía no está en la tabla (los sketches cuentan cada reseña
+    una sola vez, en la carga en que aparece por primera vez)."""
+    key = TABLE_SCHEMAS[table_name]['key']
+    keys = df[key].astype(object).astype(str)
+    pd.DataFrame({key: keys.unique()}).to_sql('_staging_keys', conn, if_exists='replace', index=False)
+    seen = conn.exec_driver_sql(
+        f"SELECT t.{key} FROM {table_name} t JOIN _staging_keys s ON s.{key} = t.{key}"
+    ).fetchall()
+    conn.exec_driver_sql("DROP TABLE _staging_keys")
+    return df[~keys.isin([r[0] for r in seen]).to_numpy()]
+
+def _save_reviews(df, mode, source):
+    """Guarda un DataFrame de reseñas y el sketch de la carga en la misma transacción."""
+    with engine.begin() as conn:
+        _ensure_sketches(conn)
+        sketch = sketches.ReviewSketch(sketches.business_lookup(conn))
+        sketch.update(df if mode == "replace" else _unseen(conn, df, "review"))
+        save_to_sqlite(df, "review", mode=mode, conn=conn)
+        sketches.save(conn, sketch, source=source, replace=mode == "replace")
+
+@metrics.timed('read_from_sqlite', rows=len)
+def read_from_sqlite(table_name, columns=None):
+    """Lee una tabla de SQLite como DataFrame (solo las columnas pedidas, si se indican)"""
+    cols = ", ".join(columns) if columns else "*"
+    with _reading() as conn:
+        df = pd.read_sql(f"SELECT {cols} FROM {table_name}", conn)
+    return compact_frame(df, COMPACT_DTYPES.get(table_name, {}))
 
-def read_from_sqlite(table_name):
-    """Lee una tabla de SQLite como DataFrame"""
-    return pd.read_sql(f"SELECT * FROM {table_name}", engine)
+def _arrow_schema(table_name):
+    columns = TABLE_SCHEMAS[table_name]['columns']
+    return pa.schema([(c, ARROW_TYPES[t.split()[0]]) for c, t in columns.items()])
+
+@metrics.timed('refresh_snapshot')
+def refresh_snapshot(table_name, chunksize=BATCH_SIZE):
+    """Exporta la tabla de SQLite a su snapshot columnar por lotes.
+    Se escribe en un archivo temporal y se reemplaza de forma atómica."""
+    full = _arrow_schema(table_name)
+    lazy = LAZY_COLUMNS.get(table_name, [])
+    schema = pa.schema([f for f in full if f.name not in lazy])
+    path = snapshot_path(table_name)
+    tmp = path.with_suffix('.feather.tmp')
+    text_schema = pa.schema([f for f in full if f.name in lazy])
+    text_path = text_snapshot_path(table_name)
+    text_tmp = text_path.with_suffix('.feather.tmp')
+    cols = ", ".join(full.names)
+    # una sola transacción de lectura: los dos archivos salen de la misma versión de la tabla
+    with _reading() as conn, pa.OSFile(str(tmp), 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        text_writer = pa.ipc.new_file(str(text_tmp), text_schema) if lazy else None
+        try:
+            for chunk in pd.read_sql(f"SELECT {cols} FROM {table_name}", conn, chunksize=chunksize):
+                writer.write_table(pa.Table.from_pandas(chunk[schema.names], schema=schema, preserve_index=False))
+                if text_writer is not None:
+                    text_writer.write_table(
+                        pa.Table.from_pandas(chunk[text_schema.names], schema=text_schema, preserve_index=False)
+                    )
+        finally:
+            if text_writer is not None:
+                text_writer.close()
+    if lazy:
+        os.replace(text_tmp, text_path)
+    os.replace(tmp, path)
+
+@metrics.timed('read_snapshot', rows=len)
+def _read_snapshot(path, columns=None, dtypes=BUSINESS_DTYPES):
+    """Lee un snapshot con memory-map cargando solo las columnas disponibles que se pidan,
+    con los tipos compactos de dtypes."""
+    if columns is not None:
+        columns = [c for c in columns if c in _snapshot_columns(path)]
+    return _to_compact_pandas(feather.read_table(path, columns=columns, memory_map=True), dtypes)
+
+def _snapshot_columns(path):
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).schema.names
+
+def _to_compact_pandas(table, dtypes):
+    # los categóricos se codifican en Arrow (sin crear un objeto Python por valor)
+    for name in table.column_names:
+        if dtypes.get(name) == 'category' and pa.types.is_string(table.schema.field(name).type):
+            i = table.column_names.index(name)
+            table = table.set_column(i, name, table[name].combine_chunks().dictionary_encode())
+    df = table.to_pandas(types_mapper={pa.string(): STRING, pa.large_string(): STRING}.get)
+    return compact_frame(df, dtypes)
+
+@metrics.timed('write_last_data')
+def _write_last_data(df):
+    """Guarda el último dataset subido como snapshot columnar."""
+    tmp = last_data_arrow.with_suffix('.feather.tmp')
+    feather.write_feather(history_store.arrow_table(df.reset_index(drop=True)), tmp, compression='uncompressed')
+    os.replace(tmp, last_data_arrow)
+    # índice espacial del mapa (clusters por zoom) para el último dataset
+    with engine.begin() as conn:
+        spatial_index.index_points(conn, df, replace=True)
+        spatial_index.rebuild_clusters(conn)
+
+# Hash de contenido de cada dataset (tablas business y review y último dataset subido): con
+# mode='replace' es el SHA-256 del archivo cargado y con 'upsert' se encadena con el anterior.
+# La versión de los datos (clave de las cachés) se deriva de estos hashes, así que los mismos
+# datos dan la misma versión. Una carga sin hash (benchmark, scripts) cuenta como contenido nuevo.
+DATASETS = ('business', 'review', 'last_data')
+DATASET_TABLE = 'dataset_state'
+
+def _ensure_dataset_state(conn):
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {DATASET_TABLE} (name TEXT PRIMARY KEY, content_hash TEXT NOT NULL, "
+        "upload_hash TEXT, mode TEXT, updated REAL)"
+    )
+
+def upload_datasets(filename):
+    """Datasets que modifica la carga de un archivo (mismo criterio que ingest_file en app)."""
+    name = Path(filename).name.lower()
+    if name.endswith('.json') and 'business' in name:
+        return ('business', 'last_data')
+    if name.endswith('.json') and 'review' in name:
+        return ('review',)
+    return ('last_data',)
+
+def _dataset_mode(name, mode):
+    # el último dataset subido siempre se reemplaza
+    return 'replace' if name == 'last_data' else mode
+
+def dataset_hashes():
+    """Hash de contenido actual de cada dataset cargado."""
+    with _reading() as conn:
+        if not db_handler.has_tables(conn, DATASET_TABLE):
+            return {}
+        return dict(conn.exec_driver_sql(f"SELECT name, content_hash FROM {DATASET_TABLE}").fetchall())
+
+def upload_is_current(filename, content_hash, mode="replace"):
+    """True si el archivo (content_hash) es lo último que se cargó en sus datasets y volver a
+    cargarlo con mode no cambiaría los datos: la carga se puede omitir."""
+    with _reading() as conn:
+        state = {}
+        if db_handler.has_tables(conn, DATASET_TABLE):
+            state = {r[0]: r[1:] for r in conn.exec_driver_sql(f"SELECT name, upload_hash, mode FROM {DATASET_TABLE}")}
+    return all(
+        _reload_is_noop(*state.get(name, (None, None)), content_hash, _dataset_mode(name, mode))
+        for name in upload_datasets(filename)
+    )
+
+def _reload_is_noop(upload_hash, last_mode, content_hash, mode):
+    # volver a cargar lo último que se cargó no cambia nada, salvo reemplazar con el archivo
+    # que antes se agregó por upsert
+    return upload_hash == content_hash and (mode == 'upsert' or last_mode == 'replace')
+
+def dataset_version():
+    """Identificador de la versión actual de los datos (cambia cuando cambia el contenido)."""
+    try:
+        return dataset_version_file.read_text().strip()
+    except FileNotFoundError:
+        return 'inicial'
+
+def _bump_dataset_version(datasets, content_hash=None, mode="replace"):
+    """Registra el contenido cargado en datasets, la nueva versión de los datos e invalida los
+    resultados en caché de las versiones anteriores."""
+    with engine.begin() as conn:
+        _ensure_dataset_state(conn)
+        for name in datasets:
+            name_mode = _dataset_mode(name, mode)
+            row = conn.exec_driver_sql(
+                f"SELECT content_hash FROM {DATASET_TABLE} WHERE name = ?", (name,)
+            ).fetchone()
+            if content_hash is None:
+                new = uuid.uuid4().hex
+            elif name_mode == 'replace':
+                new = content_hash
+            else:
+                # sobre datos de origen desconocido el resultado tampoco se conoce
+                previous = row[0] if row else uuid.uuid4().hex
+                new = hashlib.sha256(f"{previous}:{content_hash}".encode('ascii')).hexdigest()
+            conn.exec_driver_sql(
+                f"INSERT OR REPLACE INTO {DATASET_TABLE} (name, content_hash, upload_hash, mode, updated) "
+                "VALUES (?, ?, ?, ?, ?)", (name, new, content_hash, name_mode, time.time())
+            )
+        hashes = [tuple(r) for r in conn.exec_driver_sql(f"SELECT name, content_hash FROM {DATASET_TABLE} ORDER BY name")]
+    version = hashlib.sha256(json.dumps(hashes).encode('ascii')).hexdigest()[:32]
+    tmp = dataset_version_file.with_suffix('.tmp')
+    tmp.write_text(version)
+    os.replace(tmp, dataset_version_file)
+    result_cache.invalidate(keep_version=version)
+    return version
 
 # --- Funciones principales ---
-def save_uploaded_file(filepath):
+def read_uploaded_file(filepath):
+    """Lee un CSV, Excel o JSON subido como DataFrame (business.json y review.json de Yelp con
+    el extractor de Yelp)."""
+    filepath = str(filepath)
     try:
         if filepath.endswith('.csv'):
             df = pd.read_csv(filepath)
@@ -33,9 +527,9 @@ def save_uploaded_file(filepath):
         elif filepath.endswith('.json'):
             name = Path(filepath).name.lower()
             if 'business' in name:
-                df = extract_business_table(filepath)
+                df = extract_business_table(filepath, compact=False)
             elif 'review' in name:
-                df = extract_reviews_table(filepath)
+                df = extract_reviews_table(filepath, compact=False)
             else:
                 try:
                     df = pd.read_json(filepath)
@@ -48,73 +542,664 @@ def save_uploaded_file(filepath):
 
     # normalizar nombres de columnas
     df.columns = [c.strip() for c in df.columns]
+    return df
 
-    # guardar last_data.csv
-    if last_data_csv.exists():
-        try:
-            os.remove(last_data_csv)
-        except Exception:
-            pass
-    df.to_csv(last_data_csv, index=False)
-
-    # guardar historial en Excel (cada upload una hoja)
-    sheet_name = Path(filepath).stem[:30]
-    if all_data_xlsx.exists():
-        with pd.ExcelWriter(all_data_xlsx, mode="a", engine="openpyxl", if_sheet_exists="replace") as writer:
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
-    else:
-        with pd.ExcelWriter(all_data_xlsx, mode="w", engine="openpyxl") as writer:
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
+def save_uploaded_file(filepath, mode="replace", content_hash=None):
+    """Carga un CSV, Excel o JSON como último dataset (y en SQLite si es business o review de
+    Yelp). content_hash es el SHA-256 del archivo, si se conoce (ver upload_store)."""
+    filepath = str(filepath)
+    datasets = ['last_data']
+    df = read_uploaded_file(filepath)
+
+    # guardar snapshot del último dataset
+    _write_last_data(df)
+
+    # guardar historial (un archivo Parquet por carga)
+    history_store.append(df, filepath)
 
     # guardar copias específicas + SQLite
     if Path(filepath).suffix == '.json' and 'review' in Path(filepath).name.lower():
         out = storage / 'review.csv'
         df.to_csv(out, index=False)
-        save_to_sqlite(df, "review")
+        _save_reviews(df, mode, Path(filepath).name)
+        refresh_snapshot("review")
+        datasets.append('review')
 
     if Path(filepath).suffix == '.json' and 'business' in Path(filepath).name.lower():
         out = storage / 'business.csv'
         df.to_csv(out, index=False)
-        save_to_sqlite(df, "business")
+        save_to_sqlite(df, "business", mode=mode)
+        _reattribute_sketches()
+        refresh_snapshot("business")
+        datasets.append('business')
 
-    return True
+    _bump_dataset_version(datasets, content_hash, mode)
+    return df
 
-def save_yelp_business_json(filepath, nrows=None):
-    df = extract_business_table(filepath, nrows=nrows)
-    # guardar last_data y Excel
-    if last_data_csv.exists():
-        try:
-            os.remove(last_data_csv)
-        except Exception:
-            pass
-    df.to_csv(last_data_csv, index=False)
-    sheet_name = Path(filepath).stem[:30]
-    if all_data_xlsx.exists():
-        with pd.ExcelWriter(all_data_xlsx, mode="a", engine="openpyxl", if_sheet_exists="replace") as writer:
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
-    else:
-        with pd.ExcelWriter(all_data_xlsx, mode="w", engine="openpyxl") as writer:
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
+def save_yelp_business_json(filepath, nrows=None, mode="replace", workers=None, content_hash=None):
+    df = extract_business_table(filepath, nrows=nrows, workers=workers, compact=False)
+    # guardar last_data e historial
+    _write_last_data(df)
+    history_store.append(df, filepath)
 
     # guardar business.csv y SQLite
     df.to_csv(storage / 'business.csv', index=False)
-    save_to_sqlite(df, "business")
+    save_to_sqlite(df, "business", mode=mode)
+    _reattribute_sketches()
+    refresh_snapshot("business")
+    _bump_dataset_version(('business', 'last_data'), content_hash, mode)
     return df
 
-def save_yelp_review_json(filepath, nrows=None):
-    df = extract_reviews_table(filepath, nrows=nrows)
+def save_yelp_review_json(filepath, nrows=None, mode="replace", workers=None, content_hash=None):
+    df = extract_reviews_table(filepath, nrows=nrows, workers=workers, compact=False)
     outpath = storage / 'review.csv'
     df.to_csv(outpath, index=False)
-    save_to_sqlite(df, "review")
+    _save_reviews(df, mode, Path(filepath).name)
+    refresh_snapshot("review")
+    _bump_dataset_version(('review',), content_hash, mode)
     return df
 
-def get_last_dataframe():
+@metrics.timed('stream_batches', rows=lambda stats: stats['rows'])
+def _stream_batches(batches, table_name, csv_paths, mode="replace", last_data=False, progress=None,
+                    history_source=None, sketch_source=None, content_hash=None):
+    """Escribe cada lote directamente en SQLite y en los CSV, sin acumular el archivo en memoria.
+    Con mode='replace' solo el primer lote reescribe la tabla; el resto se agrega por upsert.
+    Con last_data=True los lotes también forman el snapshot del último dataset y con
+    history_source se agregan al histórico como una carga. Con sketch_source (reseñas) se
+    guarda el sketch de la carga (ver sketches). content_hash es el SHA-256 del archivo.
+    progress(filas) se llama después de cada lote."""
+    start = time.perf_counter()
+    rows = 0
+    schema = _arrow_schema(table_name)
+    tmp = last_data_arrow.with_suffix('.feather.tmp')
+    writer = pa.ipc.new_file(str(tmp), schema) if last_data else None
+    history = history_store.BatchWriter(history_source, schema) if history_source else None
+    datasets = (table_name, 'last_data') if last_data else (table_name,)
+    sketch, sketch_id = None, None
+    try:
+        # una transacción por lote: el lock de escritura se libera entre lotes (puntuación y
+        # otras cargas no esperan a toda la carga) y el WAL no crece hasta el tamaño del archivo.
+        # Las consultas en SQL ven los lotes ya confirmados; las que leen los snapshots siguen
+        # viendo la versión anterior hasta el final
+        for i, batch in enumerate(batches):
+            first = i == 0
+            for path in csv_paths:
+                batch.to_csv(path, index=False, mode='w' if first else 'a', header=first)
+            if writer is not None:
+                writer.write_table(pa.Table.from_pandas(batch[schema.names], schema=schema, preserve_index=False))
+            if history is not None:
+                history.write(batch)
+            with engine.begin() as conn:
+                if writer is not None:
+                    spatial_index.index_points(conn, batch, replace=first)
+                if first and sketch_source is not None:
+                    _ensure_sketches(conn)
+                    sketch = sketches.ReviewSketch(sketches.business_lookup(conn))
+                if sketch is not None:
+                    sketch.update(batch if first and mode == "replace" else _unseen(conn, batch, table_name))
+                save_to_sqlite(batch, table_name, mode=mode if first else "upsert", conn=conn)
+                if sketch is not None:
+                    # el sketch de la carga se reescribe con cada lote: si la carga se corta, las
+                    # reseñas ya confirmadas quedan contadas (y no se vuelven a contar al reintentar)
+                    sketch_id = sketches.save(conn, sketch, source=sketch_source,
+                                              replace=first and mode == "replace", sketch_id=sketch_id)
+            rows += len(batch)
+            if progress is not None:
+                progress(rows)
+        if writer is not None:
+            with engine.begin() as conn:
+                spatial_index.rebuild_clusters(conn)
+        if table_name == "business":
+            _reattribute_sketches()
+    except Exception:
+        if rows:
+            # los lotes confirmados cambiaron los datos: nueva versión (contenido desconocido)
+            _bump_dataset_version(datasets, None, mode)
+        raise
+    finally:
+        if writer is not None:
+            writer.close()
+        if history is not None:
+            history.close()
+    if writer is not None:
+        os.replace(tmp, last_data_arrow)
+    refresh_snapshot(table_name)
+    _bump_dataset_version(datasets, content_hash, mode)
+    elapsed = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed, 1) if elapsed > 0 else float(rows)
+    }
+
+def stream_yelp_business_json(filepath, batch_size=BATCH_SIZE, nrows=None, mode="replace", progress=None,
+                              workers=None, content_hash=None):
+    """Ingesta por lotes de business.json (memoria acotada).
+    Con workers > 1 (o DSS_PARSE_WORKERS) el archivo se procesa en paralelo por fragmentos."""
+    batches = iter_business_batches(filepath, batch_size=batch_size, nrows=nrows, workers=workers)
+    return _stream_batches(batches, "business", [storage / 'business.csv'], mode=mode, last_data=True,
+                           progress=progress, history_source=filepath, content_hash=content_hash)
+
+def stream_yelp_review_json(filepath, batch_size=BATCH_SIZE, nrows=None, mode="replace", progress=None,
+                            workers=None, content_hash=None):
+    """Ingesta por lotes de review.json (memoria acotada). Devuelve filas y filas/seg.
+    Con workers > 1 (o DSS_PARSE_WORKERS) el archivo se procesa en paralelo por fragmentos."""
+    batches = iter_reviews_batches(filepath, batch_size=batch_size, nrows=nrows, workers=workers)
+    return _stream_batches(batches, "review", [storage / 'review.csv'], mode=mode, progress=progress,
+                           sketch_source=Path(filepath).name, content_hash=content_hash)
+
+# --- Datasets con nombre ---
+# Además del último dataset y de las tablas business/review, se pueden guardar datasets con
+# nombre (p. ej. uno por país): storage/datasets/<nombre>/ con un snapshot Feather por tipo
+# (business y/o review) y un manifest.json con el archivo de origen, las filas y el hash de
+# contenido de cada uno. No tocan la base SQLite ni la versión de los datos.
+datasets_dir = storage / 'datasets'
+DATASET_NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+DATASET_KINDS = {'business': ('business_id', BUSINESS_DTYPES), 'review': ('review_id', REVIEW_DTYPES)}
+
+def _named_dir(name):
+    if not isinstance(name, str) or not DATASET_NAME_RE.match(name):
+        raise ValueError('dataset name must be 1-64 letters, digits, "-" or "_"')
+    return datasets_dir / name
+
+def named_dataset_kind(filename):
+    """Tipo de un archivo dentro de un dataset con nombre: review o business (el resto)."""
+    name = Path(filename).name.lower()
+    return 'review' if name.endswith('.json') and 'review' in name else 'business'
+
+def _read_manifest(directory):
+    try:
+        return json.loads((directory / 'manifest.json').read_text())
+    except FileNotFoundError:
+        return {}
+
+def list_named_datasets():
+    """Manifest de cada dataset con nombre: {nombre: {tipo: {source, rows, content_hash, ...}}}."""
+    if not datasets_dir.exists():
+        return {}
+    return {d.name: _read_manifest(d) for d in sorted(datasets_dir.iterdir()) if (d / 'manifest.json').exists()}
+
+def named_dataset_is_current(name, filename, content_hash, mode="replace"):
+    """True si el archivo ya es lo último cargado en ese tipo del dataset (ver upload_is_current)."""
+    entry = _read_manifest(_named_dir(name)).get(named_dataset_kind(filename), {})
+    return _reload_is_noop(entry.get('upload_hash'), entry.get('mode'), content_hash, mode)
+
+@contextmanager
+def _named_lock(directory):
+    # una carga a la vez por dataset (entre procesos): snapshot y manifest se leen y reescriben juntos
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _replace_atomic(path, write):
+    # temporal con nombre único en el mismo directorio: cargas concurrentes no pisan el archivo
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp', delete=False) as f:
+        tmp = Path(f.name)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+def save_named_dataset(name, filepath, mode="replace", content_hash=None):
+    """Guarda un archivo en el dataset con nombre. mode='upsert' agrega/actualiza las filas por
+    clave (business_id o review_id) sobre las que ya tenía. Devuelve el DataFrame guardado."""
+    directory = _named_dir(name)
+    kind = named_dataset_kind(filepath)
+    key = DATASET_KINDS[kind][0]
+    df = read_uploaded_file(filepath)
+    path = directory / f'{kind}.feather'
+    with _named_lock(directory):
+        if mode == "upsert" and path.exists() and key in df.columns:
+            # tipos tal como se guardaron (sin compactar) para no perder precisión al reescribir
+            previous = _read_snapshot(path, dtypes={})
+            df = pd.concat([previous, df], ignore_index=True).drop_duplicates(key, keep='last')
+        table = history_store.arrow_table(df.reset_index(drop=True))
+        _replace_atomic(path, lambda tmp: feather.write_feather(table, tmp, compression='uncompressed'))
+        _write_manifest_entry(directory, kind, filepath, len(df), mode, content_hash)
+    return df
+
+def _write_manifest_entry(directory, kind, filepath, rows, mode, content_hash):
+    manifest = _read_manifest(directory)
+    previous = manifest.get(kind, {}).get('content_hash')
+    if content_hash is None:
+        new = uuid.uuid4().hex
+    elif mode == "replace" or previous is None:
+        new = content_hash
+    else:
+        new = hashlib.sha256(f"{previous}:{content_hash}".encode('ascii')).hexdigest()
+    manifest[kind] = {
+        'source': Path(filepath).name, 'rows': rows, 'content_hash': new,
+        'upload_hash': content_hash, 'mode': mode, 'updated': time.time()
+    }
+    _replace_atomic(directory / 'manifest.json', lambda tmp: tmp.write_text(json.dumps(manifest, indent=2)))
+
+def named_dataset_version(name):
+    """Hash de contenido del dataset con nombre (clave de caché), o None si no existe."""
+    manifest = _read_manifest(_named_dir(name))
+    if not manifest:
+        return None
+    return hashlib.sha256(
+        json.dumps(sorted((k, v['content_hash']) for k, v in manifest.items())).encode('ascii')
+    ).hexdigest()[:32]
+
+def get_named_dataframe(name, kind='business', columns=None):
+    """DataFrame de un tipo (business o review) del dataset con nombre, o None si no lo tiene."""
+    path = _named_dir(name) / f'{kind}.feather'
+    if not path.exists():
+        return None
+    return _read_snapshot(path, columns=columns, dtypes=DATASET_KINDS[kind][1])
+
+# --- Precarga (gunicorn --preload) ---
+# Con DSS_PRELOAD=1 el proceso maestro lee los snapshots una sola vez antes de crear los
+# workers, que los comparten copy-on-write. Solo se usan mientras no cambie la versión de los
+# datos; después de una carga nueva cada worker vuelve a leer los snapshots como siempre.
+_preloaded = {'version': None, 'frames': {}}
+
+def preload_snapshots():
+    """Carga en memoria el último dataset y los snapshots de business y review (sin las
+    columnas de LAZY_COLUMNS). Devuelve las filas precargadas de cada uno."""
+    frames = {}
+    if last_data_arrow.exists():
+        frames['last_data'] = _read_snapshot(last_data_arrow)
+    for table_name in TABLE_SCHEMAS:
+        path = snapshot_path(table_name)
+        if path.exists():
+            lazy = LAZY_COLUMNS.get(table_name, [])
+            columns = [c for c in TABLE_SCHEMAS[table_name]['columns'] if c not in lazy]
+            frames[table_name] = _read_snapshot(path, columns=columns, dtypes=COMPACT_DTYPES.get(table_name, {}))
+    _preloaded['version'] = dataset_version()
+    _preloaded['frames'] = frames
+    # cada worker abre sus propias conexiones después del fork
+    engine.dispose()
+    read_engine.dispose()
+    return {name: len(df) for name, df in frames.items()}
+
+def _from_preload(name, columns=None, partial=False):
+    # proyección sin copiar los datos; None si no hay precarga vigente con esas columnas
+    df = _preloaded['frames'].get(name)
+    if df is None or _preloaded['version'] != dataset_version():
+        return None
+    if columns is None:
+        columns = list(df.columns)
+    elif partial:
+        columns = [c for c in columns if c in df.columns]
+    elif any(c not in df.columns for c in columns):
+        return None
+    return pd.DataFrame({c: df[c] for c in columns}, columns=columns, copy=False)
+
+def get_last_dataframe(columns=None):
+    pre = _from_preload('last_data', columns, partial=True)
+    if pre is not None:
+        return pre
+    if last_data_arrow.exists():
+        return _read_snapshot(last_data_arrow, columns=columns)
     if last_data_csv.exists():
-        return pd.read_csv(last_data_csv)
+        df = compact_frame(pd.read_csv(last_data_csv), BUSINESS_DTYPES)
+        return df[[c for c in columns if c in df.columns]] if columns else df
     return None
 
-def get_business_from_db():
-    return read_from_sqlite("business")
+@metrics.timed('get_markers')
+def get_markers(bbox=None, zoom=0):
+    """Clusters o negocios del mapa dentro del bbox (west, south, east, north) para el zoom dado."""
+    with _reading() as conn:
+        if not db_handler.has_tables(conn, 'map_point'):
+            # todavía no hay datos (o la base no pasó por migrate): mapa vacío
+            return {'zoom': max(0, int(zoom)), 'bounds': None, 'clusters': []}
+        return spatial_index.query_markers(conn, bbox=bbox, zoom=zoom)
+
+def _read_table(table_name, columns=None):
+    """Lee una tabla (del snapshot si existe). Las columnas pesadas de LAZY_COLUMNS
+    solo se cargan si se piden explícitamente."""
+    dtypes = COMPACT_DTYPES.get(table_name, {})
+    lazy = LAZY_COLUMNS.get(table_name, [])
+    if columns is None:
+        columns = [c for c in TABLE_SCHEMAS[table_name]['columns'] if c not in lazy]
+    pre = _from_preload(table_name, columns)
+    if pre is not None:
+        return pre
+    path = snapshot_path(table_name)
+    if not path.exists():
+        return read_from_sqlite(table_name, columns=columns)
+    wanted_lazy = [c for c in columns if c in lazy]
+    text_path = text_snapshot_path(table_name)
+    if not wanted_lazy or not text_path.exists():
+        # snapshot anterior con el texto en el mismo archivo
+        if any(c not in _snapshot_columns(path) for c in wanted_lazy):
+            return read_from_sqlite(table_name, columns=columns)
+        return _read_snapshot(path, columns=columns, dtypes=dtypes)
+    df = _read_snapshot(path, columns=[c for c in columns if c not in lazy], dtypes=dtypes)
+    text = _read_snapshot(text_path, columns=wanted_lazy, dtypes=dtypes)
+    if len(text) != len(df):
+        # los dos archivos son de versiones distintas (reemplazo en curso)
+        return read_from_sqlite(table_name, columns=columns)
+    return pd.concat([df, text], axis=1)[columns]
+
+@metrics.timed('get_sample', rows=lambda res: len(res[0]))
+def get_sample(table_name, columns, derived=None):
+    """Muestra aleatoria de business o review (mantenida en la ingesta, ver sampling):
+    devuelve las filas (columns + stratum, más las columnas de derived {tabla: [columnas]})
+    y la población de cada estrato."""
+    with _reading() as conn:
+        if not db_handler.has_tables(conn, sampling.sample_table(table_name), table_name, *(derived or {})):
+            return pd.DataFrame(columns=[*columns, 'stratum']), pd.Series(dtype='int64')
+        return sampling.read(conn, table_name, columns, derived=derived)
+
+@metrics.timed('get_review_summary')
+def get_review_summary(top=10, category=None, city=None):
+    """Resumen de las reseñas desde los sketches de las cargas (memoria constante): usuarios
+    distintos (en total y de category), categorías y negocios con más reseñas y distribución
+    de estrellas (total o de city). None si no hay reseñas resumidas."""
+    with _reading() as conn:
+        if not db_handler.has_tables(conn, sketches.SKETCH_TABLE):
+            return None
+        sketch, uploads = sketches.load_merged(conn)
+    if uploads == 0:
+        return None
+    return dict(sketch.summary(top=top, category=category, city=city), uploads=uploads)
+
+@metrics.timed('search_reviews')
+def search_reviews(q, top=20, limit=10):
+    """Demanda alrededor de un término: reseñas cuyo texto cumple q (índice FTS, ver
+    text_index), con conteos por categoría, ciudad y mes y los fragmentos más relevantes.
+    ValueError si q no tiene términos; None si el índice todavía no existe (se construye en la
+    ingesta de reseñas, nunca desde una consulta)."""
+    match = text_index.match_expression(q)
+    with _reading() as conn:
+        if not text_index.is_built(conn):
+            return None
+        return text_index.search(conn, match, top=top, limit=limit)
+
+def get_business_from_db(columns=None):
+    return _read_table("business", columns=columns)
+
+def get_review_from_db(columns=None):
+    return _read_table("review", columns=columns)
+
+@metrics.timed('update_review_sentiment', rows=int)
+def update_review_sentiment(score_fn, chunksize=BATCH_SIZE):
+    """Puntúa con score_fn(textos) solo las reseñas que aún no tienen polaridad guardada."""
+    with engine.begin() as conn:
+        _ensure_schema(conn, "review")
+    scored, last = 0, 0
+    while True:
+        # se avanza por rowid (keyset): cada lote sigue donde terminó el anterior en lugar de
+        # volver a recorrer desde el principio las reseñas ya puntuadas
+        chunk = pd.read_sql(
+            "SELECT r.rowid AS rid, r.review_id, r.text FROM review r "
+            "LEFT JOIN review_sentiment s ON s.review_id = r.review_id "
+            "WHERE r.rowid > ? AND s.review_id IS NULL ORDER BY r.rowid LIMIT ?",
+            read_engine, params=(last, chunksize)
+        )
+        if chunk.empty:
+            return scored
+        last = int(chunk['rid'].iloc[-1])
+        polarity = score_fn(chunk['text'])
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT OR REPLACE INTO review_sentiment (review_id, polarity) VALUES (?, ?)",
+                list(zip(chunk['review_id'], (float(p) for p in polarity)))
+            )
+            _ensure_rollups(conn)
+            rollups.add_sentiment(conn, chunk['review_id'])
+        scored += len(chunk)
+
+@metrics.timed('update_review_topics', rows=int)
+def update_review_topics(assign_fn, chunksize=BATCH_SIZE):
+    """Asigna tópico con assign_fn(textos, reset) a las reseñas que aún no lo tienen.
+    reset es True cuando no hay ninguna asignación previa (datos reemplazados). Las reseñas a
+    las que assign_fn no asigna tópico (-1: lote sin vocabulario) quedan sin asignar y se
+    reintentan en la próxima ingesta."""
+    with engine.begin() as conn:
+        _ensure_schema(conn, "review")
+        # versiones anteriores guardaban -1 como asignación definitiva
+        conn.exec_driver_sql("DELETE FROM review_topic WHERE topic < 0")
+        reset = conn.exec_driver_sql("SELECT 1 FROM review_topic LIMIT 1").fetchone() is None
+    assigned, last = 0, 0
+    while True:
+        # keyset por rowid, como en update_review_sentiment
+        chunk = pd.read_sql(
+            "SELECT r.rowid AS rid, r.review_id, r.text FROM review r "
+            "LEFT JOIN review_topic t ON t.review_id = r.review_id "
+            "WHERE r.rowid > ? AND t.review_id IS NULL ORDER BY r.rowid LIMIT ?",
+            read_engine, params=(last, chunksize)
+        )
+        if chunk.empty:
+            return assigned
+        last = int(chunk['rid'].iloc[-1])
+        topics = np.asarray(assign_fn(chunk['text'], reset), dtype=int)
+        ok = topics >= 0
+        if not ok.any():
+            # sin modelo nuevo: el próximo lote todavía debe descartar el anterior si reset
+            continue
+        reset = False
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT OR REPLACE INTO review_topic (review_id, topic) VALUES (?, ?)",
+                list(zip(chunk['review_id'][ok], (int(t) for t in topics[ok])))
+            )
+        assigned += int(ok.sum())
+
+@metrics.timed('get_topic_counts')
+def get_topic_counts(business_id=None, category=None):
+    """Reseñas por tópico, opcionalmente filtradas por negocio o por categoría."""
+    sql = "SELECT t.topic, COUNT(*) AS reviews FROM review_topic t JOIN review r ON r.review_id = t.review_id"
+    params = []
+    where = []
+    if category:
+        sql += (" JOIN business_category bc ON bc.business_id = r.business_id"
+                " JOIN category c ON c.category_id = bc.category_id")
+        where.append("c.name = ?")
+        params.append(category)
+    if business_id:
+        where.append("r.business_id = ?")
+        params.append(business_id)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " GROUP BY t.topic ORDER BY t.topic"
+    with _reading() as conn:
+        return pd.read_sql(sql, conn, params=tuple(params))
+
+@metrics.timed('get_monthly_trends', rows=len)
+def get_monthly_trends(start=None, end=None, category=None, city=None):
+    """Serie mensual de reseñas, estrellas y sentimiento promedio desde los agregados
+    (no recorre review). start y end son meses 'YYYY-MM' inclusive."""
+    with _reading() as conn:
+        return rollups.query(conn, start=start, end=end, category=category, city=city)
+
+def get_review_totals():
+    """Cantidad total de reseñas y polaridad promedio (de las ya puntuadas)."""
+    with _reading() as conn:
+        return rollups.totals(conn)
+
+def get_review_sentiment():
+    """Polaridad persistida por review_id."""
+    with _reading() as conn:
+        return pd.read_sql("SELECT review_id, polarity FROM review_sentiment", conn)
+
+def iter_review_text(chunksize=BATCH_SIZE):
+    """Recorre el texto de las reseñas por lotes (desde el snapshot si existe)."""
+    path = text_snapshot_path("review")
+    if not path.exists() and snapshot_path("review").exists() and 'text' in _snapshot_columns(snapshot_path("review")):
+        path = snapshot_path("review")
+    if path.exists():
+        with pa.memory_map(str(path)) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i).column('text').to_pandas()
+    else:
+        with _reading() as conn:
+            for chunk in pd.read_sql("SELECT text FROM review", conn, chunksize=chunksize):
+                yield chunk['text']
+
+# Orden de las consultas paginadas por categoría (expresión SQL sobre las columnas agregadas)
+CATEGORY_ORDERS = {
+    'category': None,
+    'gap': 'reviews - businesses_count',
+    'opportunity': 'avg_reviews / (businesses_count + 1.0)'
+}
+
+# descendente por la métrica, NULL al final y alfabético en empates (mismo orden que _ordered_frame)
+SORT_KEY_ORDER = "sort_key IS NULL, sort_key DESC, category"
+
+def _category_aggregates_sql(city=None, category=None, min_reviews=None):
+    # oferta/demanda por categoría; los filtros se aplican en el WHERE antes del GROUP BY
+    where, params = [], []
+    if city:
+        where.append("b.city = ? COLLATE NOCASE")
+        params.append(city)
+    if category:
+        where.append("c.name = ? COLLATE NOCASE")
+        params.append(category)
+    if min_reviews is not None:
+        where.append("b.review_count >= ?")
+        params.append(min_reviews)
+    sql = (
+        "WITH per_business AS ("
+        "  SELECT business_id, COUNT(*) AS reviews FROM review GROUP BY business_id"
+        ") "
+        "SELECT c.name AS category, COUNT(*) AS businesses_count, "
+        "       AVG(b.review_count) AS avg_reviews, SUM(b.review_count) AS total_reviews, "
+        "       COALESCE(SUM(pb.reviews), 0) AS reviews "
+        "FROM business_category bc "
+        "JOIN category c ON c.category_id = bc.category_id "
+        "JOIN business b ON b.business_id = bc.business_id "
+        "LEFT JOIN per_business pb ON pb.business_id = bc.business_id "
+        + ("WHERE " + " AND ".join(where) + " " if where else "") +
+        "GROUP BY bc.category_id"
+    )
+    return sql, params
+
+def _has_category_data(conn):
+    if not db_handler.has_tables(conn, 'business', 'review', 'category', 'business_category'):
+        return False
+    return conn.exec_driver_sql("SELECT 1 FROM review LIMIT 1").fetchone() is not None
+
+@metrics.timed('get_category_aggregates', rows=len)
+def get_category_aggregates(city=None, category=None, min_reviews=None):
+    """Oferta y demanda por categoría calculadas dentro de SQLite (GROUP BY sobre índices).
+    Columnas: category, businesses_count, avg_reviews y total_reviews (según review_count
+    de business) y reviews (reseñas cargadas en review). Devuelve None si faltan datos."""
+    with _reading() as conn:
+        if not _has_category_data(conn):
+            return None
+        sql, params = _category_aggregates_sql(city, category, min_reviews)
+        return pd.read_sql(f"SELECT * FROM ({sql}) ORDER BY category", conn, params=tuple(params))
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Valores de la última fila de la página anterior; ValueError si el cursor no es válido."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('cursor inválido')
+    if not isinstance(values, list) or not values:
+        raise ValueError('cursor inválido')
+    return values
+
+def _ordered_category_sql(order, city, category, min_reviews):
+    if order not in CATEGORY_ORDERS:
+        raise ValueError(f'orden no soportado: {order}')
+    sql, params = _category_aggregates_sql(city, category, min_reviews)
+    expr = CATEGORY_ORDERS[order]
+    if expr is None:
+        return f"SELECT *, NULL AS sort_key FROM ({sql})", params
+    return f"SELECT *, {expr} AS sort_key FROM ({sql})", params
+
+@metrics.timed('page_category_aggregates', rows=lambda page: len(page[0]) if page[0] is not None else None)
+def page_category_aggregates(order='gap', cursor=None, limit=50, city=None, category=None, min_reviews=None):
+    """Una página de categorías agregadas (keyset pagination sobre el orden pedido).
+    Devuelve (DataFrame, cursor de la página siguiente o None); DataFrame None si faltan datos."""
+    sql, params = _ordered_category_sql(order, city, category, min_reviews)
+    # orden descendente por la métrica y alfabético en empates; por categoría, alfabético
+    if CATEGORY_ORDERS[order] is None:
+        order_by = "category"
+        if cursor:
+            sql = f"SELECT * FROM ({sql}) WHERE category > ?"
+            params = params + [decode_cursor(cursor)[-1]]
+    else:
+        order_by = SORT_KEY_ORDER
+        if cursor:
+            # las métricas NULL (sin reseñas) van al final, como na_position='last' en pandas
+            key, last = decode_cursor(cursor)[-2:]
+            if key is None:
+                sql = f"SELECT * FROM ({sql}) WHERE sort_key IS NULL AND category > ?"
+                params = params + [last]
+            else:
+                sql = (f"SELECT * FROM ({sql}) "
+                       "WHERE sort_key < ? OR sort_key IS NULL OR (sort_key = ? AND category > ?)")
+                params = params + [key, key, last]
+    with _reading() as conn:
+        if not _has_category_data(conn):
+            return None, None
+        df = pd.read_sql(
+            f"SELECT * FROM ({sql}) ORDER BY {order_by} LIMIT ?", conn, params=tuple(params + [limit + 1])
+        )
+    return _page(df, limit)
+
+def _page(df, limit):
+    # df trae hasta limit + 1 filas ordenadas: la sobrante indica que hay página siguiente
+    next_cursor = None
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        last = df.iloc[-1]
+        next_cursor = encode_cursor([None if pd.isna(last['sort_key']) else float(last['sort_key']), last['category']])
+    return df.drop(columns=['sort_key']), next_cursor
+
+def _ordered_frame(df, order):
+    # mismo orden que en SQLite (las expresiones de CATEGORY_ORDERS también son válidas en pandas)
+    if order not in CATEGORY_ORDERS:
+        raise ValueError(f'orden no soportado: {order}')
+    expr = CATEGORY_ORDERS[order]
+    if expr is None:
+        return df.assign(sort_key=None).sort_values('category')
+    return df.assign(sort_key=df.eval(expr)).sort_values(
+        ['sort_key', 'category'], ascending=[False, True], na_position='last'
+    )
+
+def page_frame_aggregates(df, order='gap', cursor=None, limit=50):
+    """Como page_category_aggregates, sobre categorías ya agregadas en un DataFrame
+    (p. ej. las del último archivo subido); acepta los mismos cursores."""
+    df = _ordered_frame(df, order)
+    if cursor:
+        if CATEGORY_ORDERS[order] is None:
+            df = df[df['category'] > decode_cursor(cursor)[-1]]
+        else:
+            key, last = decode_cursor(cursor)[-2:]
+            after = (df['category'] > last) & (df['sort_key'].isna() if key is None else df['sort_key'] == key)
+            if key is not None:
+                after |= (df['sort_key'] < key) | df['sort_key'].isna()
+            df = df[after]
+    return _page(df.head(limit + 1).reset_index(drop=True), limit)
+
+def iter_frame_aggregates(df, order='gap', chunksize=BATCH_SIZE):
+    """Como iter_category_aggregates, sobre categorías ya agregadas en un DataFrame."""
+    df = _ordered_frame(df, order).drop(columns=['sort_key']).reset_index(drop=True)
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+def iter_category_aggregates(order='gap', city=None, category=None, min_reviews=None, chunksize=BATCH_SIZE):
+    """Categorías agregadas en el orden pedido, por lotes (para respuestas en streaming)."""
+    sql, params = _ordered_category_sql(order, city, category, min_reviews)
+    order_by = "category" if CATEGORY_ORDERS[order] is None else SORT_KEY_ORDER
+    with _reading() as conn:
+        if not _has_category_data(conn):
+            return
+        for chunk in pd.read_sql(
+            f"SELECT * FROM ({sql}) ORDER BY {order_by}", conn, params=tuple(params), chunksize=chunksize
+        ):
+            yield chunk.drop(columns=['sort_key'])
 
-def get_review_from_db():
-    return read_from_sqlite("review")
+@metrics.timed('get_business_categories', rows=lambda res: len(res[0]))
+def get_business_categories():
+    """Devuelve los pares (business_id, category_id) y el diccionario category_id -> nombre."""
+    with _reading() as conn:
+        pairs = pd.read_sql("SELECT business_id, category_id FROM business_category", conn)
+        names = pd.read_sql("SELECT category_id, name FROM category", conn, index_col='category_id')['name']
+    return pairs, names
@@ -1,14 +1,68 @@
 # db_handler.py
+# Única capa de acceso a SQLite: un engine de escritura y un pool de conexiones de solo
+# lectura sobre el mismo archivo dss.db (ruta absoluta). La base trabaja en modo WAL, así las
+# lecturas de los workers no esperan a una carga en curso: ven la última versión confirmada.
+import os
+from pathlib import Path
+
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+
+sqlite_db = Path(__file__).parent / "dss.db"  # archivo SQLite local
+
+# Ajustes de SQLite (por conexión)
+CACHE_MB = int(os.environ.get('DSS_SQLITE_CACHE_MB', 64))
+MMAP_MB = int(os.environ.get('DSS_SQLITE_MMAP_MB', 256))
+BUSY_TIMEOUT_MS = 60000
+# tamaño al que se trunca el WAL después de cada checkpoint
+JOURNAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+def _pragmas(dbapi_conn, read_only):
+    # el driver no abre transacciones por su cuenta: las abre el evento "begin" (ver create_engines)
+    dbapi_conn.isolation_level = None
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA cache_size=-{CACHE_MB * 1024}")
+    cur.execute(f"PRAGMA mmap_size={MMAP_MB * 1024 * 1024}")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute(f"PRAGMA journal_size_limit={JOURNAL_SIZE_LIMIT}")
+    if read_only:
+        cur.execute("PRAGMA query_only=ON")
+    cur.close()
+
+def create_engines(path):
+    """Engine de escritura y engine de solo lectura (pool) para el archivo SQLite path.
+    Cada transacción de escritura empieza con BEGIN IMMEDIATE (toma el lock de escritura al
+    inicio, incluido el DDL, así un reemplazo de tabla es atómico); las de lectura con BEGIN,
+    que fija una vista consistente de la base mientras dure la transacción."""
+    engines = []
+    for read_only, begin in ((False, "BEGIN IMMEDIATE"), (True, "BEGIN")):
+        eng = create_engine(f"sqlite:///{path}")
+        event.listen(eng, "connect", lambda dbapi_conn, record, ro=read_only: _pragmas(dbapi_conn, ro))
+        event.listen(eng, "begin", lambda conn, sql=begin: conn.exec_driver_sql(sql))
+        engines.append(eng)
+    return tuple(engines)
+
+engine, read_engine = create_engines(sqlite_db)
+
+def has_tables(conn, *names):
+    """True si existen todas las tablas names (las consultas no crean las que faltan)."""
+    found = {r[0] for r in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type='table'")}
+    return all(n in found for n in names)
 
-# Conexión a SQLite (se crea un archivo local dss.db en tu carpeta del proyecto)
-engine = create_engine("sqlite:///dss.db")
+def is_busy(exc):
+    """True si exc es SQLite esperando el lock de escritura de otra conexión (carga en curso)."""
+    return isinstance(exc, OperationalError) and any(w in str(exc.orig) for w in ('locked', 'busy'))
 
 def save_dataframe_to_db(df, table_name):
     """Guarda un DataFrame en SQLite (crea tabla si no existe)"""
-    df.to_sql(table_name, engine, if_exists="replace", index=False)
+    with engine.begin() as conn:
+        df.to_sql(table_name, conn, if_exists="replace", index=False)
 
 def read_table_from_db(table_name):
     """Lee una tabla de SQLite y la devuelve como DataFrame"""
-    return pd.read_sql(f"SELECT * FROM {table_name}", engine)
+    with read_engine.begin() as conn:
+        return pd.read_sql(f"SELECT * FROM {table_name}", conn)
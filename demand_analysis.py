@@ -1,53 +1,242 @@
 import pandas as pd
-import io, base64
-from textblob import TextBlob
-from wordcloud import WordCloud
-from sklearn.decomposition import LatentDirichletAllocation
-from sklearn.feature_extraction.text import CountVectorizer
+import numpy as np
+import io, base64, os, fcntl
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from sampling import domain_estimates, CONFIDENCE
+import metrics
 
-def generate_wordcloud_base64(text, max_words=150):
-    if not text:
-        text = "sin datos"
-    wc = WordCloud(width=800, height=400, background_color='white', max_words=max_words).generate(text)
+# Las dependencias de NLP (scikit-learn, wordcloud, TextBlob/NLTK, joblib) se importan dentro
+# de cada función: un worker solo las carga cuando atiende por primera vez una ruta de demanda.
+
+# Reseñas por lote al contar términos para la nube de palabras
+WORDCLOUD_CHUNK = 20000
+
+@metrics.timed('term_frequencies')
+def term_frequencies(text_chunks):
+    """Frecuencia de términos acumulada lote a lote (sin unir todas las reseñas en un solo string)."""
+    from sklearn.feature_extraction.text import CountVectorizer
+    from wordcloud import STOPWORDS
+
+    counts = {}
+    vec = CountVectorizer(token_pattern=r"(?u)\b\w[\w']+\b")
+    for chunk in text_chunks:
+        texts = pd.Series(chunk).dropna().astype(str)
+        if texts.empty:
+            continue
+        try:
+            X = vec.fit_transform(texts)
+        except ValueError:
+            continue
+        sums = np.asarray(X.sum(axis=0)).ravel()
+        for term, n in zip(vec.get_feature_names_out(), sums):
+            if term not in STOPWORDS:
+                counts[term] = counts.get(term, 0) + int(n)
+    return counts
+
+@metrics.timed('render_wordcloud_png')
+def render_wordcloud_png(frequencies, max_words=150):
+    """Genera la nube de palabras (PNG en bytes) a partir de frecuencias ya calculadas."""
+    from wordcloud import WordCloud
+
+    if not frequencies:
+        frequencies = {'sin': 1, 'datos': 1}
+    wc = WordCloud(width=800, height=400, background_color='white', max_words=max_words)
+    wc.generate_from_frequencies(frequencies)
     buf = io.BytesIO()
     wc.to_image().save(buf, format='PNG')
-    return base64.b64encode(buf.getvalue()).decode('utf-8')
+    return buf.getvalue()
+
+def generate_wordcloud_base64(text, max_words=150):
+    png = render_wordcloud_png(term_frequencies([[text]] if text else []), max_words=max_words)
+    return base64.b64encode(png).decode('utf-8')
+
+# Procesos para puntuar sentimiento (1 = sin pool de procesos)
+SENTIMENT_JOBS = int(os.environ.get('DSS_SENTIMENT_JOBS', 1))
+SENTIMENT_CHUNK = 20000
+
+_lexicon_vectorizer = None
+_lexicon_weights = None
+
+def _sentiment_lexicon():
+    """Vectorizador con vocabulario fijo (léxico de TextBlob/pattern) y pesos de polaridad."""
+    global _lexicon_vectorizer, _lexicon_weights
+    if _lexicon_vectorizer is None:
+        from textblob.en import sentiment as pattern_lexicon
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        pattern_lexicon.load()
+        words = sorted(w for w in pattern_lexicon if ' ' not in w and None in pattern_lexicon[w])
+        _lexicon_weights = np.array([pattern_lexicon[w][None][0] for w in words])
+        _lexicon_vectorizer = CountVectorizer(vocabulary=words, token_pattern=r"(?u)\b[\w']+\b")
+    return _lexicon_vectorizer, _lexicon_weights
+
+def _polarity_chunk(texts):
+    vec, weights = _sentiment_lexicon()
+    X = vec.transform(texts)
+    hits = np.asarray(X.sum(axis=1)).ravel()
+    total = X @ weights
+    return np.divide(total, hits, out=np.zeros(len(hits)), where=hits > 0)
+
+@metrics.timed('polarity_scores', rows=len)
+def polarity_scores(texts, n_jobs=None):
+    """Polaridad de una columna completa de textos con una matriz documento-término dispersa.
+    Es el promedio de la polaridad del léxico de TextBlob sobre las palabras encontradas
+    (sin las reglas de negación/intensificadores de TextBlob). Con n_jobs > 1 usa un pool de procesos."""
+    texts = pd.Series(texts).fillna('').astype(str).tolist()
+    n_jobs = SENTIMENT_JOBS if n_jobs is None else n_jobs
+    if not texts:
+        return np.zeros(0)
+    if n_jobs <= 1 or len(texts) <= SENTIMENT_CHUNK:
+        return _polarity_chunk(texts)
+    chunks = [texts[i:i + SENTIMENT_CHUNK] for i in range(0, len(texts), SENTIMENT_CHUNK)]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        return np.concatenate(list(pool.map(_polarity_chunk, chunks)))
 
 def sentiment_polarity_series(reviews_df, text_col='text'):
     reviews_df = reviews_df.copy()
-    reviews_df['polarity'] = reviews_df[text_col].astype(str).apply(lambda t: TextBlob(t).sentiment.polarity)
+    if 'polarity' not in reviews_df.columns:
+        reviews_df['polarity'] = np.nan
+    # solo se puntúan las reseñas sin polaridad persistida
+    missing = reviews_df['polarity'].isna()
+    if missing.any():
+        reviews_df.loc[missing, 'polarity'] = polarity_scores(reviews_df.loc[missing, text_col])
     return reviews_df
 
+@metrics.timed('aggregate_time_series')
 def aggregate_time_series(reviews_df, date_col='date'):
     df = reviews_df.copy()
     df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
     ts = df.groupby(df[date_col].dt.to_period('M')).size()
     return ts.sort_index().to_dict()
 
+@metrics.timed('sample_demand', rows=lambda res: res['sample']['rows'])
+def sample_demand(sample, population):
+    """Sentimiento promedio y reseñas por mes estimados sobre la muestra de reseñas
+    (columnas stratum, text, date y opcionalmente polarity; ver sampling), con intervalos
+    de confianza. Solo se puntúan las reseñas sin polaridad guardada."""
+    sample = sentiment_polarity_series(sample).assign(
+        month=pd.to_datetime(sample['date'], errors='coerce').dt.strftime('%Y-%m').fillna(''),
+        all=''
+    )
+    sampled = sample.groupby('stratum', observed=True).size()
+    overall = domain_estimates(sample, sampled, population, 'all', value='polarity').iloc[0]
+    months = domain_estimates(sample, sampled, population, 'month')
+    months = months[months['month'] != ''].sort_values('month')
+    return {
+        'avg_sentiment': float(overall['mean']),
+        'avg_sentiment_ci': [float(overall['mean_low']), float(overall['mean_high'])],
+        'time_series': dict(zip(months['month'], months['count'].round(1).tolist())),
+        'time_series_ci': {
+            m: [round(float(lo), 1), round(float(hi), 1)]
+            for m, lo, hi in zip(months['month'], months['count_low'], months['count_high'])
+        },
+        'sample': {'rows': len(sample), 'population': int(population.sum()), 'confidence': CONFIDENCE}
+    }
+
+def _topic_words(vec, lda, n_words=8):
+    features = vec.get_feature_names_out()
+    topics = []
+    for topic_idx, comp in enumerate(lda.components_):
+        terms = [features[i] for i in comp.argsort()[-n_words:][::-1]]
+        topics.append({'topic': topic_idx, 'words': terms})
+    return topics
+
+@metrics.timed('basic_topic_modeling')
 def basic_topic_modeling(texts, n_topics=4, max_features=1000):
+    from sklearn.decomposition import LatentDirichletAllocation
+    from sklearn.feature_extraction.text import CountVectorizer
+
     if not texts:
         return []
     vec = CountVectorizer(max_features=max_features, stop_words='english')
     X = vec.fit_transform(texts)
     lda = LatentDirichletAllocation(n_components=n_topics, random_state=0)
     lda.fit(X)
-    features = vec.get_feature_names_out()
-    topics = []
-    for topic_idx, comp in enumerate(lda.components_):
-        terms = [features[i] for i in comp.argsort()[-8:][::-1]]
-        topics.append({'topic': topic_idx, 'words': terms})
-    return topics
+    return _topic_words(vec, lda)
 
-def analyze_reviews_from_df(reviews_df, text_col='text', date_col='date', n_topics=4):
-    all_text = " ".join(reviews_df[text_col].astype(str).tolist())
-    wc_b64 = generate_wordcloud_base64(all_text)
+# ----------------------------
+# Modelo de tópicos persistido (LDA online con partial_fit)
+# ----------------------------
+topic_model_path = Path(__file__).parent / 'storage' / 'topic_model.joblib'
+# Tamaño estimado del corpus completo para el aprendizaje online de LDA
+TOPIC_TOTAL_SAMPLES = 1000000
+
+@contextmanager
+def _topic_model_lock():
+    # evita que dos workers actualicen el modelo al mismo tiempo
+    with open(topic_model_path.with_suffix('.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _load_topic_model():
+    import joblib
+
+    if topic_model_path.exists():
+        return joblib.load(topic_model_path)
+    return None
+
+@metrics.timed('update_topic_model', rows=len)
+def update_topic_model(texts, reset=False, n_topics=4, max_features=1000):
+    """Actualiza el modelo persistido con un lote de reseñas nuevas (partial_fit)
+    y devuelve el tópico dominante de cada una. El vocabulario se fija con el primer lote;
+    reset=True descarta el modelo anterior."""
+    import joblib
+    from sklearn.decomposition import LatentDirichletAllocation
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    texts = pd.Series(texts).fillna('').astype(str).tolist()
+    with _topic_model_lock():
+        model = None if reset else _load_topic_model()
+        if model is None:
+            vec = CountVectorizer(max_features=max_features, stop_words='english')
+            try:
+                vec.fit(texts)
+            except ValueError:
+                # lote sin vocabulario útil (vacío o solo stop words)
+                return np.full(len(texts), -1)
+            lda = LatentDirichletAllocation(
+                n_components=n_topics, learning_method='online',
+                total_samples=TOPIC_TOTAL_SAMPLES, random_state=0
+            )
+            model = {'vectorizer': vec, 'lda': lda, 'n_docs': 0}
+        X = model['vectorizer'].transform(texts)
+        model['lda'].partial_fit(X)
+        model['n_docs'] += len(texts)
+        tmp = topic_model_path.with_suffix('.tmp')
+        joblib.dump(model, tmp)
+        os.replace(tmp, topic_model_path)
+    return model['lda'].transform(X).argmax(axis=1)
+
+def stored_topics(n_words=8):
+    """Tópicos del modelo persistido (sin reentrenar)."""
+    model = _load_topic_model()
+    if model is None:
+        return []
+    return _topic_words(model['vectorizer'], model['lda'], n_words=n_words)
+
+@metrics.timed('analyze_reviews_from_df')
+def analyze_reviews_from_df(reviews_df, text_col='text', date_col='date', n_topics=4, topics=None, wordcloud=True):
+    """Con wordcloud=False no se genera la nube (se sirve aparte como PNG en caché)."""
+    results = {}
+    if wordcloud:
+        freqs = term_frequencies(
+            reviews_df[text_col].iloc[i:i + WORDCLOUD_CHUNK] for i in range(0, len(reviews_df), WORDCLOUD_CHUNK)
+        )
+        png = render_wordcloud_png(freqs)
+        results['wordcloud_b64'] = base64.b64encode(png).decode('utf-8')
     reviews_df2 = sentiment_polarity_series(reviews_df, text_col=text_col)
     avg_sent = reviews_df2['polarity'].mean() if not reviews_df2.empty else 0.0
     ts = aggregate_time_series(reviews_df2, date_col=date_col)
-    topics = basic_topic_modeling(reviews_df[text_col].astype(str).tolist(), n_topics=n_topics)
-    return {
-        'wordcloud_b64': wc_b64,
+    if topics is None:
+        topics = basic_topic_modeling(reviews_df[text_col].astype(str).tolist(), n_topics=n_topics)
+    results.update({
         'avg_sentiment': float(avg_sent),
         'time_series': ts,
         'topics': topics
-    }
+    })
+    return results
@@ -0,0 +1,200 @@
+# history_store.py
+# Histórico de cargas de solo-agregado: un archivo Parquet comprimido por carga más un
+# manifiesto (manifest.jsonl). Agregar una carga no reescribe las anteriores y las
+# exportaciones solo leen archivos ya cerrados, así que no bloquean la ingesta.
+import io, json, os, fcntl, time, uuid, zipfile
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+storage = Path(__file__).parent / 'storage'
+history_dir = storage / 'history'
+manifest_path = history_dir / 'manifest.jsonl'
+exports_dir = history_dir / 'exports'
+legacy_xlsx = storage / 'all_data.xlsx'  # histórico anterior en Excel (se migra una vez)
+
+COMPRESSION = 'zstd'
+# Filas máximas por hoja de Excel (el límite de Excel es 1.048.576 incluyendo el encabezado)
+EXCEL_MAX_ROWS = 1000000
+
+@contextmanager
+def _lock():
+    history_dir.mkdir(parents=True, exist_ok=True)
+    with open(history_dir / '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def arrow_table(df):
+    """Convierte a tabla Arrow; las columnas con tipos mezclados (típico de Excel) pasan a texto."""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        mixed = df.select_dtypes('object').columns
+        return pa.Table.from_pandas(df.astype({c: str for c in mixed}), preserve_index=False)
+
+def _read_manifest():
+    if not manifest_path.exists():
+        return []
+    with manifest_path.open('r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _next_entry(source):
+    entries = _read_manifest()
+    seq = entries[-1]['id'] + 1 if entries else 1
+    return {'id': seq, 'file': f'{seq:06d}_{Path(source).stem[:60]}.parquet', 'source': Path(source).name}
+
+def _register(entry, rows, schema):
+    entry.update({
+        'rows': rows,
+        'columns': schema.names,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S')
+    })
+    with manifest_path.open('a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    return entry
+
+def _migrate_legacy():
+    # se llama con el lock tomado; solo importa all_data.xlsx si aún no hay manifiesto
+    if manifest_path.exists() or not legacy_xlsx.exists():
+        return
+    sheets = pd.read_excel(legacy_xlsx, sheet_name=None)
+    for sheet_name, df in sheets.items():
+        _write(df, f'{sheet_name}.xlsx')
+    manifest_path.touch()
+
+def _write(df, source):
+    entry = _next_entry(source)
+    table = arrow_table(df.reset_index(drop=True))
+    tmp = history_dir / (entry['file'] + '.tmp')
+    pq.write_table(table, tmp, compression=COMPRESSION)
+    os.replace(tmp, history_dir / entry['file'])
+    return _register(entry, table.num_rows, table.schema)
+
+def append(df, source):
+    """Agrega una carga completa al histórico."""
+    with _lock():
+        _migrate_legacy()
+        return _write(df, source)
+
+class BatchWriter:
+    """Agrega una carga al histórico lote a lote (para la ingesta por streaming)."""
+
+    def __init__(self, source, schema):
+        self.source = source
+        self.schema = schema
+        self.rows = 0
+        self.writer = None
+
+    def write(self, df):
+        if self.writer is None:
+            with _lock():
+                _migrate_legacy()
+            # el número de carga se asigna al cerrar; mientras tanto el archivo no está en el manifiesto
+            self.tmp = history_dir / f'{uuid.uuid4().hex}.parquet.tmp'
+            self.writer = pq.ParquetWriter(self.tmp, self.schema, compression=COMPRESSION)
+        self.writer.write_table(pa.Table.from_pandas(df[self.schema.names], schema=self.schema, preserve_index=False))
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is None:
+            return None
+        self.writer.close()
+        with _lock():
+            entry = _next_entry(self.source)
+            os.replace(self.tmp, history_dir / entry['file'])
+            return _register(entry, self.rows, self.schema)
+
+def entries():
+    """Cargas registradas en el histórico (incluye la migración del Excel anterior)."""
+    if not manifest_path.exists() and legacy_xlsx.exists():
+        with _lock():
+            _migrate_legacy()
+    return _read_manifest()
+
+def iter_csv():
+    """Exporta todo el histórico como un único CSV, generado por lotes.
+    Las columnas son la unión de las de todas las cargas más 'upload'."""
+    items = entries()
+    columns = ['upload']
+    for e in items:
+        columns += [c for c in e['columns'] if c not in columns]
+    yield pd.DataFrame(columns=columns).to_csv(index=False)
+    for e in items:
+        pf = pq.ParquetFile(history_dir / e['file'])
+        for batch in pf.iter_batches():
+            df = batch.to_pandas()
+            df.insert(0, 'upload', e['source'])
+            yield df.reindex(columns=columns).to_csv(index=False, header=False)
+
+class _StreamBuffer(io.RawIOBase):
+    # destino no posicionable para zipfile: acumula los bytes escritos hasta que se consumen
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_parquet_zip():
+    """Exporta el histórico como ZIP (sin recomprimir) de los Parquet de cada carga + manifiesto."""
+    items = entries()
+    buf = _StreamBuffer()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as zf:
+        for e in items:
+            with zf.open(e['file'], 'w', force_zip64=True) as dest, open(history_dir / e['file'], 'rb') as src:
+                for block in iter(lambda: src.read(1 << 20), b''):
+                    dest.write(block)
+                    yield buf.drain()
+        zf.writestr('manifest.json', json.dumps(items, ensure_ascii=False, indent=2))
+    yield buf.drain()
+
+def export_xlsx():
+    """Genera (solo si cambió el histórico) un Excel con una hoja por carga y devuelve su ruta."""
+    from openpyxl import Workbook
+
+    items = entries()
+    fp = exports_dir / f'history_{len(items)}.xlsx'
+    if fp.exists():
+        return fp
+    exports_dir.mkdir(parents=True, exist_ok=True)
+    wb = Workbook(write_only=True)
+    used = set()
+    for e in items:
+        pf = pq.ParquetFile(history_dir / e['file'])
+        ws, rows_in_sheet, part = None, 0, 0
+        for batch in pf.iter_batches():
+            for row in batch.to_pandas().astype(object).where(lambda d: d.notna(), None).itertuples(index=False):
+                if ws is None or rows_in_sheet >= EXCEL_MAX_ROWS:
+                    part += 1
+                    base = Path(e['source']).stem[:25] or 'hoja'
+                    title = base if part == 1 else f'{base}_{part}'
+                    if title in used:
+                        title = f'{base[:20]}_{e["id"]}_{part}'
+                    used.add(title)
+                    ws = wb.create_sheet(title=title)
+                    ws.append(pf.schema_arrow.names)
+                    rows_in_sheet = 0
+                ws.append(list(row))
+                rows_in_sheet += 1
+    if not used:
+        wb.create_sheet(title='vacío')
+    tmp = fp.with_suffix('.tmp')
+    wb.save(tmp)
+    os.replace(tmp, fp)
+    for old in exports_dir.glob('history_*.xlsx'):
+        if old != fp:
+            old.unlink(missing_ok=True)
+    return fp
@@ -0,0 +1,82 @@
+# jobs.py
+# Cola de trabajos en segundo plano para procesar las cargas de archivos.
+# Cada proceso de gunicorn tiene su propio pool de hilos, pero el estado de los trabajos
+# se guarda en SQLite para que cualquier worker pueda responder /api/jobs/<id>.
+import os, sqlite3, time, traceback, uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+jobs_db = Path(__file__).parent / 'storage' / 'jobs.db'
+
+# Hilos por proceso para procesar cargas (1 = las cargas de un worker se procesan en orden)
+JOB_WORKERS = int(os.environ.get('DSS_JOB_WORKERS', 1))
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='dss-job')
+
+FIELDS = ['id', 'filename', 'status', 'rows', 'rows_per_sec', 'message', 'error', 'created', 'started', 'finished']
+
+def _connect():
+    conn = sqlite3.connect(jobs_db, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS job ("
+        "id TEXT PRIMARY KEY, filename TEXT, status TEXT NOT NULL, rows INTEGER DEFAULT 0, "
+        "rows_per_sec REAL DEFAULT 0, message TEXT, error TEXT, "
+        "created REAL, started REAL, finished REAL)"
+    )
+    return conn
+
+def _update(job_id, **fields):
+    cols = ", ".join(f"{k}=?" for k in fields)
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(f"UPDATE job SET {cols} WHERE id=?", (*fields.values(), job_id))
+    finally:
+        conn.close()
+
+def get_job(job_id):
+    """Estado del trabajo como dict, o None si no existe."""
+    conn = _connect()
+    try:
+        row = conn.execute(f"SELECT {', '.join(FIELDS)} FROM job WHERE id=?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return dict(zip(FIELDS, row)) if row else None
+
+def _run(job_id, fn):
+    started = time.time()
+    _update(job_id, status='running', started=started)
+
+    def progress(rows):
+        elapsed = time.time() - started
+        _update(job_id, rows=rows, rows_per_sec=round(rows / elapsed, 1) if elapsed > 0 else 0)
+
+    try:
+        result = fn(progress) or {}
+        rows = result.get('rows', 0)
+        elapsed = time.time() - started
+        _update(
+            job_id, status='done', finished=time.time(), rows=rows,
+            rows_per_sec=round(rows / elapsed, 1) if elapsed > 0 else 0,
+            message=result.get('message', '')
+        )
+    except Exception as e:
+        traceback.print_exc()
+        _update(job_id, status='error', finished=time.time(), error=str(e))
+
+def submit(filename, fn):
+    """Encola fn(progress) y devuelve el id del trabajo inmediatamente.
+    fn recibe una función progress(rows) y devuelve un dict con 'rows' y 'message'."""
+    job_id = uuid.uuid4().hex
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO job (id, filename, status, created) VALUES (?, ?, 'queued', ?)",
+                (job_id, filename, time.time())
+            )
+    finally:
+        conn.close()
+    _executor.submit(_run, job_id, fn)
+    return job_id
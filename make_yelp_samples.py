@@ -1,11 +1,34 @@
-import os
+import os, json, heapq, random
 
-def make_sample(infile, outfile, n_lines=10000):
-    """Toma las primeras n_lines de infile y las guarda en outfile."""
-    with open(infile, 'r', encoding='utf-8') as fin, open(outfile, 'w', encoding='utf-8') as fout:
+def make_sample(infile, outfile, n_lines=10000, stratify=None, seed=0):
+    """Muestra aleatoria de n_lines líneas de infile en una sola pasada (reservoir sampling),
+    en el orden original. El dump de Yelp está ordenado, así que las primeras líneas no
+    representan la mezcla de ciudades y categorías.
+    Con stratify (un campo del JSON, p. ej. 'city') se reparten las n_lines por igual entre los
+    estratos; los estratos chicos entran completos y su sobrante pasa a los demás."""
+    rng = random.Random(seed)
+    # por estrato, las n_lines líneas de menor prioridad aleatoria (heap de máximos)
+    reservoirs = {}
+    with open(infile, 'r', encoding='utf-8') as fin:
         for i, line in enumerate(fin):
-            if i >= n_lines:
-                break
+            key = json.loads(line).get(stratify) if stratify else None
+            heap = reservoirs.setdefault(key, [])
+            item = (-rng.random(), i, line)
+            if len(heap) < n_lines:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+    # asignación igualitaria entre estratos (water-filling)
+    sizes = {k: len(h) for k, h in reservoirs.items()}
+    quota, remaining = {}, n_lines
+    for k in sorted(sizes, key=sizes.get):
+        quota[k] = min(sizes[k], remaining // (len(sizes) - len(quota)))
+        remaining -= quota[k]
+    chosen = []
+    for k, heap in reservoirs.items():
+        chosen.extend(heapq.nlargest(quota[k], heap))
+    with open(outfile, 'w', encoding='utf-8') as fout:
+        for _, _, line in sorted(chosen, key=lambda item: item[1]):
             fout.write(line)
 
 if __name__ == "__main__":
@@ -13,7 +36,7 @@ if __name__ == "__main__":
     os.makedirs("uploads", exist_ok=True)
 
     # Guardar los subconjuntos directamente en uploads/
-    make_sample("business.json", os.path.join("uploads", "business_sample.json"), n_lines=5000)
+    make_sample("business.json", os.path.join("uploads", "business_sample.json"), n_lines=5000, stratify="city")
     make_sample("review.json", os.path.join("uploads", "review_sample.json"), n_lines=10000)
 
     print("✅ Subconjuntos creados en la carpeta 'uploads/'")
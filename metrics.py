@@ -0,0 +1,253 @@
+# metrics.py
+# Instrumentación de las etapas del pipeline y de la latencia por ruta, en formato Prometheus.
+# Cada proceso acumula sus métricas en memoria y cada pocos segundos las vuelca a un SQLite
+# compartido (una fila por proceso), así /metrics suma lo de todos los workers de gunicorn.
+import json, os, resource, sqlite3, threading, time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+metrics_db = Path(__file__).parent / 'storage' / 'metrics.db'
+
+# Segundos entre volcados de las métricas del proceso al archivo compartido
+FLUSH_INTERVAL = float(os.environ.get('DSS_METRICS_FLUSH', 5))
+
+# Límites de los histogramas (segundos)
+STAGE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# ru_maxrss viene en KB en Linux
+_RSS_UNIT = 1024
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_lock = threading.Lock()
+_state = {'histograms': {}, 'counters': {}, 'gauges': {}}
+_last_flush = [0.0]
+_local = threading.local()
+
+def _before_fork():
+    # lo medido en el proceso maestro (p. ej. la precarga con gunicorn --preload) se vuelca
+    # una vez con su pid; si no, cada worker lo heredaría y lo volvería a sumar con el suyo
+    try:
+        flush()
+    except sqlite3.Error:
+        pass
+
+def _after_fork_in_child():
+    global _lock
+    _lock = threading.Lock()
+    _state.update({'histograms': {}, 'counters': {}, 'gauges': {}})
+    _last_flush[0] = 0.0
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
+
+def _peak_rss():
+    # pico de toda la vida del proceso (no de una etapa)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+
+def _current_rss():
+    """RSS actual del proceso (Linux: /proc/self/statm), o None si no se puede leer."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+def observe(name, value, buckets, **labels):
+    """Registra una observación en un histograma."""
+    with _lock:
+        h = _state['histograms'].setdefault(
+            _key(name, labels), {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        )
+        for i, le in enumerate(h['buckets']):
+            if value <= le:
+                h['counts'][i] += 1
+        h['sum'] += value
+        h['count'] += 1
+    _maybe_flush()
+
+def inc(name, value=1, **labels):
+    with _lock:
+        key = _key(name, labels)
+        _state['counters'][key] = _state['counters'].get(key, 0) + value
+
+def gauge_max(name, value, **labels):
+    with _lock:
+        key = _key(name, labels)
+        _state['gauges'][key] = max(_state['gauges'].get(key, 0), value)
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+
+@contextmanager
+def stage(name):
+    """Mide tiempo, filas (asignando st.rows) y cuánto creció el RSS durante una etapa:
+
+        with metrics.stage('read_from_sqlite') as st:
+            df = ...
+            st.rows = len(df)
+    """
+    st = _Stage(name)
+    rss_before = _current_rss()
+    started = time.perf_counter()
+    try:
+        yield st
+    finally:
+        seconds = time.perf_counter() - started
+        rss_after = _current_rss()
+        # RSS al terminar menos RSS al empezar (memoria que la etapa dejó ocupada; lo que liberó
+        # antes de terminar no se ve)
+        growth = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+        observe('dss_stage_seconds', seconds, STAGE_BUCKETS, stage=name)
+        if st.rows:
+            inc('dss_stage_rows_total', st.rows, stage=name)
+        if growth is not None:
+            gauge_max('dss_stage_rss_growth_bytes', max(growth, 0), stage=name)
+        # etapas de la petición en curso (para el perfil de administrador)
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.append({
+                'stage': name, 'seconds': round(seconds, 4), 'rows': st.rows,
+                'rss_mb': round(rss_after / 2**20, 1) if rss_after is not None else None,
+                'rss_growth_mb': round(growth / 2**20, 1) if growth is not None else None
+            })
+
+def timed(name, rows=None):
+    """Decorador de stage(); rows(resultado) indica cuántas filas procesó la llamada."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name) as st:
+                result = fn(*args, **kwargs)
+                if rows is not None and result is not None:
+                    try:
+                        st.rows = rows(result)
+                    except Exception:
+                        pass
+                return result
+        return wrapper
+    return decorator
+
+def start_trace():
+    _local.trace = []
+
+def stop_trace():
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace or []
+
+# --- Volcado y exposición ---
+def _connect():
+    conn = sqlite3.connect(metrics_db, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS process_metrics (pid INTEGER PRIMARY KEY, data TEXT NOT NULL, updated REAL)")
+    return conn
+
+def flush():
+    """Guarda las métricas de este proceso en el archivo compartido."""
+    with _lock:
+        data = json.dumps(_state)
+        _last_flush[0] = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO process_metrics (pid, data, updated) VALUES (?, ?, ?)",
+                (os.getpid(), data, time.time())
+            )
+    finally:
+        conn.close()
+
+def _maybe_flush():
+    if time.time() - _last_flush[0] >= FLUSH_INTERVAL:
+        try:
+            flush()
+        except sqlite3.Error:
+            pass
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # existe, pero es de otro usuario
+        pass
+    return True
+
+def _merged():
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT pid, data FROM process_metrics").fetchall()
+        # las filas de workers que ya terminaron (reciclados o reiniciados) se descartan: sus
+        # contadores dejan de sumar (para Prometheus es un reinicio de contador)
+        dead = {pid for pid, _ in rows if not _alive(pid)}
+        if dead:
+            with conn:
+                conn.executemany("DELETE FROM process_metrics WHERE pid = ?", [(pid,) for pid in dead])
+            rows = [r for r in rows if r[0] not in dead]
+    finally:
+        conn.close()
+    merged = {'histograms': {}, 'counters': {}, 'gauges': {}}
+    for pid, data in rows:
+        state = json.loads(data)
+        for key, h in state['histograms'].items():
+            m = merged['histograms'].setdefault(
+                key, {'buckets': h['buckets'], 'counts': [0] * len(h['buckets']), 'sum': 0.0, 'count': 0}
+            )
+            m['counts'] = [a + b for a, b in zip(m['counts'], h['counts'])]
+            m['sum'] += h['sum']
+            m['count'] += h['count']
+        for key, v in state['counters'].items():
+            merged['counters'][key] = merged['counters'].get(key, 0) + v
+        for key, v in state['gauges'].items():
+            merged['gauges'][key] = max(merged['gauges'].get(key, 0), v)
+    return merged
+
+def _labels(pairs, extra=None):
+    pairs = list(pairs) + (extra or [])
+    if not pairs:
+        return ''
+    esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+
+HELP = {
+    'dss_stage_seconds': ('histogram', 'Duración de cada etapa del pipeline'),
+    'dss_stage_rows_total': ('counter', 'Filas procesadas por etapa'),
+    'dss_stage_rss_growth_bytes': ('gauge', 'Mayor crecimiento del RSS entre el inicio y el fin de la etapa'),
+    'dss_request_seconds': ('histogram', 'Latencia de las peticiones por ruta')
+}
+
+def render():
+    """Métricas de todos los procesos en formato de texto de Prometheus."""
+    flush()
+    merged = _merged()
+    series = {}
+    for kind in ('histograms', 'counters', 'gauges'):
+        for key, value in merged[kind].items():
+            name, labels = json.loads(key)
+            series.setdefault(name, []).append((labels, value))
+    lines = []
+    for name in sorted(series):
+        kind, text = HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(series[name], key=lambda s: s[0]):
+            if kind == 'histogram':
+                for le, n in zip(value['buckets'], value['counts']):
+                    lines.append(f'{name}_bucket{_labels(labels, [("le", le)])} {n}')
+                lines.append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {value["count"]}')
+                lines.append(f'{name}_sum{_labels(labels)} {value["sum"]}')
+                lines.append(f'{name}_count{_labels(labels)} {value["count"]}')
+            else:
+                lines.append(f'{name}{_labels(labels)} {value}')
+    lines.append('# HELP dss_process_peak_rss_bytes Pico de RSS de este worker (ru_maxrss, desde que arrancó)')
+    lines.append('# TYPE dss_process_peak_rss_bytes gauge')
+    lines.append(f'dss_process_peak_rss_bytes{_labels([("pid", os.getpid())])} {_peak_rss()}')
+    return '\n'.join(lines) + '\n'
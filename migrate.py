@@ -0,0 +1,17 @@
+# migrate.py
+# Pone al día dss.db antes de atender peticiones: crea las tablas que falten y construye una
+# sola vez lo que la ingesta mantiene (agregados mensuales, muestras, sketches, índice de
+# texto e índice del mapa) a partir de los datos ya cargados. En una base de una versión
+# anterior puede tardar minutos; las consultas nunca lo hacen. Sin cambios pendientes no hace nada.
+#
+# Uso:
+#   python migrate.py
+import time
+
+import data_handler
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    built = data_handler.migrate()
+    status = 'actualizada' if built else 'ya estaba al día'
+    print(f"Base {data_handler.sqlite_db}: {status} ({time.perf_counter() - started:.1f} s)")
@@ -1,44 +1,153 @@
 import pandas as pd
+from yelp_utils import explode_categories
+from sampling import domain_estimates
+import metrics
 
+# Columnas que usa analyze_opportunities (el resto no se carga del snapshot)
+OPPORTUNITY_COLUMNS = ['business_id', 'name', 'categories', 'review_count', 'reviews', 'city', 'latitude', 'longitude']
+
+# ----------------------------
+# Motor compartido de oferta/demanda por categoría
+# ----------------------------
+@metrics.timed('category_pairs', rows=lambda res: len(res[0]))
+def category_pairs(df, reviews):
+    """Pares (category_id, business_id, reviews) con categorías codificadas por diccionario.
+    Devuelve también el diccionario category_id -> nombre. Como en business_category, cada par
+    (business_id, categoría) aparece una vez: si un negocio se repite queda su última fila."""
+    df = df.reset_index(drop=True)
+    cats = explode_categories(df)
+    rows = cats.index.to_numpy()
+    codes, uniques = pd.factorize(cats)
+    pairs = pd.DataFrame({
+        'category_id': codes,
+        'business_id': df['business_id'].to_numpy()[rows],
+        'reviews': reviews.reset_index(drop=True).to_numpy()[rows]
+    })
+    # las filas sin business_id no se combinan entre sí
+    repeated = pairs.duplicated(['category_id', 'business_id'], keep='last') & pairs['business_id'].notna()
+    return pairs[~repeated.to_numpy()].reset_index(drop=True), pd.Series(uniques)
+
+def aggregate_categories(pairs, names):
+    """Agrega por categoría: cantidad de negocios, promedio y total de reseñas."""
+    grouped = pairs.groupby('category_id').agg(
+        businesses_count=('business_id', 'count'),
+        avg_reviews=('reviews', 'mean'),
+        total_reviews=('reviews', 'sum')
+    )
+    grouped.insert(0, 'category', names.reindex(grouped.index).to_numpy())
+    return grouped.sort_values('category').reset_index(drop=True)
+
+@metrics.timed('gap_analysis', rows=len)
+def gap_analysis(pairs, names, reviews_df):
+    """Brecha (demanda - oferta) por categoría a partir de business_category y las reseñas."""
+    per_business = reviews_df.groupby('business_id', observed=True).size()
+    pairs = pairs.assign(reviews=pairs['business_id'].map(per_business).fillna(0))
+    grouped = aggregate_categories(pairs, names)
+    return gap_from_aggregates(grouped['category'], grouped['businesses_count'], grouped['total_reviews'])
+
+def gap_from_aggregates(categories, supply, demand, sort=True):
+    """Tabla de brecha a partir de oferta y demanda ya agregadas por categoría (pandas o SQL).
+    Con sort=False se conserva el orden recibido (p. ej. una página ya ordenada en SQL)."""
+    gap = pd.DataFrame({
+        'category_list': categories.to_numpy(),
+        'supply': supply.to_numpy(),
+        'demand': demand.astype(float).to_numpy()
+    })
+    gap['gap'] = gap['demand'] - gap['supply']
+    return gap.sort_values('gap', ascending=False) if sort else gap
+
+def gap_report(gap, top=10):
+    """Tabla HTML, recomendación y datos del gráfico para la vista de brecha."""
+    gap = gap.rename(columns={
+        'category_list': 'Categoría',
+        'supply': 'Cantidad de negocios (Oferta)',
+        'demand': 'Cantidad de reseñas (Demanda)',
+        'gap': 'Brecha (Demanda - Oferta)'
+    })
+
+    gap_sorted = gap.sort_values('Brecha (Demanda - Oferta)', ascending=False).head(top)
+
+    best_row = gap_sorted.iloc[0] if not gap_sorted.empty else None
+    recomendacion = "No hay datos suficientes para generar una recomendación."
+    if best_row is not None:
+        categoria = best_row["Categoría"]
+        oferta = int(best_row["Cantidad de negocios (Oferta)"])
+        demanda = int(best_row["Cantidad de reseñas (Demanda)"])
+        brecha = int(best_row["Brecha (Demanda - Oferta)"])
+        recomendacion = (
+            f"La categoría con mayor oportunidad es **{categoria}**. "
+            f"Actualmente existen {oferta} negocios frente a una demanda de {demanda} reseñas. "
+            f"Esto genera una brecha de {brecha}, lo que indica una oportunidad clara."
+        )
+
+    table_html = gap_sorted.to_html(
+        index=False,
+        classes="table table-striped table-hover table-bordered text-center"
+    )
+
+    chart_labels = gap_sorted["Categoría"].tolist()
+    chart_data = gap_sorted["Brecha (Demanda - Oferta)"].tolist()
+    return table_html, recomendacion, chart_labels, chart_data
+
+def business_reviews(df):
+    """Reseñas de cada fila: review_count (business.json) o, en un archivo de reseñas,
+    cuántas tiene su negocio."""
+    if 'review_count' in df.columns:
+        return df['review_count']
+    return df['business_id'].map(df.groupby('business_id', observed=True).size()).fillna(0)
+
+@metrics.timed('analyze_opportunities')
 def analyze_opportunities(df, include_markers=False):
     if 'categories' not in df.columns:
         return ('', {'error': 'El archivo no tiene columna categories.'}, [])
 
-    # Separar categorías
-    s = df['categories'].fillna('')
-    s = s.str.split(',').apply(lambda xs: [x.strip() for x in xs if x.strip()])
-
-    # Expandir DataFrame
-    exploded = df.loc[s.index].copy()
-    exploded = exploded.assign(category_list=s)
-    exploded = exploded.explode('category_list')
-
-    # ----------------------------
-    # Manejo flexible de reseñas
-    # ----------------------------
-    if 'review_count' in exploded.columns:
-        # Caso business.json
-        grouped = exploded.groupby('category_list').agg(
-            businesses_count=('business_id', 'count'),
-            avg_reviews=('review_count', 'mean'),
-            total_reviews=('review_count', 'sum')
-        ).reset_index().rename(columns={'category_list': 'category'})
-    else:
-        # Caso review.json → contamos reseñas
-        reviews_per_business = df.groupby('business_id').size().reset_index(name='reviews')
-        merged = exploded.merge(reviews_per_business, on='business_id', how='left').fillna({'reviews': 0})
-
-        grouped = merged.groupby('category_list').agg(
-            businesses_count=('business_id', 'count'),
-            avg_reviews=('reviews', 'mean'),
-            total_reviews=('reviews', 'sum')
-        ).reset_index().rename(columns={'category_list': 'category'})
-
-    # Calcular oportunidad
+    pairs, names = category_pairs(df, business_reviews(df))
+    grouped = aggregate_categories(pairs, names)
+    table_html, summary = opportunity_report(grouped)
+
+    # Marcadores (mapa); el mapa de la UI usa /api/markers con clusters por zoom
+    markers = []
+    if include_markers and 'latitude' in df.columns and 'longitude' in df.columns:
+        points = df[df['latitude'].notna() & df['longitude'].notna()]
+        out = pd.DataFrame({'lat': points['latitude'], 'lon': points['longitude']})
+        for col in ['name', 'categories', 'city']:
+            out[col] = points[col] if col in points.columns else ''
+        reviews_col = 'review_count' if 'review_count' in points.columns else 'reviews'
+        out['reviews'] = points[reviews_col] if reviews_col in points.columns else 0
+        markers = out.where(out.notna(), None).to_dict(orient='records')
+
+    return table_html, summary, markers
+
+def with_opportunity(grouped):
+    """Agrega la columna opportunity (promedio de reseñas / (negocios + 1))."""
+    grouped = grouped.copy()
     grouped['opportunity'] = grouped['avg_reviews'] / (grouped['businesses_count'] + 1)
+    return grouped
+
+@metrics.timed('sample_opportunities', rows=len)
+def sample_opportunities(sample, population):
+    """Índice de oportunidad estimado sobre la muestra estratificada de negocios (ver sampling):
+    businesses_count y avg_reviews con su intervalo de confianza (_low, _high); opportunity se
+    calcula con las estimaciones puntuales. Ordenado por oportunidad."""
+    sample = sample.reset_index(drop=True)
+    cats = explode_categories(sample)
+    rows = sample.loc[cats.index, ['stratum', 'review_count']].assign(category=cats.to_numpy())
+    sampled = sample.groupby('stratum', observed=True).size()
+    est = domain_estimates(rows, sampled, population, 'category', value='review_count')
+    est = est.rename(columns={
+        'count': 'businesses_count', 'count_low': 'businesses_count_low', 'count_high': 'businesses_count_high',
+        'mean': 'avg_reviews', 'mean_low': 'avg_reviews_low', 'mean_high': 'avg_reviews_high'
+    })
+    return with_opportunity(est).sort_values('opportunity', ascending=False).reset_index(drop=True)
+
+@metrics.timed('opportunity_report')
+def opportunity_report(grouped, top=10):
+    """Tabla HTML y recomendación a partir de las categorías agregadas
+    (category, businesses_count, avg_reviews, total_reviews), calculadas en pandas o en SQL."""
+    grouped = with_opportunity(grouped)
 
     # Ordenar
-    result = grouped.sort_values('opportunity', ascending=False).head(10)
+    result = grouped.sort_values('opportunity', ascending=False).head(top)
 
     # Renombrar columnas
     result = result.rename(columns={
@@ -73,18 +182,4 @@ def analyze_opportunities(df, include_markers=False):
         "recommendation": recommendation
     }
 
-    # Marcadores (mapa)
-    markers = []
-    if include_markers and 'latitude' in df.columns and 'longitude' in df.columns:
-        for _, row in df.iterrows():
-            if pd.notnull(row.get('latitude')) and pd.notnull(row.get('longitude')):
-                markers.append({
-                    "lat": row['latitude'],
-                    "lon": row['longitude'],
-                    "name": row.get('name', ''),
-                    "categories": row.get('categories', ''),
-                    "reviews": row.get('review_count', row.get('reviews', 0)),
-                    "city": row.get('city', '')
-                })
-
-    return table_html, summary, markers
+    return table_html, summary
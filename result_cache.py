@@ -0,0 +1,85 @@
+# result_cache.py
+# Caché de resultados de análisis compartida entre los workers de gunicorn.
+# Se guarda en un archivo SQLite aparte y cada entrada depende de la versión del dataset,
+# así que una nueva carga de datos invalida automáticamente los resultados anteriores.
+import hashlib, json, os, pickle, sqlite3, time
+from pathlib import Path
+
+cache_db = Path(__file__).parent / 'storage' / 'cache.db'
+
+# Tamaño máximo de la caché (bytes); al superarlo se eliminan las entradas usadas hace más tiempo
+MAX_BYTES = int(os.environ.get('DSS_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+def _connect():
+    conn = sqlite3.connect(cache_db, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS result_cache ("
+        "key TEXT PRIMARY KEY, version TEXT NOT NULL, value BLOB NOT NULL, "
+        "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+    )
+    return conn
+
+def make_key(name, version, params=None):
+    raw = json.dumps([name, version, params or {}], sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def get(key):
+    """Devuelve el valor guardado o None si no existe."""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT value FROM result_cache WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE result_cache SET last_access=? WHERE key=?", (time.time(), key))
+        return pickle.loads(row[0])
+    finally:
+        conn.close()
+
+def put(key, version, value):
+    """Guarda un resultado y aplica el límite de tamaño (LRU)."""
+    blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(blob) > MAX_BYTES:
+        return
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO result_cache (key, version, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, version, blob, len(blob), time.time())
+            )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM result_cache").fetchone()[0]
+            if total > MAX_BYTES:
+                for old_key, size in conn.execute(
+                    "SELECT key, size FROM result_cache WHERE key != ? ORDER BY last_access", (key,)
+                ).fetchall():
+                    conn.execute("DELETE FROM result_cache WHERE key=?", (old_key,))
+                    total -= size
+                    if total <= MAX_BYTES:
+                        break
+    finally:
+        conn.close()
+
+def invalidate(keep_version=None):
+    """Elimina las entradas de versiones anteriores del dataset (todas si keep_version es None)."""
+    conn = _connect()
+    try:
+        with conn:
+            if keep_version is None:
+                conn.execute("DELETE FROM result_cache")
+            else:
+                conn.execute("DELETE FROM result_cache WHERE version != ?", (keep_version,))
+    finally:
+        conn.close()
+
+def cached(name, version, compute, params=None):
+    """Devuelve el resultado de compute() desde la caché si existe para esta versión y parámetros.
+    Los resultados None no se guardan."""
+    key = make_key(name, version, params)
+    value = get(key)
+    if value is None:
+        value = compute()
+        if value is not None:
+            put(key, version, value)
+    return value
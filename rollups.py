@@ -0,0 +1,149 @@
+# rollups.py
+# Agregados mensuales de reseñas (cantidad, estrellas y sentimiento) por ciudad y por
+# categoría + ciudad, mantenidos de forma incremental en la ingesta: antes de actualizar un
+# lote se resta su aporte actual y después se suma el nuevo, así nunca se recorre toda la
+# tabla review. Las series de tendencia se leen de estas tablas en milisegundos.
+import pandas as pd
+
+# Tablas: por ciudad (serie global sin duplicar reseñas) y por categoría + ciudad
+CITY_TABLE = 'review_monthly_city'
+CATEGORY_TABLE = 'review_monthly_category'
+KEYS_TABLE = '_rollup_keys'
+
+_MEASURES = "reviews INTEGER NOT NULL, stars_sum REAL NOT NULL, sentiment_sum REAL NOT NULL, sentiment_n INTEGER NOT NULL"
+_UPDATE = (
+    "reviews = reviews + excluded.reviews, stars_sum = stars_sum + excluded.stars_sum, "
+    "sentiment_sum = sentiment_sum + excluded.sentiment_sum, sentiment_n = sentiment_n + excluded.sentiment_n"
+)
+# mes 'YYYY-MM' (las fechas se guardan como texto ISO); '' si la reseña no tiene fecha
+_MONTH = "COALESCE(substr(r.date, 1, 7), '')"
+
+def ensure_tables(conn):
+    """Crea las tablas; devuelve True si no existían (hay que reconstruirlas)."""
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (CATEGORY_TABLE,)
+    ).fetchone()
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {CITY_TABLE} (month TEXT NOT NULL, city TEXT NOT NULL, {_MEASURES}, "
+        "PRIMARY KEY (month, city))"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {CATEGORY_TABLE} (month TEXT NOT NULL, category_id INTEGER NOT NULL, "
+        f"city TEXT NOT NULL, {_MEASURES}, PRIMARY KEY (category_id, month, city))"
+    )
+    return exists is None
+
+def _apply(conn, sign, where, sentiment_only=False):
+    # suma (sign=1) o resta (sign=-1) el aporte de las reseñas que cumplen where
+    reviews = "0" if sentiment_only else f"{sign} * COUNT(*)"
+    stars = "0" if sentiment_only else f"{sign} * TOTAL(r.stars)"
+    measures = f"{reviews}, {stars}, {sign} * TOTAL(s.polarity), {sign} * COUNT(s.polarity)"
+    sentiment_join = "JOIN" if sentiment_only else "LEFT JOIN"
+    conn.exec_driver_sql(
+        f"INSERT INTO {CITY_TABLE} (month, city, reviews, stars_sum, sentiment_sum, sentiment_n) "
+        f"SELECT {_MONTH}, COALESCE(b.city, ''), {measures} "
+        "FROM review r LEFT JOIN business b ON b.business_id = r.business_id "
+        f"{sentiment_join} review_sentiment s ON s.review_id = r.review_id "
+        f"WHERE {where} GROUP BY 1, 2 "
+        f"ON CONFLICT(month, city) DO UPDATE SET {_UPDATE}"
+    )
+    conn.exec_driver_sql(
+        f"INSERT INTO {CATEGORY_TABLE} (month, category_id, city, reviews, stars_sum, sentiment_sum, sentiment_n) "
+        f"SELECT {_MONTH}, bc.category_id, COALESCE(b.city, ''), {measures} "
+        "FROM review r JOIN business b ON b.business_id = r.business_id "
+        "JOIN business_category bc ON bc.business_id = r.business_id "
+        f"{sentiment_join} review_sentiment s ON s.review_id = r.review_id "
+        f"WHERE {where} GROUP BY 1, 2, 3 "
+        f"ON CONFLICT(category_id, month, city) DO UPDATE SET {_UPDATE}"
+    )
+
+def _prune(conn):
+    for table in (CITY_TABLE, CATEGORY_TABLE):
+        conn.exec_driver_sql(f"DELETE FROM {table} WHERE reviews <= 0 AND sentiment_n <= 0")
+
+def _has_tables(conn, *names):
+    # la primera reconstrucción puede ocurrir antes de que existan todas las tablas
+    found = {r[0] for r in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type='table'")}
+    return all(n in found for n in names)
+
+def rebuild(conn):
+    """Recalcula los agregados desde cero (primera vez o reemplazo completo de business)."""
+    ensure_tables(conn)
+    conn.exec_driver_sql(f"DELETE FROM {CITY_TABLE}")
+    conn.exec_driver_sql(f"DELETE FROM {CATEGORY_TABLE}")
+    if _has_tables(conn, 'review', 'business', 'business_category', 'review_sentiment'):
+        _apply(conn, 1, "true")
+
+def clear(conn):
+    ensure_tables(conn)
+    conn.exec_driver_sql(f"DELETE FROM {CITY_TABLE}")
+    conn.exec_driver_sql(f"DELETE FROM {CATEGORY_TABLE}")
+
+def _where(table_name):
+    key = 'review_id' if table_name == 'review' else 'business_id'
+    return f"r.{key} IN (SELECT key FROM {KEYS_TABLE})"
+
+def begin_batch(conn, keys, table_name):
+    """Antes de escribir un lote de review o business: resta el aporte actual de sus reseñas."""
+    if ensure_tables(conn):
+        rebuild(conn)
+    pd.DataFrame({'key': pd.Series(keys).dropna().astype(str).unique()}).to_sql(
+        KEYS_TABLE, conn, if_exists='replace', index=False
+    )
+    if _has_tables(conn, 'review', 'business', 'business_category', 'review_sentiment'):
+        _apply(conn, -1, _where(table_name))
+
+def end_batch(conn, table_name):
+    """Después de escribir el lote: suma el aporte de sus reseñas con los datos nuevos."""
+    if _has_tables(conn, 'review', 'business', 'business_category', 'review_sentiment'):
+        _apply(conn, 1, _where(table_name))
+    _prune(conn)
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {KEYS_TABLE}")
+
+def add_sentiment(conn, review_ids):
+    """Suma la polaridad recién calculada de estas reseñas (su conteo ya estaba agregado)."""
+    if ensure_tables(conn):
+        rebuild(conn)
+        return
+    pd.DataFrame({'key': pd.Series(review_ids).astype(str)}).to_sql(KEYS_TABLE, conn, if_exists='replace', index=False)
+    _apply(conn, 1, _where('review'), sentiment_only=True)
+    conn.exec_driver_sql(f"DROP TABLE {KEYS_TABLE}")
+
+def query(conn, start=None, end=None, category=None, city=None):
+    """Serie mensual (month, reviews, avg_stars, avg_sentiment) entre los meses start y end
+    ('YYYY-MM', inclusive), opcionalmente para una categoría y/o ciudad. Solo lee: las tablas
+    se crean y se completan en la ingesta (sin ellas la serie está vacía)."""
+    if not _has_tables(conn, CITY_TABLE, CATEGORY_TABLE, 'category'):
+        return pd.DataFrame(columns=['month', 'reviews', 'avg_stars', 'avg_sentiment'])
+    where, params = ["m.month != ''"], []
+    if category:
+        table = f"{CATEGORY_TABLE} m JOIN category c ON c.category_id = m.category_id"
+        where.append("c.name = ? COLLATE NOCASE")
+        params.append(category)
+    else:
+        table = f"{CITY_TABLE} m"
+    if city:
+        where.append("m.city = ? COLLATE NOCASE")
+        params.append(city)
+    if start:
+        where.append("m.month >= ?")
+        params.append(start)
+    if end:
+        where.append("m.month <= ?")
+        params.append(end)
+    return pd.read_sql(
+        "SELECT m.month, SUM(m.reviews) AS reviews, "
+        "       SUM(m.stars_sum) / NULLIF(SUM(m.reviews), 0) AS avg_stars, "
+        "       SUM(m.sentiment_sum) / NULLIF(SUM(m.sentiment_n), 0) AS avg_sentiment "
+        f"FROM {table} WHERE {' AND '.join(where)} GROUP BY m.month ORDER BY m.month",
+        conn, params=tuple(params)
+    )
+
+def totals(conn):
+    """Totales globales: reseñas y polaridad promedio (incluye reseñas sin fecha). Solo lee."""
+    if not _has_tables(conn, CITY_TABLE):
+        return {'reviews': 0, 'avg_sentiment': None}
+    row = conn.exec_driver_sql(
+        f"SELECT SUM(reviews), SUM(sentiment_sum) / NULLIF(SUM(sentiment_n), 0) FROM {CITY_TABLE}"
+    ).fetchone()
+    return {'reviews': int(row[0] or 0), 'avg_sentiment': row[1]}
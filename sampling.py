@@ -0,0 +1,184 @@
+# sampling.py
+# Muestras aleatorias mantenidas durante la ingesta, en una sola pasada, para el modo de
+# análisis aproximado (?sample=1). Cada fila recibe una prioridad u en [0, 1) y por estrato se
+# conservan las de menor u: es un reservoir sampling (muestra uniforme sin reemplazo dentro de
+# cada estrato) que se puede actualizar por lotes y con upserts sin recorrer la tabla.
+# u es un hash de la clave (no un sorteo en cada carga): una fila que se vuelve a subir
+# conserva su prioridad y no gana más chances de entrar en la muestra.
+# Las tablas de muestra guardan solo la clave; las filas se leen de la tabla original.
+import os
+import numpy as np
+import pandas as pd
+
+# Negocios por ciudad (muestra estratificada) y reseñas en total (reservoir simple)
+PER_CITY = int(os.environ.get('DSS_SAMPLE_PER_CITY', 100))
+REVIEW_SAMPLE = int(os.environ.get('DSS_SAMPLE_REVIEWS', 20000))
+
+# tabla -> clave, columna de estrato (None: un único estrato) y filas por estrato
+SAMPLES = {
+    'business': {'key': 'business_id', 'stratum': 'city', 'size': PER_CITY},
+    'review': {'key': 'review_id', 'stratum': None, 'size': REVIEW_SAMPLE}
+}
+
+# Intervalos de confianza del 95% (aproximación normal)
+CONFIDENCE = 0.95
+Z = 1.959964
+
+def sample_table(table_name):
+    return f'{table_name}_sample'
+
+def priority(keys):
+    """Prioridad de muestreo de cada clave: hash estable de 64 bits llevado a [0, 1)."""
+    h = pd.util.hash_pandas_object(pd.Series(keys, dtype=object).astype(str), index=False).to_numpy()
+    return (h >> np.uint64(11)).astype('float64') * 2.0 ** -53
+
+def ensure_tables(conn):
+    """Crea las tablas de muestra; devuelve las que no existían (hay que reconstruirlas)."""
+    created = []
+    for table_name, spec in SAMPLES.items():
+        name = sample_table(table_name)
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)
+        ).fetchone()
+        if exists is not None and not _hashed(conn, table_name):
+            # muestra de una versión anterior (prioridades sorteadas en cada carga): se rehace
+            conn.exec_driver_sql(f"DROP TABLE {name}")
+            exists = None
+        if exists is None:
+            conn.exec_driver_sql(
+                f"CREATE TABLE {name} ({spec['key']} TEXT PRIMARY KEY, stratum TEXT NOT NULL, u REAL NOT NULL)"
+            )
+            conn.exec_driver_sql(f"CREATE INDEX idx_{name}_stratum_u ON {name}(stratum, u)")
+            created.append(table_name)
+    return created
+
+def _hashed(conn, table_name):
+    # las prioridades guardadas son las de priority() (se compara una fila)
+    key = SAMPLES[table_name]['key']
+    row = conn.exec_driver_sql(f"SELECT {key}, u FROM {sample_table(table_name)} LIMIT 1").fetchone()
+    return row is None or abs(priority([row[0]])[0] - row[1]) < 1e-12
+
+def _prune(conn, table_name):
+    # deja en cada estrato solo las filas de menor prioridad
+    name = sample_table(table_name)
+    conn.exec_driver_sql(
+        f"DELETE FROM {name} WHERE rowid IN (SELECT rowid FROM ("
+        f"  SELECT rowid, ROW_NUMBER() OVER (PARTITION BY stratum ORDER BY u) AS rn FROM {name}"
+        f") WHERE rn > ?)", (SAMPLES[table_name]['size'],)
+    )
+
+def clear(conn, table_name):
+    conn.exec_driver_sql(f"DELETE FROM {sample_table(table_name)}")
+
+def rebuild(conn, table_name, chunksize=100000):
+    """Muestrea desde cero la tabla ya cargada (primera vez que se usa la muestra)."""
+    spec = SAMPLES[table_name]
+    clear(conn, table_name)
+    stratum = f"COALESCE({spec['stratum']}, '')" if spec['stratum'] else "''"
+    last = ''
+    while True:
+        # por rangos de la clave primaria (no se puede escribir con un cursor de lectura abierto)
+        chunk = pd.read_sql(
+            f"SELECT {spec['key']} AS key, {stratum} AS stratum FROM {table_name} "
+            f"WHERE {spec['key']} > ? ORDER BY {spec['key']} LIMIT ?",
+            conn, params=(last, int(chunksize))
+        )
+        if chunk.empty:
+            return
+        _insert(conn, table_name, chunk.assign(u=priority(chunk['key'])))
+        last = chunk['key'].iloc[-1]
+
+def add_batch(conn, df, table_name):
+    """Incorpora un lote recién escrito en la tabla. Cada clave tiene siempre la misma
+    prioridad (un upsert no cambia su probabilidad de estar en la muestra)."""
+    spec = SAMPLES[table_name]
+    if spec['key'] not in df.columns or df.empty:
+        return
+    keys = df[spec['key']]
+    ok = keys.notna().to_numpy()
+    if spec['stratum'] and spec['stratum'] in df.columns:
+        strata = df[spec['stratum']].astype(object).fillna('').astype(str).to_numpy()[ok]
+    else:
+        strata = np.full(ok.sum(), '', dtype=object)
+    batch = pd.DataFrame({'key': keys.astype(str).to_numpy()[ok], 'stratum': strata})
+    _insert(conn, table_name, batch.assign(u=priority(batch['key'])))
+
+def _insert(conn, table_name, batch):
+    # agrega (key, stratum, u) a la muestra y deja en cada estrato las de menor prioridad
+    spec = SAMPLES[table_name]
+    # dentro del lote ya se pueden descartar las filas que no entrarían en su estrato
+    batch = batch.drop_duplicates('key', keep='last').sort_values('u').groupby('stratum').head(spec['size'])
+    name = sample_table(table_name)
+    batch.to_sql(f'_staging_{name}', conn, if_exists='replace', index=False)
+    conn.exec_driver_sql(
+        f"INSERT INTO {name} ({spec['key']}, stratum, u) SELECT key, stratum, u FROM _staging_{name} WHERE true "
+        f"ON CONFLICT({spec['key']}) DO UPDATE SET stratum = excluded.stratum"
+    )
+    conn.exec_driver_sql(f"DROP TABLE _staging_{name}")
+    _prune(conn, table_name)
+
+def read(conn, table_name, columns, derived=None):
+    """Filas muestreadas (columns + stratum) y tamaño de la población de cada estrato.
+    derived ({tabla: [columnas]}) agrega columnas de tablas con la misma clave (NULL si faltan)."""
+    spec = SAMPLES[table_name]
+    key = spec['key']
+    cols = [f"t.{c}" for c in columns]
+    joins = ""
+    for i, (other, other_cols) in enumerate((derived or {}).items()):
+        cols += [f"d{i}.{c}" for c in other_cols]
+        joins += f" LEFT JOIN {other} d{i} ON d{i}.{key} = s.{key}"
+    rows = pd.read_sql(
+        f"SELECT {', '.join(cols)}, s.stratum FROM {sample_table(table_name)} s "
+        f"JOIN {table_name} t ON t.{key} = s.{key}{joins}", conn
+    )
+    stratum = f"COALESCE({spec['stratum']}, '')" if spec['stratum'] else "''"
+    population = pd.read_sql(
+        f"SELECT {stratum} AS stratum, COUNT(*) AS population FROM {table_name} GROUP BY 1", conn,
+        index_col='stratum'
+    )['population']
+    return rows, population
+
+def domain_estimates(sample, sampled, population, domain, value=None):
+    """Estimaciones por dominio (p. ej. categoría o mes) de una muestra estratificada.
+    sample tiene las columnas stratum, domain y opcionalmente value (una unidad puede aparecer
+    en varios dominios o en ninguno); sampled y population son las unidades muestreadas y el
+    tamaño de cada estrato. Devuelve por dominio: count (unidades en la población) y, con
+    value, mean (promedio de value), cada uno con su intervalo de confianza (_low, _high).
+    Varianzas por linealización con corrección por población finita y aproximación normal:
+    con dominios chicos o valores muy asimétricos los intervalos quedan algo angostos; un
+    estrato con una sola unidad muestreada no aporta varianza."""
+    n = sampled
+    N_h = population.reindex(n.index).fillna(0).clip(lower=n)
+    # factor de varianza por estrato: N_h^2 (1 - n_h/N_h) / (n_h (n_h - 1))
+    factor = N_h ** 2 * (1 - n / N_h) / (n * (n - 1).clip(lower=1))
+    weight = N_h / n
+
+    parts = pd.DataFrame({'stratum': sample['stratum'].to_numpy(), 'domain': sample[domain].to_numpy()})
+    if value is not None:
+        x = pd.to_numeric(sample[value], errors='coerce').to_numpy(dtype='float64')
+        parts['x'] = np.nan_to_num(x)
+        parts['xx'] = parts['x'] ** 2
+    else:
+        parts['x'] = parts['xx'] = 0.0
+    g = parts.groupby(['domain', 'stratum'], observed=True).agg(m=('x', 'size'), sx=('x', 'sum'), sxx=('xx', 'sum'))
+    g = g.reset_index()
+    nh, w, f = g['stratum'].map(n), g['stratum'].map(weight), g['stratum'].map(factor)
+
+    # conteo: y = 1 dentro del dominio
+    count = (w * g['m']).groupby(g['domain']).sum()
+    count_var = (f * (g['m'] - g['m'] ** 2 / nh)).groupby(g['domain']).sum()
+    out = pd.DataFrame({'count': count})
+    half = Z * np.sqrt(count_var.clip(lower=0))
+    out['count_low'], out['count_high'] = (count - half).clip(lower=0), count + half
+
+    if value is not None:
+        total = (w * g['sx']).groupby(g['domain']).sum()
+        mean = total / count
+        r = g['domain'].map(mean)
+        # residuos e = 1[dominio] (x - media del dominio)
+        se = g['sx'] - g['m'] * r
+        see = g['sxx'] - 2 * r * g['sx'] + g['m'] * r ** 2
+        mean_var = (f * (see - se ** 2 / nh)).groupby(g['domain']).sum() / count ** 2
+        half = Z * np.sqrt(mean_var.clip(lower=0))
+        out['mean'], out['mean_low'], out['mean_high'] = mean, mean - half, mean + half
+    return out.rename_axis(domain).reset_index()
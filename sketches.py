@@ -0,0 +1,295 @@
+# sketches.py
+# Resúmenes probabilísticos de las reseñas construidos mientras se ingieren los lotes, de
+# tamaño fijo (no crecen con la cantidad de reseñas) y combinables entre cargas:
+#   - HyperLogLog: usuarios distintos, en total y por categoría
+#   - Misra-Gries (heavy hitters): categorías y negocios con más reseñas
+#   - histograma de estrellas por ciudad: las estrellas de Yelp van de 1 a 5 en pasos de 0,5,
+#     así que un histograma de 11 celdas es un sketch de cuantiles exacto y combinable
+# Cada carga guarda su sketch en review_sketch; el resumen combina todos de a uno.
+import io, json, time
+import numpy as np
+import pandas as pd
+
+# Registros HyperLogLog: 2^p (error estándar ~1.04 / sqrt(2^p))
+USERS_P = 14       # total: ~0,8%
+CATEGORY_P = 11    # por categoría: ~2,3%
+# Contadores que conserva cada heavy hitters (error máximo: reseñas / (k + 1))
+CATEGORY_K = 2000
+BUSINESS_K = 1000
+# Histograma de estrellas: celdas de 0,5 entre 0 y 5
+STAR_STEP = 0.5
+STAR_BINS = 11
+
+SKETCH_TABLE = 'review_sketch'
+
+# --- HyperLogLog ---
+def _hash(values):
+    # hash de 64 bits estable entre procesos y cargas
+    return pd.util.hash_array(pd.Series(values).astype(str).to_numpy(dtype=object))
+
+def _leading_zeros(w):
+    n = np.zeros(len(w), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        top_clear = w < (np.uint64(1) << np.uint64(64 - shift))
+        n[top_clear] += shift
+        w = np.where(top_clear, w << np.uint64(shift), w)
+    return n
+
+def hll_registers(values, p):
+    """Índice de registro y rango (ceros iniciales + 1) de cada valor."""
+    h = _hash(values)
+    idx = (h >> np.uint64(64 - p)).astype(np.intp)
+    # el bit centinela acota el rango a 64 - p + 1
+    w = (h << np.uint64(p)) | (np.uint64(1) << np.uint64(p - 1))
+    return idx, _leading_zeros(w) + 1
+
+def hll_estimate(registers):
+    """Cardinalidad estimada de cada fila de registros (con corrección de rango chico)."""
+    registers = np.atleast_2d(registers)
+    m = registers.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype('float64')), axis=1)
+    zeros = (registers == 0).sum(axis=1)
+    small = (raw <= 2.5 * m) & (zeros > 0)
+    return np.where(small, m * np.log(m / np.maximum(zeros, 1)), raw)
+
+# --- Heavy hitters ---
+class HeavyHitters:
+    """Resumen de Misra-Gries combinable: conserva a lo sumo k valores; el conteo real de cada
+    uno está entre count y count + error."""
+
+    def __init__(self, k, counts=None, error=0):
+        self.k = k
+        self.counts = counts if counts is not None else pd.Series(dtype='int64')
+        self.error = error
+
+    def add(self, counts):
+        counts = pd.Series(counts.to_numpy(dtype='int64'), index=counts.index.astype(str))
+        merged = self.counts.add(counts, fill_value=0)
+        if len(merged) > self.k:
+            cut = merged.nlargest(self.k + 1).iloc[-1]
+            merged = merged[merged > cut] - cut
+            self.error += int(cut)
+        self.counts = merged.astype('int64')
+
+    def merge(self, other):
+        self.add(other.counts)
+        self.error += other.error
+
+    def top(self, n):
+        return self.counts.nlargest(n)
+
+# --- Sketch de una carga ---
+class ReviewSketch:
+    """Sketches de un conjunto de reseñas. lookup = (ciudad por business_id, pares
+    business_id/category) con los negocios cargados al momento de la ingesta."""
+
+    def __init__(self, lookup=None):
+        self.rows = 0
+        self.users = np.zeros(1 << USERS_P, dtype=np.uint8)
+        self.category_names = []
+        self.category_users = np.zeros((0, 1 << CATEGORY_P), dtype=np.uint8)
+        self.top_categories = HeavyHitters(CATEGORY_K)
+        self.top_businesses = HeavyHitters(BUSINESS_K)
+        self.city_names = []
+        self.city_stars = np.zeros((0, STAR_BINS), dtype=np.int64)
+        self.cities, self.pairs = lookup if lookup is not None else (pd.Series(dtype=object), None)
+
+    def _rows_for(self, names_attr, matrix_attr, labels):
+        # fila de cada etiqueta en la matriz (agrega filas nuevas en cero)
+        names = getattr(self, names_attr)
+        index = {name: i for i, name in enumerate(names)}
+        new = [label for label in dict.fromkeys(labels) if label not in index]
+        if new:
+            for label in new:
+                index[label] = len(names)
+                names.append(label)
+            matrix = getattr(self, matrix_attr)
+            grown = np.zeros((len(names), matrix.shape[1]), dtype=matrix.dtype)
+            grown[:len(matrix)] = matrix
+            setattr(self, matrix_attr, grown)
+        return np.array([index[label] for label in labels], dtype=np.intp)
+
+    def update(self, df):
+        """Agrega un lote de reseñas (columnas business_id, user_id, stars)."""
+        if df.empty:
+            return
+        self.rows += len(df)
+        business = df['business_id'].astype(object).astype(str)
+        if 'user_id' in df.columns:
+            users = df['user_id'].dropna()
+            idx, rank = hll_registers(users, USERS_P)
+            np.maximum.at(self.users, idx, rank)
+        self.top_businesses.add(business.value_counts())
+
+        if self.pairs is not None and not self.pairs.empty:
+            users = df['user_id'].to_numpy() if 'user_id' in df.columns else None
+            cats = pd.DataFrame({'business_id': business.to_numpy(), 'user_id': users}).merge(self.pairs, on='business_id')
+            if not cats.empty:
+                self.top_categories.add(cats['category'].value_counts())
+                cats = cats.dropna(subset=['user_id'])
+                if not cats.empty:
+                    codes, labels = pd.factorize(cats['category'])
+                    rows = self._rows_for('category_names', 'category_users', list(labels))[codes]
+                    idx, rank = hll_registers(cats['user_id'], CATEGORY_P)
+                    np.maximum.at(self.category_users, (rows, idx), rank)
+
+        if 'stars' in df.columns:
+            stars = pd.to_numeric(df['stars'], errors='coerce').to_numpy(dtype='float64')
+            ok = ~np.isnan(stars)
+            city = business.map(self.cities).fillna('').astype(str).to_numpy()[ok]
+            bins = np.clip(np.rint(stars[ok] / STAR_STEP), 0, STAR_BINS - 1).astype(np.intp)
+            codes, labels = pd.factorize(city)
+            rows = self._rows_for('city_names', 'city_stars', list(labels))[codes]
+            np.add.at(self.city_stars, (rows, bins), 1)
+
+    def merge(self, other):
+        self.rows += other.rows
+        np.maximum(self.users, other.users, out=self.users)
+        if other.category_names:
+            rows = self._rows_for('category_names', 'category_users', other.category_names)
+            self.category_users[rows] = np.maximum(self.category_users[rows], other.category_users)
+        if other.city_names:
+            rows = self._rows_for('city_names', 'city_stars', other.city_names)
+            self.city_stars[rows] += other.city_stars
+        self.top_categories.merge(other.top_categories)
+        self.top_businesses.merge(other.top_businesses)
+
+    # --- Serialización (npz comprimido; sin pickle) ---
+    def to_bytes(self):
+        buf = io.BytesIO()
+        hh = {name: getattr(self, name) for name in ('top_categories', 'top_businesses')}
+        np.savez_compressed(
+            buf,
+            meta=np.array(json.dumps({
+                'rows': self.rows, 'errors': {name: h.error for name, h in hh.items()}
+            })),
+            users=self.users,
+            category_names=np.array(self.category_names, dtype=str),
+            category_users=self.category_users,
+            city_names=np.array(self.city_names, dtype=str),
+            city_stars=self.city_stars,
+            **{f'{name}_keys': np.array(h.counts.index.astype(str), dtype=str) for name, h in hh.items()},
+            **{f'{name}_counts': h.counts.to_numpy(dtype='int64') for name, h in hh.items()}
+        )
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls()
+        with np.load(io.BytesIO(data)) as z:
+            meta = json.loads(str(z['meta']))
+            sketch.rows = meta['rows']
+            sketch.users = z['users']
+            sketch.category_names = z['category_names'].tolist()
+            sketch.category_users = z['category_users']
+            sketch.city_names = z['city_names'].tolist()
+            sketch.city_stars = z['city_stars']
+            for name, k in (('top_categories', CATEGORY_K), ('top_businesses', BUSINESS_K)):
+                counts = pd.Series(z[f'{name}_counts'], index=z[f'{name}_keys'].tolist(), dtype='int64')
+                setattr(sketch, name, HeavyHitters(k, counts, meta['errors'][name]))
+        return sketch
+
+    # --- Consultas ---
+    def distinct_users(self, category=None):
+        if category is None:
+            return float(hll_estimate(self.users)[0])
+        lower = [name.lower() for name in self.category_names]
+        if category.lower() not in lower:
+            return 0.0
+        return float(hll_estimate(self.category_users[lower.index(category.lower())])[0])
+
+    def stars(self, city=None):
+        """Distribución de estrellas (total o de una ciudad): cantidad, promedio y cuantiles."""
+        if city is None:
+            hist = self.city_stars.sum(axis=0) if len(self.city_stars) else np.zeros(STAR_BINS, dtype=np.int64)
+        else:
+            lower = [name.lower() for name in self.city_names]
+            hist = self.city_stars[lower.index(city.lower())] if city.lower() in lower else np.zeros(STAR_BINS, dtype=np.int64)
+        values = np.arange(STAR_BINS) * STAR_STEP
+        count = int(hist.sum())
+        result = {'city': city, 'count': count, 'mean': None, 'quantiles': {}, 'histogram': {}}
+        if count:
+            cum = np.cumsum(hist)
+            result['mean'] = float((hist * values).sum() / count)
+            result['quantiles'] = {
+                f'p{int(q * 100)}': float(values[np.searchsorted(cum, q * count)]) for q in (0.1, 0.25, 0.5, 0.75, 0.9)
+            }
+            result['histogram'] = {f'{v:.1f}': int(n) for v, n in zip(values, hist) if n}
+        return result
+
+    def summary(self, top=10, category=None, city=None):
+        cats = self.top_categories.top(top)
+        rows = {name: i for i, name in enumerate(self.category_names)}
+        users = hll_estimate(self.category_users) if len(self.category_users) else np.zeros(0)
+        out = {
+            'reviews': self.rows,
+            'distinct_users': round(self.distinct_users()),
+            'top_categories': [
+                {'category': name, 'reviews': int(n), 'reviews_max': int(n) + self.top_categories.error,
+                 'distinct_users': round(float(users[rows[name]])) if name in rows else 0}
+                for name, n in cats.items()
+            ],
+            'top_businesses': [
+                {'business_id': name, 'reviews': int(n), 'reviews_max': int(n) + self.top_businesses.error}
+                for name, n in self.top_businesses.top(top).items()
+            ],
+            'stars': self.stars(city)
+        }
+        if category is not None:
+            out['category'] = {'category': category, 'distinct_users': round(self.distinct_users(category))}
+        return out
+
+# --- Persistencia en SQLite ---
+def ensure_table(conn):
+    """Crea la tabla de sketches; devuelve True si no existía."""
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (SKETCH_TABLE,)
+    ).fetchone()
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {SKETCH_TABLE} ("
+        "sketch_id INTEGER PRIMARY KEY, source TEXT, created REAL, rows INTEGER, data BLOB NOT NULL)"
+    )
+    return exists is None
+
+def business_lookup(conn):
+    """Ciudad por business_id y pares business_id/category de los negocios cargados."""
+    tables = {r[0] for r in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type='table'")}
+    if 'business' not in tables:
+        return pd.Series(dtype=object), None
+    cities = pd.read_sql("SELECT business_id, city FROM business", conn, index_col='business_id')['city']
+    pairs = None
+    if 'business_category' in tables:
+        pairs = pd.read_sql(
+            "SELECT bc.business_id, c.name AS category FROM business_category bc "
+            "JOIN category c ON c.category_id = bc.category_id", conn
+        )
+        pairs['category'] = pairs['category'].astype('category')
+    return cities, pairs
+
+def save(conn, sketch, source=None, replace=False, sketch_id=None):
+    """Guarda el sketch de una carga; con replace descarta los de cargas anteriores. Con
+    sketch_id reescribe el guardado antes en la misma carga. Devuelve el sketch_id."""
+    ensure_table(conn)
+    if replace:
+        conn.exec_driver_sql(f"DELETE FROM {SKETCH_TABLE}")
+    if sketch_id is not None:
+        conn.exec_driver_sql(
+            f"UPDATE {SKETCH_TABLE} SET rows = ?, data = ? WHERE sketch_id = ?",
+            (sketch.rows, sketch.to_bytes(), sketch_id)
+        )
+        return sketch_id
+    return conn.exec_driver_sql(
+        f"INSERT INTO {SKETCH_TABLE} (source, created, rows, data) VALUES (?, ?, ?, ?)",
+        (source, time.time(), sketch.rows, sketch.to_bytes())
+    ).lastrowid
+
+def load_merged(conn):
+    """Combina los sketches de todas las cargas (de a uno: memoria acotada).
+    Devuelve (sketch, cantidad de cargas)."""
+    merged, uploads = ReviewSketch(), 0
+    result = conn.exec_driver_sql(f"SELECT data FROM {SKETCH_TABLE} ORDER BY sketch_id")
+    for (data,) in result:
+        merged.merge(ReviewSketch.from_bytes(data))
+        uploads += 1
+    return merged, uploads
@@ -0,0 +1,133 @@
+# spatial_index.py
+# Índice espacial en grilla (Web Mercator) para el mapa de negocios.
+# En la ingesta cada punto recibe su celda a resolución fina (gx, gy) y se materializan
+# los clusters de cada nivel de zoom, así /api/markers solo lee las celdas del bbox visible.
+import math
+import numpy as np
+import pandas as pd
+
+# Bits por eje de la grilla fina (2^24 celdas por eje)
+GRID_BITS = 24
+# Celdas de cluster por tile de 256px en cada eje (4 → celdas de ~64px)
+CLUSTER_BITS = 2
+# Hasta este zoom se devuelven clusters; por encima, negocios individuales
+MAX_CLUSTER_ZOOM = 15
+# Máximo de negocios individuales por respuesta
+MARKER_LIMIT = 2000
+MAX_LAT = 85.05112878
+
+def grid_xy(lat, lon):
+    """Celda (gx, gy) de la grilla fina para arrays de latitud/longitud."""
+    lat = np.clip(np.asarray(lat, dtype='float64'), -MAX_LAT, MAX_LAT)
+    lon = np.clip(np.asarray(lon, dtype='float64'), -180.0, 180.0)
+    x = (lon + 180.0) / 360.0
+    rad = np.radians(lat)
+    y = (1.0 - np.log(np.tan(rad) + 1.0 / np.cos(rad)) / math.pi) / 2.0
+    size = 1 << GRID_BITS
+    gx = np.clip((x * size).astype('int64'), 0, size - 1)
+    gy = np.clip((y * size).astype('int64'), 0, size - 1)
+    return gx, gy
+
+def _shift(zoom):
+    return GRID_BITS - (zoom + CLUSTER_BITS)
+
+def ensure_tables(conn):
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS map_point ("
+        "point_id INTEGER PRIMARY KEY, gx INTEGER NOT NULL, gy INTEGER NOT NULL, "
+        "latitude REAL, longitude REAL, business_id TEXT, name TEXT, categories TEXT, city TEXT, reviews REAL)"
+    )
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS idx_map_point_gx_gy ON map_point(gx, gy)")
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS map_cluster ("
+        "zoom INTEGER NOT NULL, cx INTEGER NOT NULL, cy INTEGER NOT NULL, "
+        "businesses INTEGER, reviews REAL, latitude REAL, longitude REAL, "
+        "PRIMARY KEY (zoom, cx, cy))"
+    )
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS map_bounds (south REAL, west REAL, north REAL, east REAL)"
+    )
+
+def index_points(conn, df, replace=False):
+    """Agrega al índice los negocios de df que tienen latitud y longitud."""
+    ensure_tables(conn)
+    if replace:
+        conn.exec_driver_sql("DELETE FROM map_point")
+    if 'latitude' not in df.columns or 'longitude' not in df.columns:
+        return 0
+    lat = pd.to_numeric(df['latitude'], errors='coerce')
+    lon = pd.to_numeric(df['longitude'], errors='coerce')
+    ok = lat.notna() & lon.notna()
+    if not ok.any():
+        return 0
+    if 'review_count' in df.columns:
+        reviews = df['review_count']
+    elif 'reviews' in df.columns:
+        reviews = df['reviews']
+    else:
+        reviews = pd.Series(0, index=df.index)
+    gx, gy = grid_xy(lat[ok], lon[ok])
+    points = pd.DataFrame({
+        'gx': gx,
+        'gy': gy,
+        'latitude': lat[ok].to_numpy(),
+        'longitude': lon[ok].to_numpy(),
+        'business_id': df.loc[ok, 'business_id'].astype(str).to_numpy() if 'business_id' in df.columns else None,
+        'name': df.loc[ok, 'name'].astype(str).to_numpy() if 'name' in df.columns else '',
+        'categories': df.loc[ok, 'categories'].fillna('').astype(str).to_numpy() if 'categories' in df.columns else '',
+        'city': df.loc[ok, 'city'].astype(object).fillna('').astype(str).to_numpy() if 'city' in df.columns else '',
+        'reviews': pd.to_numeric(reviews[ok], errors='coerce').fillna(0).to_numpy()
+    })
+    points.to_sql('map_point', conn, if_exists='append', index=False)
+    return len(points)
+
+def rebuild_clusters(conn):
+    """Materializa los clusters de todos los niveles de zoom a partir de map_point."""
+    ensure_tables(conn)
+    conn.exec_driver_sql("DELETE FROM map_cluster")
+    for zoom in range(MAX_CLUSTER_ZOOM + 1):
+        s = _shift(zoom)
+        conn.exec_driver_sql(
+            f"INSERT INTO map_cluster (zoom, cx, cy, businesses, reviews, latitude, longitude) "
+            f"SELECT {zoom}, gx >> {s}, gy >> {s}, COUNT(*), SUM(reviews), AVG(latitude), AVG(longitude) "
+            f"FROM map_point GROUP BY gx >> {s}, gy >> {s}"
+        )
+    conn.exec_driver_sql("DELETE FROM map_bounds")
+    conn.exec_driver_sql(
+        "INSERT INTO map_bounds SELECT MIN(latitude), MIN(longitude), MAX(latitude), MAX(longitude) "
+        "FROM map_point HAVING COUNT(*) > 0"
+    )
+
+def query_markers(conn, bbox=None, zoom=0):
+    """Clusters (zoom <= MAX_CLUSTER_ZOOM) o negocios individuales dentro del bbox
+    (west, south, east, north). Sin bbox se devuelve el mundo completo."""
+    zoom = max(0, int(zoom))
+    west, south, east, north = bbox if bbox else (-180.0, -MAX_LAT, 180.0, MAX_LAT)
+    (gx0, gx1), (gy1, gy0) = grid_xy([south, north], [west, east])
+    if gx0 > gx1:
+        gx0, gx1 = gx1, gx0
+    bounds = conn.exec_driver_sql("SELECT south, west, north, east FROM map_bounds").fetchone()
+    result = {'zoom': zoom, 'bounds': [[bounds[0], bounds[1]], [bounds[2], bounds[3]]] if bounds else None}
+
+    if zoom <= MAX_CLUSTER_ZOOM:
+        s = _shift(zoom)
+        rows = conn.exec_driver_sql(
+            "SELECT businesses, reviews, latitude, longitude FROM map_cluster "
+            "WHERE zoom = ? AND cx BETWEEN ? AND ? AND cy BETWEEN ? AND ?",
+            (zoom, int(gx0) >> s, int(gx1) >> s, int(gy0) >> s, int(gy1) >> s)
+        ).fetchall()
+        result['clusters'] = [
+            {'lat': lat, 'lon': lon, 'count': n, 'reviews': reviews} for n, reviews, lat, lon in rows
+        ]
+        return result
+
+    rows = conn.exec_driver_sql(
+        "SELECT latitude, longitude, name, categories, reviews, city FROM map_point "
+        "WHERE gx BETWEEN ? AND ? AND gy BETWEEN ? AND ? LIMIT ?",
+        (int(gx0), int(gx1), int(gy0), int(gy1), MARKER_LIMIT)
+    ).fetchall()
+    result['markers'] = [
+        {'lat': lat, 'lon': lon, 'name': name, 'categories': cats, 'reviews': reviews, 'city': city}
+        for lat, lon, name, cats, reviews, city in rows
+    ]
+    return result
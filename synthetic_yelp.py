@@ -0,0 +1,248 @@
+# synthetic_yelp.py
+# Generador determinista de datos sintéticos con el formato del dataset de Yelp
+# (business.json y review.json, un objeto JSON por línea) a cualquier escala.
+# Reproduce los sesgos del dataset real: pocas ciudades y categorías concentran la mayoría
+# de los negocios, pocos negocios concentran la mayoría de las reseñas, el largo de los textos
+# es log-normal, las estrellas se inclinan hacia 4-5 y las reseñas recientes son más frecuentes.
+#
+# Uso: python synthetic_yelp.py --reviews 1000000 --out uploads/synthetic
+import argparse, base64, json, os, time
+import numpy as np
+
+# Codificador JSON rápido si está disponible (orjson), si no el estándar
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, ensure_ascii=False)
+
+# Reseñas por negocio en promedio (en el dataset de Yelp ~7M reseñas / 150k negocios)
+REVIEWS_PER_BUSINESS = 40
+# Reseñas generadas por bloque (memoria acotada a cualquier escala)
+CHUNK_REVIEWS = 100000
+
+# (ciudad, estado, latitud, longitud); el peso decrece según la posición (Zipf)
+CITIES = [
+    ('Philadelphia', 'PA', 39.9526, -75.1652), ('Tucson', 'AZ', 32.2226, -110.9747),
+    ('Tampa', 'FL', 27.9506, -82.4572), ('Indianapolis', 'IN', 39.7684, -86.1581),
+    ('Nashville', 'TN', 36.1627, -86.7816), ('New Orleans', 'LA', 29.9511, -90.0715),
+    ('Reno', 'NV', 39.5296, -119.8138), ('Edmonton', 'AB', 53.5461, -113.4938),
+    ('Saint Louis', 'MO', 38.6270, -90.1994), ('Santa Barbara', 'CA', 34.4208, -119.6982),
+    ('Boise', 'ID', 43.6150, -116.2023), ('Clearwater', 'FL', 27.9659, -82.8001),
+    ('Saint Petersburg', 'FL', 27.7676, -82.6403), ('Metairie', 'LA', 29.9841, -90.1529),
+    ('Sparks', 'NV', 39.5349, -119.7527), ('Wilmington', 'DE', 39.7391, -75.5398),
+    ('Franklin', 'TN', 35.9251, -86.8689), ('St. Louis', 'MO', 38.6270, -90.1994),
+    ('Brandon', 'FL', 27.9378, -82.2859), ('Largo', 'FL', 27.9095, -82.7873),
+    ('Cherry Hill', 'NJ', 39.9348, -75.0307), ('Goleta', 'CA', 34.4358, -119.8276),
+    ('Kenner', 'LA', 29.9941, -90.2417), ('Carmel', 'IN', 39.9784, -86.1180),
+    ('Meridian', 'ID', 43.6121, -116.3915), ('Affton', 'MO', 38.5506, -90.3332),
+]
+
+# Categorías en orden de popularidad aproximado
+CATEGORIES = [
+    'Restaurants', 'Food', 'Shopping', 'Home Services', 'Beauty & Spas', 'Nightlife',
+    'Health & Medical', 'Local Services', 'Bars', 'Automotive', 'Event Planning & Services',
+    'Sandwiches', 'American (Traditional)', 'Active Life', 'Pizza', 'Coffee & Tea', 'Fast Food',
+    'Breakfast & Brunch', 'American (New)', 'Hotels & Travel', 'Home & Garden', 'Fashion',
+    'Burgers', 'Arts & Entertainment', 'Auto Repair', 'Hair Salons', 'Nail Salons', 'Mexican',
+    'Italian', 'Specialty Food', 'Doctors', 'Pets', 'Real Estate', 'Seafood', 'Fitness & Instruction',
+    'Professional Services', 'Hair Removal', 'Desserts', 'Chinese', 'Bakeries', 'Grocery',
+    'Salad', 'Hotels', 'Chicken Wings', 'Cafes', 'Ice Cream & Frozen Yogurt', 'Caterers',
+    'Pet Services', 'Dentists', 'Skin Care', 'Venues & Event Spaces', 'Tires', 'Wine & Spirits',
+    'Beer', 'Delis', 'Waxing', 'Contractors', 'Women\'s Clothing', 'Massage', 'Sports Bars',
+    'General Dentistry', 'Japanese', 'Sushi Bars', 'Cosmetics & Beauty Supply', 'Asian Fusion',
+    'Juice Bars & Smoothies', 'Barbeque', 'Mediterranean', 'Vegetarian', 'Thai', 'Korean',
+    'Indian', 'Vietnamese', 'Gyms', 'Yoga', 'Bookstores', 'Florists', 'Nutritionists',
+    'Shoe Stores', 'Candle Stores', 'Home Decor', 'Acupuncture', 'Breweries', 'Wine Bars',
+]
+
+NAME_WORDS = [
+    'Golden', 'Blue', 'Main Street', 'Corner', 'Happy', 'Urban', 'Old Town', 'Sunset', 'Green',
+    'Royal', 'Little', 'Big', 'Lucky', 'Family', 'Downtown', 'Riverside', 'Star', 'Oak', 'Maple',
+    'Harbor', 'Liberty', 'Union', 'Central', 'Northside', 'Southern', 'Silver', 'Red Door',
+]
+NAME_SUFFIXES = ['Kitchen', 'Grill', 'Market', 'Studio', 'Shop', 'House', 'Co.', 'Cafe', 'Bar', 'Center', 'Place']
+
+# Frases para componer los textos, según el tono de la reseña
+POSITIVE = [
+    'The food was amazing and the staff were super friendly.',
+    'Great service, we will definitely come back.',
+    'Best place in town, highly recommend it.',
+    'Everything was fresh and delicious.',
+    'The atmosphere is cozy and the prices are fair.',
+    'Our server was attentive and the portions were huge.',
+    'I love this place, it never disappoints.',
+    'Excellent quality and very clean.',
+]
+NEGATIVE = [
+    'The service was slow and the food arrived cold.',
+    'Terrible experience, the manager was rude.',
+    'Overpriced for what you get, very disappointing.',
+    'We waited almost an hour and nobody apologized.',
+    'The place was dirty and the staff did not care.',
+    'My order was wrong twice, I will not return.',
+    'Bland food and a noisy room.',
+    'Worst customer service I have had in years.',
+]
+NEUTRAL = [
+    'We came here on a Saturday night with a group of friends.',
+    'Parking can be hard to find on weekends.',
+    'They have a small patio and a few tables inside.',
+    'I ordered the special of the day and a drink.',
+    'The menu changes every season.',
+    'It is located right next to the train station.',
+    'Reservations are recommended for dinner.',
+    'They also offer takeout and delivery.',
+    'The line moved at a normal pace.',
+    'I had been meaning to try this spot for a while.',
+]
+
+# Distribución de estrellas de Yelp (1 a 5): sesgada hacia 4-5
+STAR_WEIGHTS = np.array([0.15, 0.08, 0.10, 0.21, 0.46])
+# Palabras por reseña: log-normal con mediana ~80 (como Yelp), acotada
+TEXT_WORDS_MEDIAN = 80
+TEXT_WORDS_SIGMA = 0.7
+TEXT_WORDS_MAX = 1000
+DATE_START = np.datetime64('2005-01-01')
+DATE_END = np.datetime64('2022-01-19')
+
+def _zipf_weights(n, s=1.1):
+    w = 1.0 / np.arange(1, n + 1) ** s
+    return w / w.sum()
+
+def _ids(rng, n):
+    # ids de 22 caracteres como los de Yelp (16 bytes en base64 url-safe)
+    raw = rng.bytes(16 * n)
+    return [base64.urlsafe_b64encode(raw[i:i + 16]).decode('ascii')[:22] for i in range(0, 16 * n, 16)]
+
+def _business_rows(rng, ids, review_counts):
+    n = len(ids)
+    city_idx = rng.choice(len(CITIES), size=n, p=_zipf_weights(len(CITIES)))
+    cat_weights = _zipf_weights(len(CATEGORIES), s=0.9)
+    n_cats = rng.integers(1, 6, size=n)
+    cat_draws = rng.choice(len(CATEGORIES), size=(n, 5), p=cat_weights)
+    name_a = rng.integers(0, len(NAME_WORDS), size=n)
+    name_b = rng.integers(0, len(NAME_SUFFIXES), size=n)
+    dlat = rng.normal(0, 0.06, size=n)
+    dlon = rng.normal(0, 0.08, size=n)
+    stars = np.round(np.clip(rng.normal(3.7, 0.8, size=n), 1, 5) * 2) / 2
+    is_open = rng.random(n) < 0.8
+    street = rng.integers(1, 9999, size=n)
+    postal = rng.integers(10000, 99999, size=n)
+    for i in range(n):
+        city, state, lat, lon = CITIES[city_idx[i]]
+        cats = list(dict.fromkeys(CATEGORIES[c] for c in cat_draws[i, :n_cats[i]]))
+        yield {
+            'business_id': ids[i],
+            'name': f'{NAME_WORDS[name_a[i]]} {NAME_SUFFIXES[name_b[i]]}',
+            'address': f'{street[i]} Main St',
+            'city': city,
+            'state': state,
+            'postal_code': str(postal[i]),
+            'latitude': round(lat + float(dlat[i]), 7),
+            'longitude': round(lon + float(dlon[i]), 7),
+            'stars': float(stars[i]),
+            'review_count': int(review_counts[i]),
+            'is_open': int(is_open[i]),
+            'attributes': None,
+            'categories': ', '.join(cats),
+            'hours': None
+        }
+
+def _texts(rng, stars):
+    # cada reseña se arma con frases; la proporción positiva/negativa depende de las estrellas
+    n = len(stars)
+    words = np.clip(rng.lognormal(np.log(TEXT_WORDS_MEDIAN), TEXT_WORDS_SIGMA, size=n), 5, TEXT_WORDS_MAX)
+    n_sentences = np.maximum(1, (words / 9).astype(int))
+    p_positive = (stars - 1) / 4.0
+    texts = []
+    for i in range(n):
+        k = n_sentences[i]
+        tone = rng.random(k)
+        pick = rng.integers(0, 1 << 30, size=k)
+        parts = []
+        for t, p in zip(tone, pick):
+            if t < 0.4:
+                parts.append(NEUTRAL[p % len(NEUTRAL)])
+            elif t < 0.4 + 0.6 * p_positive[i]:
+                parts.append(POSITIVE[p % len(POSITIVE)])
+            else:
+                parts.append(NEGATIVE[p % len(NEGATIVE)])
+        texts.append(' '.join(parts))
+    return texts
+
+def _dates(rng, n):
+    # más reseñas en los años recientes (beta sesgada hacia el final del rango)
+    span = (DATE_END - DATE_START).astype('timedelta64[s]').astype(np.int64)
+    offsets = (rng.beta(2.5, 1.2, size=n) * span).astype(np.int64)
+    return (DATE_START + offsets.astype('timedelta64[s]')).astype(str)
+
+def generate(out_dir, n_reviews=10000, n_businesses=None, seed=0):
+    """Escribe business.json y review.json en out_dir. Con la misma semilla y tamaños
+    el resultado es idéntico byte a byte. Devuelve un dict con conteos y rutas."""
+    started = time.time()
+    os.makedirs(out_dir, exist_ok=True)
+    n_businesses = n_businesses or max(10, n_reviews // REVIEWS_PER_BUSINESS)
+    rng = np.random.default_rng(seed)
+
+    business_ids = _ids(rng, n_businesses)
+    # popularidad por negocio (cola larga): pocos negocios reciben la mayoría de las reseñas
+    popularity = rng.pareto(1.2, size=n_businesses) + 1
+    popularity /= popularity.sum()
+    counts = rng.multinomial(n_reviews, popularity)
+
+    business_path = os.path.join(out_dir, 'business.json')
+    with open(business_path, 'w', encoding='utf-8') as f:
+        for row in _business_rows(rng, business_ids, counts):
+            f.write(_dumps(row) + '\n')
+
+    # las reseñas se reparten en orden aleatorio entre negocios, por bloques
+    owner = np.repeat(np.arange(n_businesses), counts)
+    rng.shuffle(owner)
+    review_path = os.path.join(out_dir, 'review.json')
+    with open(review_path, 'w', encoding='utf-8') as f:
+        for start in range(0, n_reviews, CHUNK_REVIEWS):
+            idx = owner[start:start + CHUNK_REVIEWS]
+            n = len(idx)
+            review_ids = _ids(rng, n)
+            user_ids = _ids(rng, n)
+            stars = rng.choice(np.arange(1, 6), size=n, p=STAR_WEIGHTS).astype(float)
+            texts = _texts(rng, stars)
+            dates = _dates(rng, n)
+            votes = rng.poisson(0.8, size=(n, 3))
+            for i in range(n):
+                f.write(_dumps({
+                    'review_id': review_ids[i],
+                    'user_id': user_ids[i],
+                    'business_id': business_ids[idx[i]],
+                    'stars': float(stars[i]),
+                    'useful': int(votes[i, 0]),
+                    'funny': int(votes[i, 1]),
+                    'cool': int(votes[i, 2]),
+                    'text': texts[i],
+                    'date': dates[i].replace('T', ' ')
+                }) + '\n')
+
+    return {
+        'businesses': n_businesses,
+        'reviews': n_reviews,
+        'business_path': business_path,
+        'review_path': review_path,
+        'seconds': round(time.time() - started, 2)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Genera datos sintéticos con formato Yelp.')
+    parser.add_argument('--reviews', type=int, default=10000, help='cantidad de reseñas (10k a 10M)')
+    parser.add_argument('--businesses', type=int, default=None, help=f'cantidad de negocios (por defecto reseñas / {REVIEWS_PER_BUSINESS})')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=os.path.join('uploads', 'synthetic'))
+    args = parser.parse_args()
+
+    info = generate(args.out, n_reviews=args.reviews, n_businesses=args.businesses, seed=args.seed)
+    print(f"✅ {info['businesses']} negocios y {info['reviews']} reseñas en {info['seconds']} s")
+    print(f"   - {info['business_path']}")
+    print(f"   - {info['review_path']}")
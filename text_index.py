@@ -0,0 +1,136 @@
+# text_index.py
+# Índice de texto completo (SQLite FTS5) sobre el texto de las reseñas, mantenido en la
+# ingesta: antes de escribir un lote se quitan del índice sus reseñas actuales y después se
+# agregan con el texto nuevo. La tabla FTS usa review como contenido externo (no duplica el
+# texto) y se relaciona por rowid; las búsquedas de un término no recorren la tabla review.
+import re
+import pandas as pd
+
+FTS_TABLE = 'review_fts'
+KEYS_TABLE = '_fts_keys'
+
+# unicode61 sin acentos + stemming en inglés (porter): "vegan" también encuentra "vegans"
+TOKENIZE = 'porter unicode61 remove_diacritics 2'
+
+# Fragmentos: marcas alrededor de los términos encontrados y cantidad de tokens
+SNIPPET_MARKS = ('[', ']')
+SNIPPET_TOKENS = 16
+
+# mes 'YYYY-MM' (las fechas se guardan como texto ISO); '' si la reseña no tiene fecha
+_MONTH = "COALESCE(substr(r.date, 1, 7), '')"
+
+def ensure_table(conn):
+    """Crea la tabla FTS; devuelve True si no existía (hay que indexar las reseñas ya cargadas)."""
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (FTS_TABLE,)
+    ).fetchone()
+    if exists is None:
+        conn.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(text, content='review', content_rowid='rowid', "
+            f"tokenize='{TOKENIZE}')"
+        )
+    return exists is None
+
+def is_built(conn):
+    """True si existe el índice (las búsquedas no lo construyen)."""
+    return conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (FTS_TABLE,)
+    ).fetchone() is not None
+
+def rebuild(conn):
+    """Indexa desde cero el texto de la tabla review."""
+    conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+def clear(conn):
+    # sin leer el contenido: sirve aunque la tabla review ya se haya reemplazado
+    conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+
+def begin_batch(conn, keys):
+    """Antes de escribir un lote de reseñas: quita del índice el texto actual de sus review_id."""
+    pd.DataFrame({'review_id': pd.Series(keys).dropna().astype(str).unique()}).to_sql(
+        KEYS_TABLE, conn, if_exists='replace', index=False
+    )
+    # con contenido externo hay que pasar el texto indexado para borrarlo
+    conn.exec_driver_sql(
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) "
+        f"SELECT 'delete', r.rowid, r.text FROM review r JOIN {KEYS_TABLE} k ON k.review_id = r.review_id "
+        "WHERE r.text IS NOT NULL"
+    )
+
+def end_batch(conn):
+    """Después de escribir el lote: indexa el texto nuevo de sus reseñas."""
+    conn.exec_driver_sql(
+        f"INSERT INTO {FTS_TABLE}(rowid, text) "
+        f"SELECT r.rowid, r.text FROM review r JOIN {KEYS_TABLE} k ON k.review_id = r.review_id "
+        "WHERE r.text IS NOT NULL"
+    )
+    conn.exec_driver_sql(f"DROP TABLE {KEYS_TABLE}")
+
+_TERM_RE = re.compile(r'"([^"]*)"|(\w+\*?)', re.UNICODE)
+
+def match_expression(q):
+    """Convierte el texto del usuario en una consulta FTS5 segura: cada palabra (o "frase
+    entre comillas") es un término y deben aparecer todos; palabra* busca por prefijo.
+    ValueError si no queda ningún término."""
+    terms = []
+    for phrase, word in _TERM_RE.findall(q or ''):
+        if phrase.strip():
+            words = re.findall(r'\w+', phrase, re.UNICODE)
+            if words:
+                terms.append('"' + ' '.join(words) + '"')
+        elif word:
+            prefix = word.endswith('*')
+            terms.append('"' + word.rstrip('*') + '"' + ('*' if prefix else ''))
+    if not terms:
+        raise ValueError('empty search query')
+    return ' '.join(terms)
+
+# reseñas y suma de estrellas de las coincidencias por negocio (agrupar antes de cruzar con
+# categorías y ciudades evita un join por reseña)
+_PER_BUSINESS = (
+    "WITH hits AS MATERIALIZED ("
+    "  SELECT r.business_id, COUNT(*) AS n, TOTAL(r.stars) AS stars_sum "
+    f"  FROM {FTS_TABLE} JOIN review r ON r.rowid = {FTS_TABLE}.rowid "
+    f"  WHERE {FTS_TABLE} MATCH ? GROUP BY r.business_id"
+    ") "
+)
+
+def _counts(conn, match, group, joins, top):
+    return pd.read_sql(
+        f"{_PER_BUSINESS}SELECT {group} AS value, SUM(h.n) AS reviews, SUM(h.stars_sum) / SUM(h.n) AS avg_stars "
+        f"FROM hits h {joins} GROUP BY 1 ORDER BY reviews DESC, value LIMIT ?",
+        conn, params=(match, int(top))
+    )
+
+def search(conn, match, top=20, limit=10):
+    """Reseñas que cumplen la consulta FTS5 match: total, conteos por categoría y ciudad (las
+    top de cada una), serie mensual y los limit fragmentos mejor rankeados (score: bm25,
+    mayor es más relevante)."""
+    categories = _counts(
+        conn, match, "c.name",
+        "JOIN business_category bc ON bc.business_id = h.business_id "
+        "JOIN category c ON c.category_id = bc.category_id", top
+    )
+    cities = _counts(conn, match, "COALESCE(b.city, '')", "LEFT JOIN business b ON b.business_id = h.business_id", top)
+    months = pd.read_sql(
+        f"SELECT {_MONTH} AS month, COUNT(*) AS reviews, AVG(r.stars) AS avg_stars "
+        f"FROM {FTS_TABLE} JOIN review r ON r.rowid = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH ? GROUP BY 1 ORDER BY 1",
+        conn, params=(match,)
+    )
+    open_mark, close_mark = SNIPPET_MARKS
+    snippets = pd.read_sql(
+        f"SELECT r.review_id, r.business_id, b.name, b.city, r.stars, r.date, "
+        f"       snippet({FTS_TABLE}, 0, ?, ?, '…', {SNIPPET_TOKENS}) AS snippet, -bm25({FTS_TABLE}) AS score "
+        f"FROM {FTS_TABLE} JOIN review r ON r.rowid = {FTS_TABLE}.rowid "
+        "LEFT JOIN business b ON b.business_id = r.business_id "
+        f"WHERE {FTS_TABLE} MATCH ? ORDER BY rank LIMIT ?",
+        conn, params=(open_mark, close_mark, match, int(limit))
+    )
+    return {
+        'reviews': int(months['reviews'].sum()),
+        'categories': categories.rename(columns={'value': 'category'}),
+        'cities': cities.rename(columns={'value': 'city'}),
+        'months': months[months['month'] != ''].reset_index(drop=True),
+        'snippets': snippets
+    }
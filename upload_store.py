@@ -0,0 +1,210 @@
+# upload_store.py
+# Archivos subidos guardados por contenido: cada archivo queda en uploads/<sha256>/<nombre>,
+# con el SHA-256 calculado mientras se escribe a disco (sin una segunda lectura). El mismo
+# contenido se guarda una sola vez aunque se suba varias veces o con otro nombre.
+# Las cargas por partes (archivos Yelp de varios GB) se escriben en uploads/partial y se pueden
+# reanudar desde el último byte recibido, aunque cada parte la atienda otro worker.
+import hashlib, json, os, re, shutil, threading, time, uuid, fcntl
+from contextlib import contextmanager
+from pathlib import Path
+
+upload_folder = Path(__file__).parent / 'uploads'
+tmp_folder = upload_folder / 'tmp'
+partial_folder = upload_folder / 'partial'
+
+# Tamaño de los bloques que se leen del cuerpo de la petición
+CHUNK_SIZE = 1024 * 1024
+
+# Cargas por partes sin actividad durante este tiempo se descartan (segundos)
+PARTIAL_TTL = int(os.environ.get('DSS_UPLOAD_PARTIAL_TTL', 7 * 24 * 3600))
+
+_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+class HashingFile:
+    """Archivo temporal que calcula el SHA-256 de lo que se escribe (Werkzeug escribe aquí
+    cada archivo de un multipart a medida que llega, ver app.UploadRequest)."""
+
+    def __init__(self):
+        tmp_folder.mkdir(parents=True, exist_ok=True)
+        self.path = tmp_folder / uuid.uuid4().hex
+        self._file = open(self.path, 'w+b')
+        self._sha = hashlib.sha256()
+
+    def write(self, data):
+        self._sha.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha.hexdigest()
+
+    def __getattr__(self, name):
+        # read, seek, tell, close... del archivo real
+        return getattr(self._file, name)
+
+def object_path(digest, filename):
+    return upload_folder / digest / filename
+
+def _store(tmp_path, digest, filename):
+    # mueve el archivo a su lugar por contenido; si ya existía se descarta la copia nueva
+    # (con otro nombre se enlaza al mismo contenido)
+    target = object_path(digest, filename)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    existing = next((p for p in target.parent.iterdir() if p.is_file()), None)
+    if existing is None:
+        os.replace(tmp_path, target)
+        return target
+    os.remove(tmp_path)
+    if not target.exists():
+        try:
+            os.link(existing, target)
+        except OSError:
+            shutil.copyfile(existing, target)
+    return target
+
+def commit(hashing_file, filename):
+    """Guarda un HashingFile ya escrito; devuelve (ruta, sha256)."""
+    hashing_file.close()
+    digest = hashing_file.hexdigest()
+    return _store(hashing_file.path, digest, filename), digest
+
+def discard(hashing_file):
+    """Descarta un HashingFile que no se va a guardar (p. ej. un campo de archivo vacío)."""
+    hashing_file.close()
+    hashing_file.path.unlink(missing_ok=True)
+
+def save_stream(stream, filename):
+    """Escribe un stream binario (p. ej. el cuerpo de la petición) calculando su SHA-256."""
+    out = HashingFile()
+    try:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            out.write(chunk)
+    except BaseException:
+        discard(out)
+        raise
+    return commit(out, filename)
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+# --- Cargas por partes ---
+# El hash se va calculando en el proceso que recibe las partes en orden; si una parte llega a
+# otro worker (o después de un reinicio) se recalcula leyendo el archivo al final. Cada parte se
+# escribe con un flock sobre el .part, así dos workers no agregan bytes en el mismo offset.
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+def _partial_paths(upload_id):
+    if not _ID_RE.match(upload_id or ''):
+        return None, None
+    return partial_folder / f'{upload_id}.part', partial_folder / f'{upload_id}.json'
+
+@contextmanager
+def _locked_part(upload_id):
+    # el .part abierto y bloqueado; KeyError si la carga no existe o otro worker ya la cerró
+    data, meta = _partial_paths(upload_id)
+    try:
+        f = open(data, 'r+b') if data is not None else None
+    except FileNotFoundError:
+        f = None
+    if f is None:
+        raise KeyError(upload_id)
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if not meta.exists():
+                raise KeyError(upload_id)
+            f.seek(0, os.SEEK_END)
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _expire():
+    # cargas por partes abandonadas y temporales de peticiones que no terminaron
+    now = time.time()
+    for path in [*tmp_folder.glob('*'), *partial_folder.glob('*')]:
+        try:
+            if now - path.stat().st_mtime > PARTIAL_TTL:
+                path.unlink(missing_ok=True)
+        except FileNotFoundError:
+            # otro worker lo borró primero
+            pass
+
+def start(filename, size=None):
+    """Inicia una carga por partes; devuelve su id."""
+    partial_folder.mkdir(parents=True, exist_ok=True)
+    _expire()
+    upload_id = uuid.uuid4().hex
+    data, meta = _partial_paths(upload_id)
+    data.touch()
+    meta.write_text(json.dumps({'filename': filename, 'size': size, 'created': time.time()}))
+    return upload_id
+
+def status(upload_id):
+    """Nombre, tamaño esperado y offset (bytes recibidos) de la carga, o None si no existe."""
+    data, meta = _partial_paths(upload_id)
+    if meta is None or not meta.exists() or not data.exists():
+        return None
+    info = json.loads(meta.read_text())
+    return dict(info, upload_id=upload_id, offset=data.stat().st_size)
+
+def append(upload_id, offset, stream):
+    """Agrega el stream a la carga a partir de offset; devuelve el nuevo offset.
+    ValueError si offset no coincide con los bytes ya recibidos (el cliente debe reanudar
+    desde status()['offset']) o si se supera el tamaño declarado."""
+    info = status(upload_id)
+    if info is None:
+        raise KeyError(upload_id)
+    with _locked_part(upload_id) as f:
+        received = f.tell()
+        if offset != received:
+            raise ValueError(f"offset mismatch: {received} bytes received")
+        with _hashers_lock:
+            # se vuelve a guardar solo si la parte se escribe completa
+            hasher = _hashers.pop(upload_id, None)
+        if hasher is not None and hasher[0] == offset:
+            sha = hasher[1].copy()
+        else:
+            # primera parte en este proceso: solo se puede seguir el hash si empieza en 0
+            sha = hashlib.sha256() if offset == 0 else None
+        written = offset
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                if info['size'] is not None and written + len(chunk) > info['size']:
+                    f.truncate(offset)
+                    raise ValueError(f"upload exceeds declared size of {info['size']} bytes")
+                f.write(chunk)
+                if sha is not None:
+                    sha.update(chunk)
+                written += len(chunk)
+        finally:
+            # si la parte se corta, lo recibido queda en disco y finish() recalcula el hash
+            f.flush()
+        if sha is not None:
+            with _hashers_lock:
+                _hashers[upload_id] = (written, sha)
+    return written
+
+def finish(upload_id):
+    """Cierra la carga por partes y la guarda por contenido; devuelve (ruta, sha256, nombre).
+    ValueError si faltan bytes del tamaño declarado."""
+    info = status(upload_id)
+    if info is None:
+        raise KeyError(upload_id)
+    data, meta = _partial_paths(upload_id)
+    with _locked_part(upload_id) as f:
+        received = f.tell()
+        if info['size'] is not None and received != info['size']:
+            raise ValueError(f"incomplete upload: {received} of {info['size']} bytes received")
+        with _hashers_lock:
+            hasher = _hashers.pop(upload_id, None)
+        if hasher is not None and hasher[0] == received:
+            digest = hasher[1].hexdigest()
+        else:
+            digest = file_sha256(data)
+        path = _store(data, digest, info['filename'])
+        meta.unlink(missing_ok=True)
+    return path, digest, info['filename']
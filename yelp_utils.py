@@ -1,44 +1,194 @@
-import json
+import json, mmap, os
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-def extract_business_table(business_json_path, nrows=None):
+# Decodificador JSON rápido si está disponible (orjson), si no el estándar
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Tamaño de lote por defecto para la ingesta por streaming
+BATCH_SIZE = 50000
+
+# Procesos para leer archivos NDJSON grandes en paralelo (1 = lectura secuencial)
+PARSE_WORKERS = int(os.environ.get('DSS_PARSE_WORKERS', 1))
+# Tamaño aproximado de cada fragmento del archivo que procesa un worker
+SHARD_BYTES = 64 * 1024 * 1024
+
+# Esquema compacto de los DataFrames Yelp: ids únicos y textos como cadenas Arrow (un solo buffer
+# en vez de un objeto Python por valor), valores repetidos como categóricos, enteros y
+# flotantes de 32 bits y fechas como datetime64
+STRING = pd.StringDtype('pyarrow')
+BUSINESS_DTYPES = {
+    'business_id': STRING,
+    'name': STRING,
+    'categories': STRING,
+    'review_count': 'int32',
+    'city': 'category',
+    'latitude': 'float32',
+    'longitude': 'float32'
+}
+REVIEW_DTYPES = {
+    'review_id': STRING,
+    'business_id': 'category',
+    'user_id': 'category',
+    'stars': 'float32',
+    'date': 'datetime64[ns]',
+    'text': STRING
+}
+# Columnas pesadas que solo se cargan cuando se piden explícitamente (etapas de NLP)
+LAZY_COLUMNS = {'review': ['text']}
+
+def _business_row(j):
+    # Yelp trae latitude/longitude en la raíz; algunos exports los anidan en coordinates
+    coords = j.get('coordinates') or {}
+    cats = j.get('categories')
+    if isinstance(cats, list):
+        cats = ", ".join(cats)
+    return {
+        'business_id': j.get('business_id'),
+        'name': j.get('name'),
+        'categories': cats,
+        'review_count': j.get('review_count', 0),
+        'city': j.get('city', ''),
+        'latitude': j.get('latitude', coords.get('latitude')),
+        'longitude': j.get('longitude', coords.get('longitude'))
+    }
+
+def _review_row(j):
+    return {
+        'review_id': j.get('review_id'),
+        'business_id': j.get('business_id'),
+        'user_id': j.get('user_id'),
+        'stars': j.get('stars'),
+        'date': j.get('date'),
+        'text': j.get('text')
+    }
+
+def _iter_batches(json_path, row_fn, batch_size=BATCH_SIZE, nrows=None):
+    """Lee un archivo NDJSON y produce DataFrames de como máximo batch_size filas."""
     rows = []
-    p = Path(business_json_path)
-    with p.open('r', encoding='utf-8') as f:
+    p = Path(json_path)
+    with p.open('rb') as f:
         for i, line in enumerate(f):
             if nrows and i >= nrows:
                 break
-            j = json.loads(line)
-            coords = j.get('coordinates') or {}
-            cats = j.get('categories')
-            if isinstance(cats, list):
-                cats = ", ".join(cats)
-            rows.append({
-                'business_id': j.get('business_id'),
-                'name': j.get('name'),
-                'categories': cats,
-                'review_count': j.get('review_count', 0),
-                'city': j.get('city', ''),
-                'latitude': coords.get('latitude'),
-                'longitude': coords.get('longitude')
-            })
-    return pd.DataFrame(rows)
-
-def extract_reviews_table(review_json_path, nrows=None):
-    rows = []
-    p = Path(review_json_path)
-    with p.open('r', encoding='utf-8') as f:
-        for i, line in enumerate(f):
-            if nrows and i >= nrows:
+            if not line.strip():
+                continue
+            rows.append(row_fn(_loads(line)))
+            if len(rows) >= batch_size:
+                yield pd.DataFrame(rows)
+                rows = []
+    if rows:
+        yield pd.DataFrame(rows)
+
+def shard_ranges(json_path, n_shards):
+    """Divide el archivo en n_shards rangos de bytes [inicio, fin) alineados a fin de línea."""
+    size = os.path.getsize(json_path)
+    bounds = [0]
+    with open(json_path, 'rb') as f:
+        for k in range(1, n_shards):
+            pos = max(size * k // n_shards, bounds[-1])
+            if pos >= size:
                 break
-            j = json.loads(line)
-            rows.append({
-                'review_id': j.get('review_id'),
-                'business_id': j.get('business_id'),
-                'user_id': j.get('user_id'),
-                'stars': j.get('stars'),
-                'date': j.get('date'),
-                'text': j.get('text')
-            })
-    return pd.DataFrame(rows)
+            f.seek(pos)
+            f.readline()  # completa la línea en curso: el corte queda después de un salto de línea
+            if f.tell() > bounds[-1]:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+def _parse_shard(json_path, start, end, row_fn, batch_size):
+    # se ejecuta en un proceso del pool: recorre su rango con mmap (sin copiar el archivo)
+    frames, rows = [], []
+    with open(json_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        pos = start
+        while pos < end:
+            nl = m.find(b'\n', pos, end)
+            line_end = end if nl == -1 else nl
+            line = m[pos:line_end]
+            pos = line_end + 1
+            if not line.strip():
+                continue
+            rows.append(row_fn(_loads(line)))
+            if len(rows) >= batch_size:
+                frames.append(pd.DataFrame(rows))
+                rows = []
+    if rows:
+        frames.append(pd.DataFrame(rows))
+    return frames
+
+def _iter_batches_parallel(json_path, row_fn, batch_size, workers):
+    """Como _iter_batches pero procesando fragmentos del archivo en un pool de procesos.
+    Los lotes salen en el orden del archivo; a lo sumo 2 fragmentos por worker en vuelo."""
+    size = os.path.getsize(json_path)
+    n_shards = max(workers, -(-size // SHARD_BYTES))
+    ranges = shard_ranges(json_path, n_shards)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for start, end in ranges:
+            pending.append(pool.submit(_parse_shard, str(json_path), start, end, row_fn, batch_size))
+            if len(pending) >= 2 * workers:
+                yield from pending.pop(0).result()
+        for future in pending:
+            yield from future.result()
+
+def _batches(json_path, row_fn, batch_size, nrows, workers):
+    workers = PARSE_WORKERS if workers is None else workers
+    # con nrows se lee en secuencia (el corte depende del número de línea)
+    if workers > 1 and not nrows:
+        return _iter_batches_parallel(json_path, row_fn, batch_size, workers)
+    return _iter_batches(json_path, row_fn, batch_size=batch_size, nrows=nrows)
+
+def iter_business_batches(business_json_path, batch_size=BATCH_SIZE, nrows=None, workers=None):
+    return _batches(business_json_path, _business_row, batch_size, nrows, workers)
+
+def iter_reviews_batches(review_json_path, batch_size=BATCH_SIZE, nrows=None, workers=None):
+    return _batches(review_json_path, _review_row, batch_size, nrows, workers)
+
+def explode_categories(df, col='categories'):
+    """Separa la columna categories en una fila por categoría (vectorizado, conserva el índice).
+    Una categoría repetida en la misma fila se cuenta una vez, como en business_category."""
+    s = df[col].fillna('').astype(str).str.split(',').explode().str.strip()
+    s = s[s != '']
+    return s[~pd.MultiIndex.from_arrays([s.index, s]).duplicated()]
+
+def compact_frame(df, dtypes):
+    """Convierte las columnas presentes de df a los tipos compactos del esquema."""
+    out = {}
+    for col, dtype in dtypes.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        s = df[col]
+        if dtype == 'int32':
+            s = pd.to_numeric(s, errors='coerce').fillna(0)
+        elif dtype == 'float32':
+            s = pd.to_numeric(s, errors='coerce')
+        elif dtype == 'datetime64[ns]':
+            out[col] = pd.to_datetime(s, errors='coerce')
+            continue
+        elif dtype == STRING or dtype == 'category':
+            s = s.where(s.isna(), s.astype(str))
+        out[col] = s.astype(dtype)
+    return df.assign(**out) if out else df
+
+def _concat(batches, dtypes=None):
+    frames = list(batches)
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    return compact_frame(df, dtypes) if dtypes else df
+
+# compact=False devuelve los valores tal como vienen en el archivo (coordenadas float64, fechas
+# como texto): es lo que se guarda en SQLite, CSV, snapshots e histórico. Los tipos compactos
+# (float32 pierde precisión en las coordenadas) son solo para trabajar en memoria.
+def extract_business_table(business_json_path, nrows=None, workers=None, compact=True):
+    batches = iter_business_batches(business_json_path, nrows=nrows, workers=workers)
+    return _concat(batches, BUSINESS_DTYPES if compact else None)
+
+def extract_reviews_table(review_json_path, nrows=None, workers=None, compact=True):
+    batches = iter_reviews_batches(review_json_path, nrows=nrows, workers=workers)
+    return _concat(batches, REVIEW_DTYPES if compact else None)